@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the installed WebSocket message decoders.
+
+Decodes a mix of synthetic full channel messages with every decoder in
+copra.websocket.decoders.DECODERS, plus the standard library parsing bytes
+directly.
+
+Usage (from the project root)::
+
+    PYTHONPATH=. python benchmarks/bench_decoders.py [number of messages]
+"""
+
+import json
+import sys
+import time
+import uuid
+
+from copra.websocket.decoders import DECODERS
+
+
+def make_payloads(count):
+    templates = [
+        {'type': 'received', 'order_type': 'limit', 'side': 'buy',
+         'size': '0.01000000', 'price': '6500.01000000'},
+        {'type': 'open', 'side': 'sell', 'price': '6500.02000000',
+         'remaining_size': '1.25000000'},
+        {'type': 'done', 'side': 'buy', 'reason': 'canceled',
+         'price': '6499.99000000', 'remaining_size': '0.50000000'},
+        {'type': 'match', 'side': 'sell', 'size': '0.00500000',
+         'price': '6500.02000000', 'trade_id': 1234567,
+         'maker_order_id': str(uuid.uuid4()),
+         'taker_order_id': str(uuid.uuid4())},
+    ]
+    payloads = []
+    for sequence in range(count):
+        msg = dict(templates[sequence % len(templates)])
+        msg.update({'product_id': 'BTC-USD', 'sequence': 7000000000 + sequence,
+                    'time': '2019-01-07T23:41:39.123456Z',
+                    'order_id': str(uuid.uuid4())})
+        payloads.append(json.dumps(msg).encode('utf8'))
+    return payloads
+
+
+def bench(decode, payloads):
+    start = time.perf_counter()
+    for payload in payloads:
+        decode(payload)
+    return len(payloads) / (time.perf_counter() - start)
+
+
+def main(count):
+    payloads = make_payloads(count)
+    decoders = dict(DECODERS)
+    decoders['json (bytes)'] = json.loads
+    for name, decode in sorted(decoders.items()):
+        print('{:<12} {:>12,.0f} messages/sec'.format(name,
+                                                      bench(decode, payloads)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Load test the WebSocket client against a local feed server.
+
+Runs copra.websocket.server.FeedServer in a child process, streaming
+synthetic full channel messages at the given rate, and counts the messages
+a Client receives and dispatches for the given number of seconds.
+
+Usage (from the project root)::
+
+    PYTHONPATH=. python benchmarks/bench_feed.py [rate] [seconds]
+
+A rate of 0 streams as fast as the client reads.
+"""
+
+import asyncio
+import multiprocessing
+import sys
+import time
+
+from copra.websocket import Channel, Client
+from copra.websocket.server import FeedServer
+
+
+def serve(rate, ports):
+    loop = asyncio.new_event_loop()
+    server = FeedServer(loop, rate=rate or None)
+    loop.run_until_complete(server.start())
+    ports.put(server.port)
+    loop.run_forever()
+
+
+class Counter(Client):
+
+    received = 0
+
+    def on_message(self, message):
+        self.received += 1
+
+
+def main(rate, seconds):
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(rate, ports),
+                                      daemon=True)
+    process.start()
+    port = ports.get()
+
+    loop = asyncio.get_event_loop()
+    client = Counter(loop, Channel('full', ['BTC-USD', 'ETH-USD']),
+                     feed_url='ws://127.0.0.1:{}'.format(port))
+
+    async def measure():
+        await client.connected.wait()
+        await asyncio.sleep(1)
+        received, start = client.received, time.perf_counter()
+        await asyncio.sleep(seconds)
+        count = client.received - received
+        elapsed = time.perf_counter() - start
+        await client.close()
+        return count, elapsed
+
+    count, elapsed = loop.run_until_complete(measure())
+    process.terminate()
+    print('rate {:>9}: {:>9,} messages in {:.1f}s, {:>9,.0f} msg/s'.format(
+        rate or 'max', count, elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 0,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 5.0)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark copra.book.L2Book against synthetic level2 traffic.
+
+Usage (from the project root)::
+
+    PYTHONPATH=. python benchmarks/bench_level2.py [number of updates]
+"""
+
+import random
+import sys
+import time
+
+from copra.book import L2Book
+
+
+def make_updates(count, mid=6500.0, tick=0.01, levels=2000, seed=0):
+    rnd = random.Random(seed)
+    updates = []
+    for _ in range(count):
+        side = rnd.choice(('buy', 'sell'))
+        offset = int(rnd.expovariate(1 / 20.0)) % levels + 1
+        price = mid - offset * tick if side == 'buy' else mid + offset * tick
+        size = '0' if rnd.random() < 0.3 else '{:.8f}'.format(rnd.random() * 5)
+        updates.append({'type': 'l2update', 'product_id': 'BTC-USD',
+                        'changes': [[side, '{:.2f}'.format(price), size]]})
+    return updates
+
+
+def main(count):
+    book = L2Book('BTC-USD')
+    bids = [['{:.2f}'.format(6500 - i * 0.01), '1'] for i in range(1, 2001)]
+    asks = [['{:.2f}'.format(6500 + i * 0.01), '1'] for i in range(1, 2001)]
+    book.process({'type': 'snapshot', 'product_id': 'BTC-USD',
+                  'bids': bids, 'asks': asks})
+    updates = make_updates(count)
+
+    start = time.perf_counter()
+    for update in updates:
+        book.process(update)
+        book.best_bid
+        book.best_ask
+    elapsed = time.perf_counter() - start
+
+    print('{} updates in {:.3f}s: {:,.0f} updates/sec'.format(
+        count, elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark copra.book.L3Book throughput and memory use.
+
+Usage (from the project root)::
+
+    PYTHONPATH=. python benchmarks/bench_level3.py [number of orders]
+"""
+
+import random
+import sys
+import time
+import uuid
+
+from copra.book import L3Book
+
+
+def main(count):
+    rnd = random.Random(0)
+    ids = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(count)]
+    bids = [['{:.2f}'.format(6500 - rnd.randint(1, 2000) * 0.01),
+             '{:.8f}'.format(rnd.random()), order_id]
+            for order_id in ids[:count // 2]]
+    asks = [['{:.2f}'.format(6500 + rnd.randint(1, 2000) * 0.01),
+             '{:.8f}'.format(rnd.random()), order_id]
+            for order_id in ids[count // 2:]]
+
+    book = L3Book('BTC-USD')
+    start = time.perf_counter()
+    book.load_snapshot({'sequence': 0, 'bids': bids, 'asks': asks})
+    elapsed = time.perf_counter() - start
+    print('loaded {} orders in {:.3f}s, {:,} bytes ({:.0f} bytes/order)'.format(
+        count, elapsed, book.nbytes, book.nbytes / count))
+
+    messages = []
+    for sequence, (price, size, order_id) in enumerate(bids, 1):
+        if sequence % 2:
+            messages.append({'type': 'done', 'product_id': 'BTC-USD',
+                             'sequence': sequence, 'order_id': order_id,
+                             'reason': 'canceled'})
+        else:
+            messages.append({'type': 'open', 'product_id': 'BTC-USD',
+                             'sequence': sequence, 'order_id': order_id + 'x',
+                             'side': 'buy', 'price': price,
+                             'remaining_size': size})
+
+    start = time.perf_counter()
+    for message in messages:
+        book.process(message)
+    elapsed = time.perf_counter() - start
+    print('{} messages in {:.3f}s: {:,.0f} messages/sec'.format(
+        len(messages), elapsed, len(messages) / elapsed))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
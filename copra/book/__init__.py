@@ -0,0 +1,5 @@
+from copra.book.bbo import BBOStream
+from copra.book.depth import DepthLadder
+from copra.book.level2 import L2Book
+from copra.book.level3 import L3Book
+from copra.book.shared import BookPublisher, BookReader
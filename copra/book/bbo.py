@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Change-only best bid and offer stream derived from level 2 books.
+
+"""
+
+from copra.book.level2 import L2Book
+from copra.websocket.channel import Channel
+
+
+class BBOStream:
+    """Emits the best bid and offer (BBO) of products only when it changes.
+
+    The stream keeps an :class:`copra.book.L2Book` for each of its products.
+    After each snapshot or l2update is applied, the best bid and ask are
+    compared with those last emitted, and a ``bbo`` message is emitted only
+    if the price or size of either has changed. Most level 2 updates are
+    away from the top of the book, so consumers of the ``bbo`` messages
+    handle a fraction of the level2 channel's messages. A ``bbo`` message
+    looks like::
+
+        {
+          'type': 'bbo',
+          'product_id': 'BTC-USD',
+          'time': '2019-01-07T23:41:39.123456Z',
+          'bid': (3657.99, 1.5),
+          'ask': (3658.0, 0.25),
+          'old_bid': (3657.99, 1.25),
+          'old_ask': (3658.0, 0.25)
+        }
+
+    Each of bid, ask, old_bid and old_ask is a (price, size) tuple, or None
+    if that side of the book is (or was) empty. time is that of the update
+    and None for snapshots.
+
+    Each message is passed to :meth:`on_bbo` and, if the stream is attached
+    to a client, through the client's handlers, so consumers can register
+    for it with ``client.on('bbo', handler)``. It is dispatched while the
+    client is handling the level2 message it was derived from.
+
+    :ivar dict books: The :class:`copra.book.L2Book` of each product.
+    :ivar int updates: The number of level2 messages applied to ready books.
+    :ivar int events: The number of bbo messages emitted.
+    """
+
+    def __init__(self, product_ids):
+        """
+
+        :param product_ids: The product ids to track the BBO of.
+        :type product_ids: str or list of str
+        """
+        if isinstance(product_ids, str):
+            product_ids = [product_ids]
+        self.product_ids = tuple(product_ids)
+        self.books = {product_id: L2Book(product_id)
+                      for product_id in self.product_ids}
+        self.updates = 0
+        self.events = 0
+        self.client = None
+        self._bbo = {product_id: (None, None)
+                     for product_id in self.product_ids}
+
+    def __repr__(self):
+        return 'BBOStream({!r})'.format(list(self.product_ids))
+
+    def attach(self, client):
+        """Derive the BBO from the level2 messages a WebSocket client
+        receives.
+
+        The client is subscribed to the level2 channel for the stream's
+        products.
+
+        :param client: The client to attach to.
+        :type client: copra.websocket.Client
+        """
+        self.client = client
+        for product_id in self.product_ids:
+            for msg_type in ('snapshot', 'l2update'):
+                client.on(msg_type, self.process, product_id=product_id)
+        client.subscribe(Channel('level2', list(self.product_ids)))
+
+    def detach(self, client):
+        """Stop receiving level2 messages from a WebSocket client.
+
+        The client remains subscribed to the level2 channel.
+
+        :param client: The client to detach from.
+        :type client: copra.websocket.Client
+        """
+        for product_id in self.product_ids:
+            for msg_type in ('snapshot', 'l2update'):
+                client.off(msg_type, self.process, product_id=product_id)
+        self.client = None
+
+    def bbo(self, product_id):
+        """Return the last emitted best bid and ask of a product.
+
+        :param str product_id: The product id.
+
+        :returns: A tuple of the bid and ask, each a (price, size) tuple or
+            None.
+        """
+        return self._bbo[product_id]
+
+    def process(self, message):
+        """Apply a level2 message to its product's book and emit a bbo
+        message if the best bid or ask has changed.
+
+        Messages that are not level2 messages for one of the stream's
+        products are ignored.
+
+        :param dict message: Dictionary representing the message.
+
+        :returns: The bbo message emitted, or None.
+        """
+        product_id = message.get('product_id')
+        book = self.books.get(product_id)
+        if book is None:
+            return None
+        book.process(message)
+        if not book.ready:
+            return None
+        self.updates += 1
+
+        bid, ask = book.best_bid, book.best_ask
+        old_bid, old_ask = self._bbo[product_id]
+        if bid == old_bid and ask == old_ask:
+            return None
+        self._bbo[product_id] = (bid, ask)
+        self.events += 1
+        event = {'type': 'bbo', 'product_id': product_id,
+                 'time': message.get('time'), 'bid': bid, 'ask': ask,
+                 'old_bid': old_bid, 'old_ask': old_ask}
+        self.on_bbo(event)
+        if self.client is not None:
+            self.client._process_message(event)
+        return event
+
+    def on_bbo(self, message):
+        """Callback fired when the best bid or ask of a product changes.
+
+        Override this method, or register a handler for 'bbo' messages with
+        the client, to act on the changes.
+
+        :param dict message: The bbo message.
+        """
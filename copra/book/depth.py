@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""Incrementally maintained depth ladders of level 2 books in price buckets.
+
+"""
+
+from decimal import Decimal, InvalidOperation
+
+from copra.book.level2 import L2Book
+from copra.book.level3 import _SCALE, _units
+from copra.websocket.channel import Channel
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+class _Buckets:
+    """The total size and number of levels of one side of a book in buckets
+    of a fixed width.
+
+    Prices are in ticks (multiples of the quote increment). Bids are counted
+    in the bucket at or below their price and asks in the bucket at or above
+    theirs, so no bucket holds prices from both sides of the spread. Sizes
+    are integer multiples of 1e-8, so the running totals stay exact.
+    """
+
+    __slots__ = ('width', 'ask', 'sizes', 'counts')
+
+    def __init__(self, width, ask):
+        self.width = width
+        self.ask = ask
+        self.sizes = {}
+        self.counts = {}
+
+    def clear(self):
+        self.sizes = {}
+        self.counts = {}
+
+    def index(self, ticks):
+        if self.ask:
+            return -(-ticks // self.width)
+        return ticks // self.width
+
+    def change(self, ticks, old, new):
+        """Apply a change of the size of a level from old to new units."""
+        index = self.index(ticks)
+        sizes, counts = self.sizes, self.counts
+        if not old:
+            counts[index] = counts.get(index, 0) + 1
+        elif not new:
+            counts[index] -= 1
+            if not counts[index]:
+                del counts[index]
+                del sizes[index]
+                return
+        sizes[index] = sizes.get(index, 0) + new - old
+
+    def levels(self, depth=None):
+        """Return (index, units) pairs, best bucket first."""
+        indexes = sorted(self.sizes, reverse=not self.ask)
+        if depth is not None:
+            indexes = indexes[:depth]
+        sizes = self.sizes
+        return [(index, sizes[index]) for index in indexes]
+
+
+class DepthLadder:
+    """The depth of a level 2 book aggregated into price buckets of one or
+    more sizes.
+
+    The ladder keeps an :class:`copra.book.L2Book` for its product and,
+    as each change is applied to it, adds the change in size to the bucket
+    of the level for every bucket size, so an update costs O(number of
+    bucket sizes) however deep the book is. Bids are grouped down and asks up
+    to a multiple of the bucket size: with $10 buckets, the bucket at 6500
+    holds the bids from 6500 up to 6509.99 and the asks from 6490.01 up to
+    6500.
+
+    Prices are converted to whole multiples of the product's quote
+    increment, so bucket boundaries are exact. Each bucket size must be a
+    multiple of the quote increment; :meth:`from_rest` creates a ladder with
+    the quote increment returned by :meth:`copra.rest.Client.products`.
+
+    :ivar str product_id: The product id of the ladder.
+    :ivar tuple bucket_sizes: The bucket sizes, as Decimals.
+    :ivar Decimal quote_increment: The product's quote increment.
+    :ivar book: The ladder's book.
+    :vartype book: copra.book.L2Book
+    """
+
+    def __init__(self, product_id, bucket_sizes, quote_increment):
+        """
+
+        :param str product_id: The product id of the ladder (eg., 'BTC-USD').
+
+        :param bucket_sizes: The widths of the price buckets, e.g.
+            ('1', '10').
+        :type bucket_sizes: list of str, int, float or Decimal
+
+        :param quote_increment: The product's quote increment, e.g. '0.01'.
+        :type quote_increment: str or Decimal
+
+        :raises ValueError: If a bucket size is not a positive multiple of
+            the quote increment.
+        """
+        self.product_id = product_id
+        try:
+            increment = Decimal(str(quote_increment))
+            sizes = tuple(Decimal(str(size)) for size in bucket_sizes)
+        except InvalidOperation:
+            raise ValueError(
+                'invalid bucket size or quote increment') from None
+        if increment <= 0:
+            raise ValueError('invalid quote increment {}'.format(
+                quote_increment))
+        for size in sizes:
+            if size <= 0 or size % increment:
+                msg = 'bucket size {} is not a multiple of {}'
+                raise ValueError(msg.format(size, increment))
+        self.bucket_sizes = sizes
+        self.quote_increment = increment
+        self.book = L2Book(product_id)
+        self._increment = float(increment)
+        # Round bucket prices to the increment's number of decimals.
+        self._places = max(0, -increment.as_tuple().exponent)
+        self._buckets = {}
+        for size in sizes:
+            width = int(size / increment)
+            self._buckets[size] = {'buy': _Buckets(width, False),
+                                   'sell': _Buckets(width, True)}
+        self._sides = {'buy': [buckets['buy']
+                               for buckets in self._buckets.values()],
+                       'sell': [buckets['sell']
+                                for buckets in self._buckets.values()]}
+
+    def __repr__(self):
+        return 'DepthLadder({!r}, {})'.format(
+            self.product_id, [str(size) for size in self.bucket_sizes])
+
+    @classmethod
+    async def from_rest(cls, rest_client, product_id, bucket_sizes):
+        """Create a ladder with the quote increment of a product as returned
+        by the REST API.
+
+        :param rest_client: The client to get the products with.
+        :type rest_client: copra.rest.Client
+
+        :param str product_id: The product id of the ladder.
+
+        :param bucket_sizes: The widths of the price buckets.
+        :type bucket_sizes: list of str, int, float or Decimal
+
+        :returns: A DepthLadder.
+
+        :raises ValueError: If the product doesn't exist or a bucket size is
+            not a multiple of its quote increment.
+
+        :raises APIRequestError: Any error generated by the Coinbase Pro API
+            server.
+        """
+        for product in await rest_client.products():
+            if product['id'] == product_id:
+                return cls(product_id, bucket_sizes,
+                           product['quote_increment'])
+        raise ValueError('unknown product {}'.format(product_id))
+
+    def attach(self, client):
+        """Keep the ladder up to date from a WebSocket client.
+
+        The client is subscribed to the level2 channel for the ladder's
+        product.
+
+        :param client: The client to attach to.
+        :type client: copra.websocket.Client
+        """
+        for msg_type in ('snapshot', 'l2update'):
+            client.on(msg_type, self.process, product_id=self.product_id)
+        client.subscribe(Channel('level2', self.product_id))
+
+    def detach(self, client):
+        """Stop receiving updates from a WebSocket client.
+
+        The client remains subscribed to the level2 channel.
+
+        :param client: The client to detach from.
+        :type client: copra.websocket.Client
+        """
+        for msg_type in ('snapshot', 'l2update'):
+            client.off(msg_type, self.process, product_id=self.product_id)
+
+    def _bucket(self, size):
+        try:
+            return self._buckets[Decimal(str(size))]
+        except (KeyError, InvalidOperation):
+            raise ValueError('no {} buckets'.format(size)) from None
+
+    def process(self, message):
+        """Apply a level2 message to the book and the buckets.
+
+        Messages that are not level2 messages for the ladder's product are
+        ignored.
+
+        :param dict message: Dictionary representing the message.
+        """
+        if message.get('product_id') != self.product_id:
+            return
+        msg_type = message['type']
+        if msg_type == 'l2update':
+            if self.book.ready:
+                self.apply_changes(message['changes'])
+        elif msg_type == 'snapshot':
+            self.book.process(message)
+            self._rebuild()
+
+    def _rebuild(self):
+        increment = self._increment
+        for side in ('buy', 'sell'):
+            buckets = self._sides[side]
+            for bucket in buckets:
+                bucket.clear()
+            levels = self.book.bids() if side == 'buy' else self.book.asks()
+            for price, size in levels:
+                ticks = int(round(price / increment))
+                units = _units(size)
+                for bucket in buckets:
+                    bucket.change(ticks, 0, units)
+
+    def apply_changes(self, changes):
+        """Apply the changes of an l2update message to the book and the
+        buckets.
+
+        :param changes: List of [side, price, size] lists as sent by the
+            server. A size of 0 removes the price level.
+        :type changes: list of [str, str, str]
+        """
+        increment = self._increment
+        ladders = self.book._sides
+        for side, price, size in changes:
+            price, size = float(price), float(size)
+            ladder = ladders[side]
+            old = ladder.sizes.get(price, 0.0)
+            if old == size:
+                continue
+            ladder.set(price, size)
+            ticks = int(round(price / increment))
+            old, new = _units(old), _units(size)
+            for bucket in self._sides[side]:
+                bucket.change(ticks, old, new)
+
+    def levels(self, side, bucket_size, depth=None):
+        """Return the buckets of one side of the book, best first.
+
+        :param str side: 'buy' or 'sell'.
+
+        :param bucket_size: One of the ladder's bucket sizes.
+        :type bucket_size: str, int, float or Decimal
+
+        :param int depth: (optional) The maximum number of buckets to return.
+            The default is all of them.
+
+        :returns: A list of (bucket price, total size) tuples. Empty buckets
+            are left out.
+
+        :raises ValueError: If the ladder has no buckets of bucket_size.
+        """
+        buckets = self._bucket(bucket_size)[side]
+        width = buckets.width * self._increment
+        places = self._places
+        return [(round(index * width, places), units / _SCALE)
+                for index, units in buckets.levels(depth)]
+
+    def to_numpy(self, side, bucket_size, depth=None):
+        """Return the buckets of one side of the book as NumPy arrays, best
+        first.
+
+        :param str side: 'buy' or 'sell'.
+
+        :param bucket_size: One of the ladder's bucket sizes.
+        :type bucket_size: str, int, float or Decimal
+
+        :param int depth: (optional) The maximum number of buckets to return.
+            The default is all of them.
+
+        :returns: A tuple of three float64 arrays: the bucket prices, the
+            total size in each bucket and the cumulative size from the best
+            bucket out.
+
+        :raises ValueError: If the ladder has no buckets of bucket_size.
+
+        :raises ImportError: If NumPy is not installed.
+        """
+        if numpy is None:
+            raise ImportError('to_numpy requires NumPy')
+        buckets = self._bucket(bucket_size)[side]
+        levels = buckets.levels(depth)
+        width = buckets.width * self._increment
+        prices = numpy.array([index for index, units in levels],
+                             dtype=numpy.float64) * width
+        prices = numpy.round(prices, self._places)
+        units = numpy.array([units for index, units in levels],
+                            dtype=numpy.int64)
+        # Sum the exact units and only then convert to floats.
+        return prices, units / _SCALE, numpy.cumsum(units) / _SCALE
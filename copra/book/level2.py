@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Incrementally maintained level 2 (aggregated) order book.
+
+"""
+
+from bisect import bisect_left, insort
+
+from copra.websocket.channel import Channel
+
+
+class _Ladder:
+    """One side of an order book as a sorted ladder of price levels.
+
+    Prices are kept in a list sorted so that the best price is always the
+    last element. Bids are stored as-is (highest price last) and asks are
+    stored negated (lowest price last). Changing the size of an existing
+    level is a dict update, finding the position of a price is an O(log n)
+    bisection and reading the best level is O(1). Adding or removing a level
+    is O(n), since the list elements after it are moved, but most book
+    activity happens near the inside of the book, at the end of the list,
+    so few elements are moved in practice.
+
+    :ivar dict sizes: Map of price to the aggregate size at that price.
+    """
+
+    __slots__ = ('_sign', '_keys', 'sizes')
+
+    def __init__(self, sign):
+        self._sign = sign
+        self._keys = []
+        self.sizes = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def clear(self):
+        self._keys = []
+        self.sizes = {}
+
+    def load(self, levels):
+        """Replace the contents of the ladder.
+
+        :param levels: Iterable of (price, size) pairs.
+        """
+        sign = self._sign
+        self.sizes = {price: size for price, size in levels if size}
+        self._keys = sorted(sign * price for price in self.sizes)
+
+    def set(self, price, size):
+        """Set the aggregate size at a price. A size of 0 removes the level.
+        """
+        sizes = self.sizes
+        if size:
+            if price not in sizes:
+                insort(self._keys, self._sign * price)
+            sizes[price] = size
+        elif price in sizes:
+            del sizes[price]
+            keys = self._keys
+            del keys[bisect_left(keys, self._sign * price)]
+
+    def best(self):
+        """Return the best (price, size) pair or None if the ladder is empty.
+        """
+        if not self._keys:
+            return None
+        price = self._sign * self._keys[-1]
+        return (price, self.sizes[price])
+
+    def levels(self, depth=None):
+        """Return a list of (price, size) pairs, best price first.
+        """
+        keys = self._keys[::-1] if depth is None else self._keys[:-depth-1:-1]
+        sign, sizes = self._sign, self.sizes
+        return [(sign * key, sizes[sign * key]) for key in keys]
+
+
+class L2Book:
+    """A level 2 order book for a single product.
+
+    The book is built from the ``snapshot`` and ``l2update`` messages of the
+    level2 channel. Prices and sizes are stored as floats.
+
+    An L2Book can be fed messages directly with :meth:`process` or attached
+    to a :class:`copra.websocket.Client` with :meth:`attach`, in which case
+    the client subscribes to the level2 channel for the book's product and
+    keeps the book up to date before its own ``on_message`` is called.
+
+    :ivar str product_id: The product id of the book.
+    :ivar bool ready: True once a snapshot has been loaded.
+    """
+
+    def __init__(self, product_id):
+        """
+
+        :param str product_id: The product id of the book (eg., 'BTC-USD').
+        """
+        self.product_id = product_id
+        self.ready = False
+        self._bids = _Ladder(1)
+        self._asks = _Ladder(-1)
+        self._sides = {'buy': self._bids, 'sell': self._asks}
+
+    def __repr__(self):
+        return 'L2Book({!r}, bid={}, ask={})'.format(self.product_id,
+                                                     self.best_bid,
+                                                     self.best_ask)
+
+    def attach(self, client):
+        """Keep the book up to date from a WebSocket client.
+
+        :param client: The client to attach to.
+        :type client: copra.websocket.Client
+        """
+        for msg_type in ('snapshot', 'l2update'):
+            client.on(msg_type, self.process, product_id=self.product_id)
+        client.subscribe(Channel('level2', self.product_id))
+
+    def detach(self, client):
+        """Stop receiving updates from a WebSocket client.
+
+        The client remains subscribed to the level2 channel.
+
+        :param client: The client to detach from.
+        :type client: copra.websocket.Client
+        """
+        for msg_type in ('snapshot', 'l2update'):
+            client.off(msg_type, self.process, product_id=self.product_id)
+
+    def process(self, message):
+        """Apply a WebSocket message to the book.
+
+        Messages that are not level2 messages for the book's product are
+        ignored.
+
+        :param dict message: Dictionary representing the message.
+        """
+        if message.get('product_id') != self.product_id:
+            return
+        msg_type = message['type']
+        if msg_type == 'l2update':
+            if self.ready:
+                self.apply_changes(message['changes'])
+        elif msg_type == 'snapshot':
+            self.load_snapshot(message['bids'], message['asks'])
+
+    def load_snapshot(self, bids, asks):
+        """Replace the contents of the book.
+
+        :param bids: List of [price, size] pairs as sent by the server.
+        :type bids: list of [str, str]
+
+        :param asks: List of [price, size] pairs as sent by the server.
+        :type asks: list of [str, str]
+        """
+        self._bids.load((float(p), float(s)) for p, s, *_ in bids)
+        self._asks.load((float(p), float(s)) for p, s, *_ in asks)
+        self.ready = True
+
+    def apply_changes(self, changes):
+        """Apply the changes of an l2update message to the book.
+
+        :param changes: List of [side, price, size] lists as sent by the
+            server. A size of 0 removes the price level.
+        :type changes: list of [str, str, str]
+        """
+        sides = self._sides
+        for side, price, size in changes:
+            sides[side].set(float(price), float(size))
+
+    def clear(self):
+        """Empty the book. It will not be ready until the next snapshot.
+        """
+        self._bids.clear()
+        self._asks.clear()
+        self.ready = False
+
+    @property
+    def best_bid(self):
+        """The best bid as a (price, size) tuple or None if there are no bids.
+        """
+        return self._bids.best()
+
+    @property
+    def best_ask(self):
+        """The best ask as a (price, size) tuple or None if there are no asks.
+        """
+        return self._asks.best()
+
+    @property
+    def spread(self):
+        """The best ask price minus the best bid price or None if either side
+        of the book is empty.
+        """
+        bid, ask = self._bids.best(), self._asks.best()
+        if bid is None or ask is None:
+            return None
+        return ask[0] - bid[0]
+
+    def bids(self, depth=None):
+        """Return the bid levels, best (highest) price first.
+
+        :param int depth: (optional) The maximum number of levels to return.
+            The default is all of them.
+
+        :returns: A list of (price, size) tuples.
+        """
+        return self._bids.levels(depth)
+
+    def asks(self, depth=None):
+        """Return the ask levels, best (lowest) price first.
+
+        :param int depth: (optional) The maximum number of levels to return.
+            The default is all of them.
+
+        :returns: A list of (price, size) tuples.
+        """
+        return self._asks.levels(depth)
+
+    def size_at(self, side, price):
+        """Return the aggregate size at a price.
+
+        :param str side: 'buy' or 'sell'.
+        :param float price: The price level.
+
+        :returns: The size at the price or 0.0 if there is no such level.
+        """
+        return self._sides[side].sizes.get(float(price), 0.0)
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""Incrementally maintained level 3 (per order) order book.
+
+"""
+
+from array import array
+import sys
+
+from copra.book.level2 import _Ladder
+from copra.websocket.channel import Channel
+
+# Sizes are stored as integer multiples of 1e-8 so that level aggregates
+# stay exact as orders are opened, matched and canceled.
+_SCALE = 10 ** 8
+
+_BUY, _SELL = 0, 1
+# The message types that change the book.
+_MESSAGE_TYPES = ('open', 'done', 'match', 'change', 'resync')
+_SIDES = {'buy': _BUY, 'sell': _SELL}
+
+
+def _units(size):
+    return int(round(float(size) * _SCALE))
+
+
+class L3Book:
+    """A level 3 order book for a single product.
+
+    The book is built from a level 3 snapshot returned by
+    :meth:`copra.rest.Client.order_book` and the ``open``, ``done``,
+    ``match`` and ``change`` messages of the full channel.
+
+    Orders are stored in preallocated, parallel arrays indexed by slot rather
+    than as one object per order. A dict maps each order id to its slot for
+    O(1) lookup, and the orders at each price level form a FIFO queue linked
+    through the slot arrays so that any order can be removed in O(1). Each
+    side of the book also keeps a sorted ladder of aggregate level sizes, so
+    reading the best bid or ask is O(1). Freed slots are reused and the arrays
+    double in size when full. :attr:`nbytes` reports the memory used by the
+    book.
+
+    Prices are floats. Sizes are reported as floats but are aggregated
+    internally as integer multiples of 1e-8, the precision of the Coinbase Pro
+    API, so level sizes never drift.
+
+    :ivar str product_id: The product id of the book.
+    :ivar int sequence: The sequence number of the last message applied to
+        the book or None if no snapshot has been loaded.
+    :ivar bool ready: True once a snapshot has been loaded.
+    """
+
+    def __init__(self, product_id, capacity=1024):
+        """
+
+        :param str product_id: The product id of the book (eg., 'BTC-USD').
+
+        :param int capacity: (optional) The number of orders to allocate
+            space for initially. The book grows as needed. The default is
+            1024.
+        """
+        self.product_id = product_id
+        self.sequence = None
+        self.ready = False
+        self._pending = None
+        self._capacity = 0
+        self._handlers = {'open': self._on_open, 'done': self._on_done,
+                          'match': self._on_match, 'change': self._on_change}
+        self._reset(max(capacity, 1))
+
+    def __repr__(self):
+        return 'L3Book({!r}, orders={}, bid={}, ask={})'.format(
+            self.product_id, len(self), self.best_bid, self.best_ask)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, order_id):
+        return order_id in self._index
+
+    def _reset(self, capacity):
+        self._index = {}
+        self._ids = [None] * capacity
+        self._price = array('d', bytes(8 * capacity))
+        self._size = array('q', bytes(8 * capacity))
+        self._side = array('b', bytes(capacity))
+        self._prev = array('l', [-1]) * capacity
+        self._next = array('l', [-1]) * capacity
+        self._free = []
+        self._top = 0
+        self._capacity = capacity
+        self._ladders = (_Ladder(1), _Ladder(-1))
+        self._queues = ({}, {})
+
+    def _grow(self):
+        extra = self._capacity
+        self._ids.extend([None] * extra)
+        self._price.extend(array('d', bytes(8 * extra)))
+        self._size.extend(array('q', bytes(8 * extra)))
+        self._side.extend(array('b', bytes(extra)))
+        self._prev.extend(array('l', [-1]) * extra)
+        self._next.extend(array('l', [-1]) * extra)
+        self._capacity += extra
+
+    def attach(self, client):
+        """Keep the book up to date from a WebSocket client.
+
+        The client is subscribed to the full channel for the book's product.
+        The book still needs to be seeded with :meth:`seed`,
+        :meth:`load_snapshot` or :meth:`copra.websocket.Client.resync` before
+        it is ready. If the client has a rest_client, the book is reloaded
+        automatically whenever the client detects a sequence gap.
+
+        :param client: The client to attach to.
+        :type client: copra.websocket.Client
+        """
+        for msg_type in _MESSAGE_TYPES:
+            client.on(msg_type, self.process, product_id=self.product_id)
+        client.subscribe(Channel('full', self.product_id))
+
+    def detach(self, client):
+        """Stop receiving updates from a WebSocket client.
+
+        The client remains subscribed to the full channel.
+
+        :param client: The client to detach from.
+        :type client: copra.websocket.Client
+        """
+        for msg_type in _MESSAGE_TYPES:
+            client.off(msg_type, self.process, product_id=self.product_id)
+
+    async def seed(self, rest_client):
+        """Load the book from a level 3 REST snapshot.
+
+        Messages processed while the snapshot is being fetched are buffered
+        and those newer than the snapshot are applied once it arrives.
+
+        :param rest_client: The REST client to request the snapshot with.
+        :type rest_client: copra.rest.Client
+
+        :raises APIRequestError: Any error generated by the Coinbase Pro API
+            server.
+        """
+        self._pending = []
+        try:
+            snapshot = await rest_client.order_book(self.product_id, level=3)
+        except Exception:
+            self._pending = None
+            raise
+        self.load_snapshot(snapshot)
+
+    def load_snapshot(self, snapshot):
+        """Replace the contents of the book with a level 3 snapshot.
+
+        :param dict snapshot: A level 3 order book as returned by
+            :meth:`copra.rest.Client.order_book`.
+        """
+        self._reset(max(self._capacity,
+                        len(snapshot['bids']) + len(snapshot['asks'])))
+        add = self._add
+        for price, size, order_id in snapshot['bids']:
+            add(order_id, _BUY, float(price), _units(size))
+        for price, size, order_id in snapshot['asks']:
+            add(order_id, _SELL, float(price), _units(size))
+        self.sequence = int(snapshot['sequence'])
+        self.ready = True
+
+        pending, self._pending = self._pending, None
+        for message in pending or ():
+            self.process(message)
+
+    def process(self, message):
+        """Apply a full channel WebSocket message to the book.
+
+        Messages for other products, messages older than the book and
+        messages that do not change the book (received, activate) are ignored.
+        Messages processed before the book is ready are buffered if the book
+        is being seeded and ignored otherwise.
+
+        A resync message emitted by :meth:`copra.websocket.Client.resync`
+        replaces the contents of the book with its snapshot.
+
+        :param dict message: Dictionary representing the message.
+        """
+        if message.get('product_id') != self.product_id:
+            return
+        if message['type'] == 'resync':
+            self.load_snapshot(message['snapshot'])
+            return
+        if not self.ready:
+            if self._pending is not None:
+                self._pending.append(message)
+            return
+        sequence = message.get('sequence')
+        if sequence is not None:
+            if sequence <= self.sequence:
+                return
+            self.sequence = sequence
+        handler = self._handlers.get(message['type'])
+        if handler is not None:
+            handler(message)
+
+    def _on_open(self, message):
+        self._add(message['order_id'], _SIDES[message['side']],
+                  float(message['price']), _units(message['remaining_size']))
+
+    def _on_done(self, message):
+        slot = self._index.get(message['order_id'])
+        if slot is not None:
+            self._remove(slot)
+
+    def _on_match(self, message):
+        slot = self._index.get(message['maker_order_id'])
+        if slot is not None:
+            self._resize(slot, self._size[slot] - _units(message['size']))
+
+    def _on_change(self, message):
+        slot = self._index.get(message['order_id'])
+        if slot is not None and message.get('new_size') is not None:
+            self._resize(slot, _units(message['new_size']))
+
+    def _add(self, order_id, side, price, units):
+        if order_id in self._index:
+            return
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self._top == self._capacity:
+                self._grow()
+            slot = self._top
+            self._top += 1
+
+        self._index[order_id] = slot
+        self._ids[slot] = order_id
+        self._price[slot] = price
+        self._size[slot] = units
+        self._side[slot] = side
+        self._next[slot] = -1
+
+        queue = self._queues[side].get(price)
+        if queue is None:
+            self._queues[side][price] = [slot, slot, 1]
+            self._prev[slot] = -1
+        else:
+            tail = queue[1]
+            self._next[tail] = slot
+            self._prev[slot] = tail
+            queue[1] = slot
+            queue[2] += 1
+
+        ladder = self._ladders[side]
+        ladder.set(price, ladder.sizes.get(price, 0) + units)
+
+    def _remove(self, slot):
+        side, price = self._side[slot], self._price[slot]
+        prev, nxt = self._prev[slot], self._next[slot]
+        queues = self._queues[side]
+        queue = queues[price]
+        if prev == -1:
+            queue[0] = nxt
+        else:
+            self._next[prev] = nxt
+        if nxt == -1:
+            queue[1] = prev
+        else:
+            self._prev[nxt] = prev
+        queue[2] -= 1
+        if not queue[2]:
+            del queues[price]
+
+        ladder = self._ladders[side]
+        ladder.set(price, ladder.sizes.get(price, 0) - self._size[slot])
+
+        del self._index[self._ids[slot]]
+        self._ids[slot] = None
+        self._free.append(slot)
+
+    def _resize(self, slot, units):
+        side, price = self._side[slot], self._price[slot]
+        ladder = self._ladders[side]
+        size = ladder.sizes.get(price, 0) + units - self._size[slot]
+        ladder.set(price, size)
+        self._size[slot] = units
+
+    def order(self, order_id):
+        """Look up an order on the book.
+
+        :param str order_id: The id of the order.
+
+        :returns: A (side, price, size) tuple or None if the order is not on
+            the book.
+        """
+        slot = self._index.get(order_id)
+        if slot is None:
+            return None
+        side = 'buy' if self._side[slot] == _BUY else 'sell'
+        return (side, self._price[slot], self._size[slot] / _SCALE)
+
+    def orders_at(self, side, price):
+        """Return the orders at a price level in time priority.
+
+        :param str side: 'buy' or 'sell'.
+        :param float price: The price level.
+
+        :returns: A list of (order_id, size) tuples, oldest first.
+        """
+        queue = self._queues[_SIDES[side]].get(float(price))
+        orders = []
+        slot = queue[0] if queue else -1
+        while slot != -1:
+            orders.append((self._ids[slot], self._size[slot] / _SCALE))
+            slot = self._next[slot]
+        return orders
+
+    def _best(self, side):
+        best = self._ladders[side].best()
+        if best is None:
+            return None
+        return (best[0], best[1] / _SCALE)
+
+    @property
+    def best_bid(self):
+        """The best bid as a (price, size) tuple or None if there are no bids.
+        """
+        return self._best(_BUY)
+
+    @property
+    def best_ask(self):
+        """The best ask as a (price, size) tuple or None if there are no asks.
+        """
+        return self._best(_SELL)
+
+    def _levels(self, side, depth):
+        queues = self._queues[side]
+        return [(price, units / _SCALE, queues[price][2])
+                for price, units in self._ladders[side].levels(depth)]
+
+    def bids(self, depth=None):
+        """Return the aggregated bid levels, best (highest) price first.
+
+        :param int depth: (optional) The maximum number of levels to return.
+            The default is all of them.
+
+        :returns: A list of (price, size, number of orders) tuples.
+        """
+        return self._levels(_BUY, depth)
+
+    def asks(self, depth=None):
+        """Return the aggregated ask levels, best (lowest) price first.
+
+        :param int depth: (optional) The maximum number of levels to return.
+            The default is all of them.
+
+        :returns: A list of (price, size, number of orders) tuples.
+        """
+        return self._levels(_SELL, depth)
+
+    @property
+    def capacity(self):
+        """The number of orders the book can hold before it needs to grow.
+        """
+        return self._capacity
+
+    @property
+    def nbytes(self):
+        """The approximate number of bytes of memory used by the book.
+
+        This includes the order arrays, the order id index (and the id strings
+        themselves) and the price level structures. Computing it is O(n) in
+        the number of orders and levels.
+        """
+        size = sum(a.buffer_info()[1] * a.itemsize for a in
+                   (self._price, self._size, self._side, self._prev,
+                    self._next))
+        size += sys.getsizeof(self._ids) + sys.getsizeof(self._free)
+        size += sys.getsizeof(self._index)
+        size += sum(sys.getsizeof(order_id) for order_id in self._index)
+        for side in (_BUY, _SELL):
+            queues, ladder = self._queues[side], self._ladders[side]
+            size += sys.getsizeof(queues) + sys.getsizeof(ladder._keys)
+            size += sys.getsizeof(ladder.sizes)
+            size += sum(sys.getsizeof(queue) for queue in queues.values())
+        return size
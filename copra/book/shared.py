@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""Level 2 order books published to shared memory for other processes.
+
+"""
+
+from binascii import hexlify
+from collections import namedtuple
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from copra.book.level2 import L2Book
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover
+    # Python < 3.8
+    shared_memory = None
+
+# The segment starts with a header: a magic number, the layout version, the
+# number of levels per side and the number of products.
+_HEADER = struct.Struct('<4sIII')
+_MAGIC = b'CPRB'
+_LAYOUT = 1
+
+# Each product has a slot. A slot starts with its seqlock counter, which is
+# odd while the slot is being written, followed by the product id (UTF-8,
+# NUL padded), the time the slot was written, the number of bid and ask
+# levels and depth (price, size) pairs per side, bids then asks.
+_COUNTER = struct.Struct('<Q')
+_PRODUCT_ID = struct.Struct('<16s')
+_SLOT_HEADER = '<dII'
+
+# Where segments are created when multiprocessing.shared_memory isn't
+# available. /dev/shm is also where shared_memory creates them on Linux, so
+# both can open the same segments there.
+_SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+BookSnapshot = namedtuple('BookSnapshot', 'product_id version time bids asks')
+BookSnapshot.__doc__ = """A consistent copy of the top levels of a book.
+
+:ivar str product_id: The product id of the book.
+:ivar int version: The number of times the book has been published.
+:ivar float time: The time the book was published, per time.time().
+:ivar tuple bids: (price, size) tuples, best (highest) price first.
+:ivar tuple asks: (price, size) tuples, best (lowest) price first.
+"""
+
+
+class _MappedFile:
+    """A shared memory segment backed by a memory mapped file, with the
+    interface of multiprocessing.shared_memory.SharedMemory, for Python
+    versions that don't have it.
+    """
+
+    def __init__(self, name=None, create=False, size=0):
+        if name is None:
+            name = 'copra_{}'.format(hexlify(os.urandom(8)).decode())
+        self.name = name
+        self._path = os.path.join(_SHM_DIR, name)
+        flags = os.O_RDWR | (os.O_CREAT | os.O_EXCL if create else 0)
+        fd = os.open(self._path, flags, 0o600)
+        try:
+            if create:
+                os.ftruncate(fd, size)
+            else:
+                size = os.fstat(fd).st_size
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.size = size
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        self.buf.release()
+        self._mmap.close()
+
+    def unlink(self):
+        os.unlink(self._path)
+
+
+# The names of the segments created by this process.
+_CREATED = set()
+
+
+def _create(size):
+    if shared_memory is None:
+        segment = _MappedFile(create=True, size=size)
+    else:
+        segment = shared_memory.SharedMemory(create=True, size=size)
+    _CREATED.add(segment.name)
+    return segment
+
+
+def _open(name):
+    if shared_memory is None:
+        return _MappedFile(name)
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Python < 3.13
+        pass
+    segment = shared_memory.SharedMemory(name)
+    if name not in _CREATED:
+        # Readers don't own the segment. Without this, the resource tracker
+        # of a reader process unlinks it when the reader exits.
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+class _Layout:
+    """The offsets and formats of a segment with a given depth."""
+
+    def __init__(self, depth, count):
+        self.depth = depth
+        self.count = count
+        self.levels = struct.Struct('<{}d'.format(4 * depth))
+        self.slot_header = struct.Struct(_SLOT_HEADER)
+        self.body = struct.Struct('<16s' + _SLOT_HEADER[1:] +
+                                  '{}d'.format(4 * depth))
+        self.slot_size = _COUNTER.size + self.body.size
+        self.size = _HEADER.size + count * self.slot_size
+
+    def offset(self, index):
+        return _HEADER.size + index * self.slot_size
+
+
+class BookPublisher:
+    """Publishes the top levels of level 2 order books to shared memory.
+
+    The publisher keeps an :class:`copra.book.L2Book` for each of its
+    products and, after every snapshot and l2update applied to one, writes
+    the top depth levels of each side to the product's slot of a shared
+    memory segment. Other processes on the same host open the segment by
+    name with :class:`BookReader` and read the books without a WebSocket
+    connection of their own, so one client can feed any number of
+    processes.
+
+    Each slot is guarded by a seqlock: a counter that is incremented before
+    and after the slot is written, so it is odd while a write is in
+    progress. Readers never block the publisher. They retry if the counter
+    is odd or changes while they read.
+
+    The segment is created when the publisher is, using
+    multiprocessing.shared_memory on Python 3.8 and later and a memory
+    mapped file in /dev/shm (or the temporary directory) otherwise. Call
+    :meth:`close` to remove it.
+
+    :ivar str name: The name readers open the segment with.
+    :ivar int depth: The number of levels published per side.
+    :ivar dict books: The :class:`copra.book.L2Book` of each product.
+    :ivar int publishes: The number of times a book has been published.
+    """
+
+    def __init__(self, product_ids, depth=10):
+        """
+
+        :param product_ids: The product ids to publish books for.
+        :type product_ids: str or list of str
+
+        :param int depth: (optional) The number of levels published per side.
+            The default is 10.
+
+        :raises ValueError: If a product id is longer than 16 bytes.
+        """
+        if isinstance(product_ids, str):
+            product_ids = [product_ids]
+        self.product_ids = tuple(product_ids)
+        self.depth = depth
+        self.books = {product_id: L2Book(product_id)
+                      for product_id in self.product_ids}
+        self.publishes = 0
+        self._layout = layout = _Layout(depth, len(self.product_ids))
+        self._offsets = {}
+        encoded = []
+        for product_id in self.product_ids:
+            raw = product_id.encode('utf8')
+            if len(raw) > _PRODUCT_ID.size:
+                raise ValueError('product id {} is too long'.format(
+                    product_id))
+            encoded.append(raw)
+
+        self._segment = _create(layout.size)
+        self.name = self._segment.name
+        buf = self._segment.buf
+        _HEADER.pack_into(buf, 0, _MAGIC, _LAYOUT, depth, layout.count)
+        for index, (product_id, raw) in enumerate(zip(self.product_ids,
+                                                      encoded)):
+            offset = self._offsets[product_id] = layout.offset(index)
+            _COUNTER.pack_into(buf, offset, 0)
+            _PRODUCT_ID.pack_into(buf, offset + _COUNTER.size, raw)
+        self._empty = (0.0, 0.0) * depth
+
+    def __repr__(self):
+        return 'BookPublisher({!r}, depth={}, name={!r})'.format(
+            list(self.product_ids), self.depth, self.name)
+
+    def attach(self, client):
+        """Build and publish the books from a WebSocket client.
+
+        The client is subscribed to the level2 channel for the publisher's
+        products.
+
+        :param client: The client to attach to.
+        :type client: copra.websocket.Client
+        """
+        for product_id, book in self.books.items():
+            book.attach(client)
+            # Registered after the book's handlers, so they run after it has
+            # been updated.
+            for msg_type in ('snapshot', 'l2update'):
+                client.on(msg_type, self._on_update, product_id=product_id)
+
+    def detach(self, client):
+        """Stop building the books from a WebSocket client.
+
+        The client remains subscribed to the level2 channel.
+
+        :param client: The client to detach from.
+        :type client: copra.websocket.Client
+        """
+        for product_id, book in self.books.items():
+            book.detach(client)
+            for msg_type in ('snapshot', 'l2update'):
+                client.off(msg_type, self._on_update, product_id=product_id)
+
+    def _on_update(self, message):
+        if self.books[message['product_id']].ready:
+            self.publish(message['product_id'])
+
+    def publish(self, product_id):
+        """Write the top levels of a product's book to its slot.
+
+        This is called automatically while the publisher is attached to a
+        client.
+
+        :param str product_id: The product id.
+        """
+        book = self.books[product_id]
+        depth = self.depth
+        bids = book.bids(depth)
+        asks = book.asks(depth)
+        values = []
+        for price, size in bids:
+            values.append(price)
+            values.append(size)
+        values.extend(self._empty[:2 * (depth - len(bids))])
+        for price, size in asks:
+            values.append(price)
+            values.append(size)
+        values.extend(self._empty[:2 * (depth - len(asks))])
+
+        buf = self._segment.buf
+        offset = self._offsets[product_id]
+        layout = self._layout
+        counter = _COUNTER.unpack_from(buf, offset)[0]
+        _COUNTER.pack_into(buf, offset, counter + 1)
+        header = offset + _COUNTER.size + _PRODUCT_ID.size
+        layout.slot_header.pack_into(buf, header, time.time(), len(bids),
+                                     len(asks))
+        layout.levels.pack_into(buf, header + layout.slot_header.size,
+                                *values)
+        _COUNTER.pack_into(buf, offset, counter + 2)
+        self.publishes += 1
+
+    def close(self):
+        """Close and remove the shared memory segment.
+
+        Readers that have it open can keep reading the last published books
+        until they close it.
+        """
+        if self._segment is None:
+            return
+        self._segment.close()
+        self._segment.unlink()
+        _CREATED.discard(self.name)
+        self._segment = None
+
+
+class BookReader:
+    """Reads the books published by a :class:`BookPublisher`, usually in
+    another process.
+    """
+
+    def __init__(self, name, retries=1000):
+        """
+
+        :param str name: The name of the publisher's segment.
+
+        :param int retries: (optional) The number of times a read is retried
+            while the book is being written before giving up. The default is
+            1000.
+
+        :raises ValueError: If the segment isn't a book segment.
+        """
+        self.name = name
+        self.retries = retries
+        self._segment = segment = _open(name)
+        buf = segment.buf
+        magic, layout, depth, count = _HEADER.unpack_from(buf, 0)
+        if magic != _MAGIC or layout != _LAYOUT:
+            segment.close()
+            raise ValueError('{} is not a book segment'.format(name))
+        self.depth = depth
+        self._layout = _Layout(depth, count)
+        self._offsets = {}
+        for index in range(count):
+            offset = self._layout.offset(index)
+            raw = _PRODUCT_ID.unpack_from(buf, offset + _COUNTER.size)[0]
+            self._offsets[raw.rstrip(b'\0').decode('utf8')] = offset
+
+    def __repr__(self):
+        return 'BookReader({!r})'.format(self.name)
+
+    @property
+    def product_ids(self):
+        """The product ids of the published books."""
+        return tuple(self._offsets)
+
+    def version(self, product_id):
+        """Return the number of times a book has been published.
+
+        This reads a single counter, so polling it is a cheap way to wait
+        for a change before taking a :meth:`snapshot`.
+
+        :param str product_id: The product id.
+
+        :raises KeyError: If the product isn't published.
+        """
+        return _COUNTER.unpack_from(self._segment.buf,
+                                    self._offsets[product_id])[0] // 2
+
+    def snapshot(self, product_id):
+        """Return a consistent copy of a product's published levels.
+
+        :param str product_id: The product id.
+
+        :returns: A :class:`BookSnapshot`, or None if the book hasn't been
+            published yet.
+
+        :raises KeyError: If the product isn't published.
+
+        :raises RuntimeError: If the book was being written on every one of
+            retries attempts.
+        """
+        buf = self._segment.buf
+        offset = self._offsets[product_id]
+        body = self._layout.body
+        unpack_counter = _COUNTER.unpack_from
+        for _ in range(self.retries):
+            before = unpack_counter(buf, offset)[0]
+            if before & 1:
+                time.sleep(0)
+                continue
+            values = body.unpack_from(buf, offset + _COUNTER.size)
+            if unpack_counter(buf, offset)[0] == before:
+                break
+        else:
+            msg = 'could not read a consistent snapshot of {}'
+            raise RuntimeError(msg.format(product_id))
+        if not before:
+            return None
+
+        published, bid_count, ask_count = values[1:4]
+        depth = self.depth
+        bids = values[4:4 + 2 * bid_count]
+        asks = values[4 + 2 * depth:4 + 2 * depth + 2 * ask_count]
+        return BookSnapshot(product_id, before // 2, published,
+                            tuple(zip(bids[::2], bids[1::2])),
+                            tuple(zip(asks[::2], asks[1::2])))
+
+    def close(self):
+        """Close the segment."""
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
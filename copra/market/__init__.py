@@ -0,0 +1,3 @@
+from copra.market.candles import Candle, CandleBuilder
+from copra.market.tape import TradeTape
+from copra.market.ticker import TickerStore
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""Incrementally built OHLCV candles.
+
+"""
+
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+import logging
+import time
+
+from copra.websocket.channel import Channel
+from copra.websocket.latency import parse_time
+
+logger = logging.getLogger(__name__)
+
+# The granularities, in seconds, historic_rates can seed and reconcile.
+REST_GRANULARITIES = (60, 300, 900, 3600, 21600, 86400)
+
+Candle = namedtuple('Candle', 'time low high open close volume')
+Candle.__doc__ = """A candle, with the fields in the order of a
+:meth:`copra.rest.Client.historic_rates` bucket.
+
+:ivar int time: The start of the candle as a Unix timestamp.
+:ivar float low: The lowest trade price.
+:ivar float high: The highest trade price.
+:ivar float open: The first trade price.
+:ivar float close: The last trade price.
+:ivar float volume: The total size traded.
+"""
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class _Series:
+    """The candles of one product at one granularity.
+
+    Closed candles are kept in a ring buffer (a deque with a maxlen), oldest
+    first. The open candle is kept as a list so trades update it in place.
+    """
+
+    __slots__ = ('granularity', 'closed', 'current')
+
+    def __init__(self, granularity, capacity):
+        self.granularity = granularity
+        self.closed = deque(maxlen=capacity)
+        self.current = None
+
+    def merge(self, candles):
+        """Overwrite or add closed candles, keeping them in time order.
+
+        :param candles: Candles older than the open candle.
+        """
+        merged = {candle.time: candle for candle in self.closed}
+        merged.update((candle.time, candle) for candle in candles)
+        self.closed.clear()
+        self.closed.extend(merged[key] for key in sorted(merged))
+
+
+class CandleBuilder:
+    """OHLCV candles for several products and granularities built from the
+    matches channel.
+
+    Each trade (a ``match`` message) updates the open candle of each
+    granularity for its product. A candle closes when the first trade of a
+    later candle arrives, or, if the builder is attached to a client, once
+    its interval has ended plus close_delay seconds by the local clock, so
+    quiet markets still close their candles on time. Closed candles are kept
+    in a ring buffer of capacity candles per product and granularity, and
+    :meth:`on_candle` is called for each one. As with
+    :meth:`copra.rest.Client.historic_rates`, intervals without trades have
+    no candle.
+
+    Candles of the granularities historic_rates supports can be seeded from,
+    and after a reconnect reconciled with, the REST API with
+    :meth:`reconcile`.
+
+    :ivar tuple product_ids: The product ids candles are built for.
+    :ivar tuple granularities: The candle lengths in seconds, shortest first.
+    :ivar int trades: The number of trades processed.
+    """
+
+    def __init__(self, product_ids, granularities=(1, 60, 300, 900, 3600,
+                                                   21600, 86400),
+                 capacity=1000, close_delay=0.5):
+        """
+
+        :param product_ids: The product ids to build candles for.
+        :type product_ids: str or list of str
+
+        :param granularities: (optional) The candle lengths in seconds. The
+            default is 1 second, 1, 5 and 15 minutes, 1 and 6 hours and 1 day.
+        :type granularities: tuple of int
+
+        :param int capacity: (optional) The number of closed candles kept per
+            product and granularity. The default is 1000.
+
+        :param float close_delay: (optional) The seconds after the end of an
+            interval that its candle is closed if no later trade has closed
+            it, to allow for trades that are delivered late. The default is
+            0.5.
+        """
+        if isinstance(product_ids, str):
+            product_ids = [product_ids]
+        self.product_ids = tuple(product_ids)
+        self.granularities = tuple(sorted(granularities))
+        self.capacity = capacity
+        self.close_delay = close_delay
+        self.trades = 0
+        self._series = {
+            product_id: [_Series(granularity, capacity)
+                         for granularity in self.granularities]
+            for product_id in self.product_ids}
+        self._trade_ids = {}
+        self._last_trade = {}
+        self._client = None
+        self._connection_id = None
+        self._handle = None
+
+    def __repr__(self):
+        return 'CandleBuilder({!r}, {!r})'.format(list(self.product_ids),
+                                                  self.granularities)
+
+    def attach(self, client):
+        """Build candles from the trades a WebSocket client receives.
+
+        The client is subscribed to the matches channel for the builder's
+        products. If the client has a rest_client, candles are reconciled
+        with the REST API after every reconnect.
+
+        :param client: The client to attach to.
+        :type client: copra.websocket.Client
+        """
+        self._client = client
+        for product_id in self.product_ids:
+            client.on('match', self.process, product_id=product_id)
+        client.on('subscriptions', self._on_subscriptions)
+        client.subscribe(Channel('matches', list(self.product_ids)))
+        self._schedule()
+
+    def detach(self, client):
+        """Stop receiving trades from a WebSocket client.
+
+        The client remains subscribed to the matches channel.
+
+        :param client: The client to detach from.
+        :type client: copra.websocket.Client
+        """
+        for product_id in self.product_ids:
+            client.off('match', self.process, product_id=product_id)
+        client.off('subscriptions', self._on_subscriptions)
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._client = None
+
+    def _schedule(self):
+        """Call close_candles at the end of the shortest open interval."""
+        shortest = self.granularities[0]
+        now = time.time()
+        delay = shortest - now % shortest + self.close_delay
+        self._handle = self._client.loop.call_later(delay, self._tick)
+
+    def _tick(self):
+        self._handle = None
+        if self._client is None:
+            return
+        try:
+            self.close_candles()
+        finally:
+            if self._client is not None:
+                self._schedule()
+
+    def _on_subscriptions(self, message):
+        """Reconcile the candles after a reconnect."""
+        client = self._client
+        previous, self._connection_id = (self._connection_id,
+                                         client.connection_id)
+        if previous is None or previous == client.connection_id:
+            return
+        if client.rest_client is not None and self._last_trade:
+            start = min(self._last_trade.values())
+            client.loop.create_task(self._reconcile(client.rest_client,
+                                                    start))
+
+    async def _reconcile(self, rest_client, start):
+        try:
+            await self.reconcile(rest_client, start=start)
+        except Exception:
+            logger.exception('Failed to reconcile candles.')
+
+    def process(self, message):
+        """Add a trade to the candles of its product.
+
+        Messages that are not matches for one of the builder's products, and
+        trades that have already been processed, are ignored. Trades for a
+        candle that has already closed are dropped.
+
+        :param dict message: Dictionary representing the message.
+        """
+        if message.get('type') != 'match':
+            return
+        product_id = message['product_id']
+        series = self._series.get(product_id)
+        if series is None:
+            return
+        trade_id = message['trade_id']
+        if trade_id <= self._trade_ids.get(product_id, 0):
+            return
+        self._trade_ids[product_id] = trade_id
+        self.trades += 1
+
+        timestamp = parse_time(message['time'])
+        self._last_trade[product_id] = timestamp
+        price = float(message['price'])
+        size = float(message['size'])
+        for candles in series:
+            granularity = candles.granularity
+            start = int(timestamp // granularity) * granularity
+            current = candles.current
+            if current is not None and start != current[0]:
+                if start < current[0]:
+                    continue
+                self._close(product_id, candles)
+                current = None
+            if current is None:
+                closed = candles.closed
+                if closed and start <= closed[-1].time:
+                    continue
+                candles.current = [start, price, price, price, price, size]
+            else:
+                if price < current[1]:
+                    current[1] = price
+                elif price > current[2]:
+                    current[2] = price
+                current[4] = price
+                current[5] += size
+
+    def _close(self, product_id, candles):
+        candle = Candle(*candles.current)
+        candles.closed.append(candle)
+        candles.current = None
+        self.on_candle(product_id, candles.granularity, candle)
+
+    def close_candles(self, now=None):
+        """Close the open candles whose interval ended more than close_delay
+        seconds ago.
+
+        This is called automatically while the builder is attached to a
+        client.
+
+        :param float now: (optional) The current Unix time. The default is
+            now.
+        """
+        if now is None:
+            now = time.time()
+        for product_id, series in self._series.items():
+            for candles in series:
+                current = candles.current
+                if (current is not None and
+                        current[0] + candles.granularity + self.close_delay
+                        <= now):
+                    self._close(product_id, candles)
+
+    def on_candle(self, product_id, granularity, candle):
+        """Callback fired when a candle closes.
+
+        Override this method to act on closed candles.
+
+        :param str product_id: The product id of the candle.
+        :param int granularity: The length of the candle in seconds.
+        :param Candle candle: The candle.
+        """
+
+    def _candles(self, product_id, granularity):
+        try:
+            index = self.granularities.index(granularity)
+            return self._series[product_id][index]
+        except (KeyError, ValueError):
+            msg = 'no {}s candles for {}'.format(granularity, product_id)
+            raise ValueError(msg) from None
+
+    def candles(self, product_id, granularity, count=None):
+        """Return the closed candles of a product, oldest first.
+
+        :param str product_id: The product id.
+        :param int granularity: The length of the candles in seconds.
+        :param int count: (optional) Return only the last count candles. The
+            default is None, all of them.
+
+        :returns: A list of :class:`Candle`.
+
+        :raises ValueError: If there are no candles for the product and
+            granularity.
+        """
+        closed = self._candles(product_id, granularity).closed
+        if count is None or count >= len(closed):
+            return list(closed)
+        return list(closed)[-count:] if count > 0 else []
+
+    def current(self, product_id, granularity):
+        """Return the open candle of a product.
+
+        :param str product_id: The product id.
+        :param int granularity: The length of the candle in seconds.
+
+        :returns: The open :class:`Candle`, or None if there have been no
+            trades since the last one closed.
+
+        :raises ValueError: If there are no candles for the product and
+            granularity.
+        """
+        current = self._candles(product_id, granularity).current
+        return Candle(*current) if current is not None else None
+
+    async def reconcile(self, rest_client, product_ids=None, start=None):
+        """Seed or correct the candles with those of the REST API.
+
+        For every product and every granularity the REST API supports, the
+        candles from start (or, if start is None, the last 300 candles) are
+        fetched with :meth:`copra.rest.Client.historic_rates`. They replace
+        the closed candles for the same intervals, filling in the trades
+        missed while the client was disconnected. The open candle is merged
+        with the REST candle for its interval: its low, high and volume are
+        widened to cover both and its open is taken from the REST API.
+
+        This is called automatically after a reconnect if the builder is
+        attached to a client with a rest_client. Call it directly once
+        after attaching to seed the candles.
+
+        :param rest_client: The REST client to fetch candles with.
+        :type rest_client: copra.rest.Client
+
+        :param product_ids: (optional) The products to reconcile. The default
+            is None, all of them.
+        :type product_ids: list of str
+
+        :param float start: (optional) The Unix time to reconcile from. At
+            most the last 300 candles of each granularity are fetched. The
+            default is None, the last 300 candles.
+
+        :raises APIRequestError: Any error generated by the Coinbase Pro API
+            server.
+        """
+        if product_ids is None:
+            product_ids = self.product_ids
+        for product_id in product_ids:
+            for candles in self._series[product_id]:
+                granularity = candles.granularity
+                if granularity not in REST_GRANULARITIES:
+                    continue
+                kwargs = {}
+                if start is not None:
+                    now = time.time()
+                    since = max(start, now - 299 * granularity)
+                    since = int(since // granularity) * granularity
+                    kwargs = {'start': _isoformat(since),
+                              'end': _isoformat(now)}
+                rates = await rest_client.historic_rates(
+                    product_id, granularity, **kwargs)
+                self._apply_rates(candles, rates)
+
+    def _apply_rates(self, candles, rates):
+        fetched = sorted(Candle(int(rate[0]), *map(float, rate[1:6]))
+                         for rate in rates)
+        current = candles.current
+        if current is not None:
+            if fetched and fetched[-1].time == current[0]:
+                rest = fetched.pop()
+                current[1] = min(current[1], rest.low)
+                current[2] = max(current[2], rest.high)
+                current[3] = rest.open
+                current[5] = max(current[5], rest.volume)
+            fetched = [candle for candle in fetched
+                       if candle.time < current[0]]
+        elif fetched:
+            # Adopt the REST API's latest candle as the open candle if its
+            # interval hasn't ended yet.
+            last = fetched[-1]
+            if last.time + candles.granularity > time.time():
+                candles.current = list(fetched.pop())
+        candles.merge(fetched)
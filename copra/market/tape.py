@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""A trade tape with rolling VWAP and volume statistics.
+
+"""
+
+from copra.websocket.channel import Channel
+from copra.websocket.latency import parse_time
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+BUY = 1
+SELL = -1
+
+
+class _Window:
+    """Running totals of the trades in the last length seconds.
+
+    tail is the number of trades written to the tape before the oldest trade
+    still in the window.
+    """
+
+    __slots__ = ('length', 'tail', 'count', 'volume', 'notional',
+                 'buy_volume')
+
+    def __init__(self, length):
+        self.length = length
+        self.tail = 0
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.volume = 0.0
+        self.notional = 0.0
+        self.buy_volume = 0.0
+
+
+class _Tape:
+    """The ring buffers and windows of one product."""
+
+    __slots__ = ('times', 'prices', 'sizes', 'sides', 'capacity', 'head',
+                 'windows', 'truncated')
+
+    def __init__(self, capacity, windows):
+        self.times = numpy.zeros(capacity, dtype=numpy.float64)
+        self.prices = numpy.zeros(capacity, dtype=numpy.float64)
+        self.sizes = numpy.zeros(capacity, dtype=numpy.float64)
+        self.sides = numpy.zeros(capacity, dtype=numpy.int8)
+        self.capacity = capacity
+        # The number of trades written.
+        self.head = 0
+        self.windows = {length: _Window(length) for length in windows}
+        self.truncated = 0
+
+    def append(self, timestamp, price, size, side):
+        head = self.head
+        capacity = self.capacity
+        # Trades about to be overwritten leave every window first.
+        if head >= capacity:
+            for window in self.windows.values():
+                if window.tail <= head - capacity:
+                    self.truncated += 1
+                    self._expire(window, head - capacity + 1)
+        index = head % capacity
+        self.times[index] = timestamp
+        self.prices[index] = price
+        self.sizes[index] = size
+        self.sides[index] = side
+        self.head = head + 1
+        notional = price * size
+        for window in self.windows.values():
+            window.count += 1
+            window.volume += size
+            window.notional += notional
+            if side == BUY:
+                window.buy_volume += size
+            self.expire(window, timestamp)
+
+    def expire(self, window, now):
+        """Remove the trades older than the window from it."""
+        times = self.times
+        capacity = self.capacity
+        oldest = now - window.length
+        tail = window.tail
+        head = self.head
+        while tail < head and times.item(tail % capacity) <= oldest:
+            tail += 1
+        if tail != window.tail:
+            self._expire(window, tail)
+
+    def _expire(self, window, tail):
+        """Remove the trades before tail from a window."""
+        if tail >= self.head:
+            window.tail = self.head
+            window.reset()
+            return
+        capacity = self.capacity
+        if tail - window.tail <= 8:
+            # NumPy's per call overhead outweighs the loop for a few trades,
+            # which is how many usually leave a window per trade.
+            prices, sizes, sides = self.prices, self.sizes, self.sides
+            for position in range(window.tail, tail):
+                index = position % capacity
+                size = sizes.item(index)
+                window.count -= 1
+                window.volume -= size
+                window.notional -= prices.item(index) * size
+                if sides.item(index) == BUY:
+                    window.buy_volume -= size
+            window.tail = tail
+            return
+        start, end = window.tail % capacity, tail % capacity
+        if start < end:
+            pieces = [slice(start, end)]
+        else:
+            pieces = [slice(start, capacity), slice(0, end)]
+        for piece in pieces:
+            sizes = self.sizes[piece]
+            window.count -= len(sizes)
+            window.volume -= float(sizes.sum())
+            window.notional -= float(numpy.dot(self.prices[piece], sizes))
+            window.buy_volume -= float(sizes[self.sides[piece] == BUY].sum())
+        window.tail = tail
+
+    def ordered(self, array, count):
+        """Return the last count values of a ring buffer, oldest first."""
+        head, capacity = self.head, self.capacity
+        count = min(count, head, capacity)
+        start, end = (head - count) % capacity, head % capacity
+        if count and start >= end:
+            return numpy.concatenate((array[start:], array[:end]))
+        return array[start:start + count].copy()
+
+
+class TradeTape:
+    """The recent trades of several products, with rolling VWAP, volume,
+    trade count and buy/sell imbalance over one or more time windows.
+
+    Each trade (a ``match`` message) is written to preallocated NumPy ring
+    buffers of its product's time, price, size and side. Each window keeps
+    running totals that are updated as trades enter it and leave it, so
+    adding a trade costs O(number of windows) amortized however long the
+    windows are, and reading the statistics costs O(1).
+
+    The side of a trade is that of the taker: BUY (1) if the taker bought,
+    i.e. the resting order was a sell, and SELL (-1) otherwise.
+
+    Each product's ring buffers hold capacity trades. It should be large
+    enough to hold the trades of the longest window. If it isn't, the
+    oldest trades leave the windows early when they are overwritten, and
+    the tape's truncated count is incremented.
+
+    :ivar tuple product_ids: The product ids of the tape.
+    :ivar tuple windows: The window lengths in seconds, shortest first.
+    :ivar int capacity: The number of trades kept per product.
+    :ivar int trades: The number of trades processed.
+    """
+
+    def __init__(self, product_ids, windows=(60, 300, 3600), capacity=100000):
+        """
+
+        :param product_ids: The product ids to keep trades for.
+        :type product_ids: str or list of str
+
+        :param windows: (optional) The lengths in seconds of the windows to
+            keep statistics for. The default is 1, 5 and 60 minutes.
+        :type windows: tuple of float
+
+        :param int capacity: (optional) The number of trades kept per
+            product. The default is 100000.
+
+        :raises ImportError: If NumPy is not installed.
+        """
+        if numpy is None:
+            raise ImportError('TradeTape requires NumPy')
+        if isinstance(product_ids, str):
+            product_ids = [product_ids]
+        self.product_ids = tuple(product_ids)
+        self.windows = tuple(sorted(windows))
+        self.capacity = capacity
+        self.trades = 0
+        self._tapes = {product_id: _Tape(capacity, self.windows)
+                       for product_id in self.product_ids}
+        self._trade_ids = {}
+
+    def __repr__(self):
+        return 'TradeTape({!r}, windows={!r})'.format(list(self.product_ids),
+                                                      self.windows)
+
+    def attach(self, client):
+        """Keep the trades a WebSocket client receives.
+
+        The client is subscribed to the matches channel for the tape's
+        products.
+
+        :param client: The client to attach to.
+        :type client: copra.websocket.Client
+        """
+        for product_id in self.product_ids:
+            client.on('match', self.process, product_id=product_id)
+        client.subscribe(Channel('matches', list(self.product_ids)))
+
+    def detach(self, client):
+        """Stop receiving trades from a WebSocket client.
+
+        The client remains subscribed to the matches channel.
+
+        :param client: The client to detach from.
+        :type client: copra.websocket.Client
+        """
+        for product_id in self.product_ids:
+            client.off('match', self.process, product_id=product_id)
+
+    def process(self, message):
+        """Add a trade to the tape of its product.
+
+        Messages that are not matches for one of the tape's products, and
+        trades that have already been processed, are ignored.
+
+        :param dict message: Dictionary representing the message.
+        """
+        if message.get('type') != 'match':
+            return
+        product_id = message['product_id']
+        tape = self._tapes.get(product_id)
+        if tape is None:
+            return
+        trade_id = message['trade_id']
+        if trade_id <= self._trade_ids.get(product_id, 0):
+            return
+        self._trade_ids[product_id] = trade_id
+        self.trades += 1
+        tape.append(parse_time(message['time']),
+                    float(message['price']), float(message['size']),
+                    BUY if message['side'] == 'sell' else SELL)
+
+    def _tape(self, product_id):
+        try:
+            return self._tapes[product_id]
+        except KeyError:
+            raise ValueError('no trades for {}'.format(product_id)) from None
+
+    def stats(self, product_id, window, now=None):
+        """Return the statistics of a product's trades in a window.
+
+        :param str product_id: The product id.
+
+        :param float window: One of the tape's window lengths.
+
+        :param float now: (optional) The current Unix time. Trades older than
+            window seconds before it are left out. The default is None, in
+            which case the window ends at the last trade.
+
+        :returns: A dict with the count, volume, buy_volume, sell_volume,
+            vwap (None if there were no trades) and imbalance, the buy
+            volume minus the sell volume over the volume (0.0 if there were
+            no trades).
+
+        :raises ValueError: If the tape has no such product or window.
+        """
+        tape = self._tape(product_id)
+        try:
+            totals = tape.windows[window]
+        except KeyError:
+            raise ValueError('no {}s window'.format(window)) from None
+        if now is not None:
+            tape.expire(totals, now)
+        volume = totals.volume
+        if totals.count and volume > 0:
+            buy_volume = totals.buy_volume
+            sell_volume = volume - buy_volume
+            vwap = totals.notional / volume
+            imbalance = (buy_volume - sell_volume) / volume
+        else:
+            volume = buy_volume = sell_volume = imbalance = 0.0
+            vwap = None
+        return {'count': totals.count, 'volume': volume,
+                'buy_volume': buy_volume, 'sell_volume': sell_volume,
+                'vwap': vwap, 'imbalance': imbalance}
+
+    def to_numpy(self, product_id, count=None):
+        """Return the last trades of a product as NumPy arrays, oldest first.
+
+        :param str product_id: The product id.
+
+        :param int count: (optional) The number of trades to return. The
+            default is None, all of the trades the tape holds.
+
+        :returns: A tuple of four new arrays: the times (Unix timestamps),
+            prices, sizes and sides (BUY or SELL) of the trades.
+
+        :raises ValueError: If the tape has no such product.
+        """
+        tape = self._tape(product_id)
+        if count is None:
+            count = tape.capacity
+        return tuple(tape.ordered(array, count)
+                     for array in (tape.times, tape.prices, tape.sizes,
+                                   tape.sides))
+
+    def truncated(self, product_id):
+        """Return the number of times trades left a window of a product
+        early because the ring buffers were full.
+
+        :param str product_id: The product id.
+        """
+        return self._tape(product_id).truncated
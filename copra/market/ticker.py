@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Conflated, latest-value store of ticker messages.
+
+"""
+
+from collections import OrderedDict
+
+from copra.websocket.channel import Channel
+
+
+class TickerStore:
+    """The latest ticker message of each product.
+
+    Each ticker message replaces the previous one for its product, so
+    consumers that only need current prices can sample the store at their
+    own rate instead of handling every message. Storing a message costs a
+    couple of dict operations and nothing is parsed.
+
+    Every stored message advances the store's version. Consumers remember
+    the version they last saw and pass it to :meth:`changed_since` to get
+    only the products that have ticked since, no matter how many times each
+    one ticked in between.
+
+    :ivar int version: The number of ticker messages stored.
+    :ivar int dropped: The number of ticker messages ignored because a
+        message with a later sequence number had already been stored.
+    """
+
+    def __init__(self, product_ids=None):
+        """
+
+        :param product_ids: (optional) The product ids to store tickers for.
+            The default is None, in which case the tickers of every product
+            the client receives are stored.
+        :type product_ids: str or list of str
+        """
+        if isinstance(product_ids, str):
+            product_ids = [product_ids]
+        self.product_ids = tuple(product_ids) if product_ids else None
+        self.version = 0
+        self.dropped = 0
+        # product id: [version, message], the most recently changed last.
+        self._latest = OrderedDict()
+
+    def __len__(self):
+        return len(self._latest)
+
+    def __repr__(self):
+        return 'TickerStore(products={}, version={})'.format(len(self),
+                                                             self.version)
+
+    def attach(self, client):
+        """Store the ticker messages a WebSocket client receives.
+
+        If the store has product ids, the client is subscribed to the ticker
+        channel for them.
+
+        :param client: The client to attach to.
+        :type client: copra.websocket.Client
+        """
+        if self.product_ids is None:
+            client.on('ticker', self.process)
+            return
+        for product_id in self.product_ids:
+            client.on('ticker', self.process, product_id=product_id)
+        client.subscribe(Channel('ticker', list(self.product_ids)))
+
+    def detach(self, client):
+        """Stop storing the ticker messages of a WebSocket client.
+
+        The client remains subscribed to the ticker channel.
+
+        :param client: The client to detach from.
+        :type client: copra.websocket.Client
+        """
+        if self.product_ids is None:
+            client.off('ticker', self.process)
+            return
+        for product_id in self.product_ids:
+            client.off('ticker', self.process, product_id=product_id)
+
+    def process(self, message):
+        """Store a ticker message.
+
+        :param dict message: Dictionary representing the message.
+        """
+        product_id = message['product_id']
+        entry = self._latest.get(product_id)
+        if entry is not None:
+            sequence = message.get('sequence')
+            if (sequence is not None and
+                    sequence < entry[1].get('sequence', sequence)):
+                self.dropped += 1
+                return
+            self._latest.move_to_end(product_id)
+        self.version += 1
+        self._latest[product_id] = [self.version, message]
+
+    def latest(self, product_id):
+        """Return the latest ticker message of a product.
+
+        :param str product_id: The product id.
+
+        :returns: The message dict, or None if there hasn't been one.
+        """
+        entry = self._latest.get(product_id)
+        return entry[1] if entry is not None else None
+
+    def changed_since(self, version):
+        """Return the latest ticker message of every product that has
+        ticked since a version.
+
+        This takes time proportional to the number of products returned,
+        not to the number of products in the store.
+
+        :param int version: A version previously returned, or 0 for all
+            products.
+
+        :returns: A tuple of the current version, to pass to the next call,
+            and a dict of the latest message keyed by product id.
+        """
+        changed = {}
+        latest = self._latest
+        for product_id in reversed(latest):
+            entry = latest[product_id]
+            if entry[0] <= version:
+                break
+            changed[product_id] = entry[1]
+        return self.version, changed
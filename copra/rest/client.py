@@ -5,10 +5,7 @@ for the Coinbase Pro platform.
 """
 
 import asyncio
-import base64
 from datetime import datetime, timedelta
-import hashlib
-import hmac
 import json
 import sys
 import time
@@ -19,6 +16,7 @@ import dateutil.parser
 from multidict import CIMultiDict
 
 from copra import __version__
+from copra.signer import Signer
 
 URL = 'https://api.pro.coinbase.com'
 SANDBOX_URL = 'https://api-public.sandbox.pro.coinbase.com'
@@ -74,7 +72,8 @@ class Client:
         
     """
     
-    def __init__(self, loop, url=URL, auth=False, key='', secret='', passphrase=''):
+    def __init__(self, loop, url=URL, auth=False, key='', secret='', passphrase='',
+                 signer=None):
         """
         
         :param loop: The asyncio loop that the client runs in.
@@ -97,20 +96,30 @@ class Client:
             
         :param str passphrase: (optional) The passphrase for the API key used 
             for authentication. Required if auth is True. The default is ''.
-            
-        :raises ValueError: If auth is True and key, secret, and passphrase are
-            not provided.
+
+        :param signer: (optional) The signer to authenticate requests with,
+            which may be shared with other clients. If provided, key, secret,
+            and passphrase are not needed. The default is None, in which case
+            a signer is created from key, secret, and passphrase if auth is
+            True.
+        :type signer: copra.signer.Signer
+            
+        :raises ValueError: If auth is True and neither a signer nor key,
+            secret, and passphrase are provided.
         """
         self.loop = loop
         self.url = url
         
-        if auth and not (key and secret and passphrase):
+        if auth and signer is None and not (key and secret and passphrase):
             raise ValueError('auth requires key, secret, and passphrase')
         
         self.auth = auth
-        self.key = key
+        self.key = key if signer is None else signer.key
         self.secret = secret
-        self.passphrase = passphrase
+        self.passphrase = passphrase if signer is None else signer.passphrase
+        if auth and signer is None:
+            signer = Signer(key, secret, passphrase)
+        self.signer = signer
 
         self.session = aiohttp.ClientSession(loop=loop)
 
@@ -151,7 +160,8 @@ class Client:
             exists for testing purposes and generally should not be used. If a 
             timestamp is provided it must be within 30 seconds of the API 
             server's time. This can be found using: 
-            :meth:`copra.rest.Client.server_time`.
+            :meth:`copra.rest.Client.server_time`. The default is None, in
+            which case the signer's estimate of the server time is used.
             
         :returns: A dict of headers to be added to the request.
         
@@ -160,22 +170,15 @@ class Client:
         if not self.auth:
             raise ValueError('client is not properly configured for authorization')
             
-        if not timestamp:
-            timestamp = time.time()
-        timestamp = str(timestamp)
-        message = timestamp + method + path + data
-        message = message.encode('ascii')
-        hmac_key = base64.b64decode(self.secret)
-        signature = hmac.new(hmac_key, message, hashlib.sha256)
-        signature_b64 = base64.b64encode(signature.digest()).decode('utf-8')
+        timestamp, signature = self.signer.sign(path, method, data, timestamp)
         
         return {
             'USER-AGENT': USER_AGENT,
             'Content-Type': 'Application/JSON',
-            'CB-ACCESS-SIGN': signature_b64,
+            'CB-ACCESS-SIGN': signature,
             'CB-ACCESS-TIMESTAMP': timestamp,
-            'CB-ACCESS-KEY': self.key,
-            'CB-ACCESS-PASSPHRASE': self.passphrase
+            'CB-ACCESS-KEY': self.signer.key,
+            'CB-ACCESS-PASSPHRASE': self.signer.passphrase
         }
 
      
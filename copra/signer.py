@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Request signing shared by the REST and WebSocket clients.
+
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Signer:
+    """Signs authenticated requests to Coinbase Pro with an API key.
+
+    The secret is decoded and loaded into an HMAC-SHA256 object once. Each
+    signature is made from a copy of it, so signing doesn't decode the
+    secret or derive the HMAC key again.
+
+    Timestamps are the local time plus an offset, the difference between
+    the API server's clock and the local one. The offset is 0 until
+    :meth:`sync` measures it, and :meth:`start` keeps it up to date in the
+    background, so requests aren't rejected as expired when the local clock
+    drifts. One signer can be shared by any number of REST and WebSocket
+    clients using the same API key.
+
+    :ivar str key: The API key.
+    :ivar str passphrase: The passphrase for the API key.
+    :ivar float offset: The seconds added to the local time to get the API
+        server's time.
+    :ivar float synced_at: The local time, per time.time(), the offset was
+        last measured, or None if it hasn't been.
+    """
+
+    def __init__(self, key, secret, passphrase):
+        """
+
+        :param str key: The API key.
+
+        :param str secret: The base64-encoded secret string for the API key.
+
+        :param str passphrase: The passphrase for the API key.
+
+        :raises ValueError: If key, secret, or passphrase are not provided.
+        """
+        if not (key and secret and passphrase):
+            raise ValueError('Signer requires key, secret, and passphrase')
+        self.key = key
+        self.passphrase = passphrase
+        self._hmac = hmac.new(base64.b64decode(secret),
+                              digestmod=hashlib.sha256)
+        self.offset = 0.0
+        self.synced_at = None
+        self._task = None
+
+    def __repr__(self):
+        return 'Signer(key={!r}, offset={:.3f})'.format(self.key, self.offset)
+
+    def timestamp(self):
+        """Return the current API server time estimated from the local clock.
+
+        :returns: The time as a str, in seconds since the epoch.
+        """
+        return str(time.time() + self.offset)
+
+    def sign(self, path, method='GET', data='', timestamp=None):
+        """Sign a request.
+
+        :param str path: The path portion of the request, including any query
+            string. For example, '/orders?status=open'.
+
+        :param str method: (optional) The method of the request. The default
+            is GET.
+
+        :param str data: (optional) The body of the request. The default is ''.
+
+        :param timestamp: (optional) A UNIX timestamp. The default is None,
+            in which case :meth:`timestamp` is used.
+        :type timestamp: str or float
+
+        :returns: A tuple of the timestamp (a str) and the base64-encoded
+            signature (a str).
+        """
+        if not timestamp:
+            timestamp = self.timestamp()
+        timestamp = str(timestamp)
+        signature = self._hmac.copy()
+        signature.update((timestamp + method + path + data).encode('ascii'))
+        return timestamp, base64.b64encode(signature.digest()).decode('utf-8')
+
+    async def sync(self, rest_client):
+        """Measure the offset between the API server's clock and the local
+        one.
+
+        The server's time is taken to be its reported time at the midpoint of
+        the request.
+
+        :param rest_client: The client to get the server time with.
+        :type rest_client: copra.rest.Client
+
+        :returns: The offset in seconds.
+
+        :raises APIRequestError: Any error generated by the Coinbase Pro API
+            server.
+        """
+        sent = time.time()
+        server_time = await rest_client.server_time()
+        received = time.time()
+        self.offset = float(server_time['epoch']) - (sent + received) / 2
+        self.synced_at = received
+        return self.offset
+
+    def start(self, rest_client, interval=300.0):
+        """Sync the offset now and then every interval seconds in the
+        background until :meth:`stop` is called.
+
+        Failed syncs are logged and the previous offset is kept.
+
+        :param rest_client: The client to get the server time with.
+        :type rest_client: copra.rest.Client
+
+        :param float interval: (optional) The seconds between syncs. The
+            default is 300.0.
+
+        :returns: The asyncio task doing the syncing.
+        """
+        self.stop()
+        self._task = rest_client.loop.create_task(
+            self._refresh(rest_client, interval))
+        return self._task
+
+    def stop(self):
+        """Stop syncing the offset in the background."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _refresh(self, rest_client, interval):
+        while True:
+            try:
+                await self.sync(rest_client)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Failed to sync with the server clock.')
+            await asyncio.sleep(interval)
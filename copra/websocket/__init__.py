@@ -1,2 +1,11 @@
 from copra.websocket.channel import Channel
-from copra.websocket.client import Client, FEED_URL, SANDBOX_FEED_URL
\ No newline at end of file
+from copra.websocket.client import Client, FEED_URL, SANDBOX_FEED_URL
+from copra.websocket.latency import LatencyMonitor
+from copra.websocket.pool import ProcessPool
+from copra.websocket.queue import MessageQueue
+from copra.websocket.recorder import Recorder
+from copra.websocket.replay import Replayer
+from copra.websocket.server import FeedServer
+from copra.websocket.sharded import ShardedClient
+from copra.websocket.watchdog import Watchdog
+from copra.websocket.workers import ProductWorkers
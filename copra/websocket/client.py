@@ -4,22 +4,37 @@
 """
 
 import asyncio
-import base64
-import hashlib
-import hmac
+import itertools
 import json
 import logging
+import random
 import time
 from urllib.parse import urlparse
 
 from autobahn.asyncio.websocket import WebSocketClientFactory
 from autobahn.asyncio.websocket import WebSocketClientProtocol
+from autobahn.websocket.compress import (PerMessageDeflateOffer,
+                                         PerMessageDeflateResponse,
+                                         PerMessageDeflateResponseAccept)
+
+from copra.signer import Signer
+from copra.websocket.channel import Channel
+from copra.websocket.decoders import LazyMessage, get_decoder
+from copra.websocket.dispatch import HandlerTable
+from copra.websocket.queue import BLOCK, MessageQueue
 
 logger = logging.getLogger(__name__)
 
 FEED_URL = 'wss://ws-feed.pro.coinbase.com:443'
 SANDBOX_FEED_URL = 'wss://ws-feed-public.sandbox.pro.coinbase.com:443'
 
+# Unique (per process) ids of the connections made by all clients.
+_CONNECTION_IDS = itertools.count(1)
+
+# Full channel message types whose sequence numbers are contiguous per product.
+SEQUENCED_TYPES = frozenset(('received', 'open', 'done', 'match', 'change',
+                             'activate'))
+
 
 class ClientProtocol(WebSocketClientProtocol):
     """Websocket client protocol.
@@ -37,6 +52,7 @@ class ClientProtocol(WebSocketClientProtocol):
 
         You now can send and receive WebSocket messages.
         """
+        self.factory.compression_stats._opened(self)
         self.factory.on_open()
 
     def onClose(self, wasClean, code, reason):
@@ -50,24 +66,189 @@ class ClientProtocol(WebSocketClientProtocol):
           code (int or None): Close status code as sent by the WebSocket peer.
           reason (str or None): Close reason as sent by the WebSocket peer.
         """
+        self.factory.compression_stats._closed()
         self.factory.on_close(wasClean, code, reason)
 
     def onMessage(self, payload, isBinary):
         """Callback fired when a complete WebSocket message was received.
 
-        Call its factory's (the client's) on_message method with a
-        dict representing the JSON message receieved.
+        Decode the JSON message with its factory's (the client's) decoder
+        and pass the resulting dict on to the client. Messages the client's
+        pool accepts are handed to it undecoded instead. If the client is
+        lazy, the message is passed on as a LazyMessage.
+
+        The receive time is only taken if the client records, times or
+        measures the latency of messages, and is shared by all three.
 
         Args:
             payload (bytes): The WebSocket message received.
             isBinary (bool): Flag indicating whether payload is binary or UTF-8
             encoded text.
         """
-        msg = json.loads(payload.decode('utf8'))
-        if msg['type'] == 'error':
-            self.factory.on_error(msg['message'], msg.get('reason', ''))
+        factory = self.factory
+        recorder = factory.recorder
+        latency = factory.latency
+        if recorder is not None or latency is not None or factory.timestamps:
+            received = time.time()
+            started = time.monotonic()
+            if recorder is not None:
+                recorder.record(payload, factory.connection_id, received,
+                                started)
+        pool = factory.pool
+        if pool is not None and pool.submit(payload):
+            return
+        if factory.lazy:
+            msg = LazyMessage(payload, factory.decode)
         else:
-            self.factory.on_message(msg)
+            msg = factory.decode(payload)
+        if msg['type'] == 'error':
+            factory.on_error(msg['message'], msg.get('reason', ''))
+            return
+        if factory.timestamps:
+            msg['received'] = received
+        if factory._process_message(msg) and latency is not None:
+            latency.observe(msg, received, started, time.monotonic())
+
+
+class ReconnectStats:
+    """Reconnection metrics of a WebSocket client.
+
+    :ivar int attempts: The number of reconnect attempts since the last
+        connection that received a message.
+    :ivar int total_attempts: The total number of reconnect attempts.
+    :ivar int reconnects: The number of times the connection was reopened
+        after closing unexpectedly.
+    :ivar float disconnected_at: The time (per time.monotonic) the connection
+        last closed unexpectedly, or the first connection attempt failed, or
+        None if it has since (re)opened.
+    :ivar float time_disconnected: The total number of seconds the client has
+        spent disconnected after the connection closed unexpectedly or the
+        first connection attempt failed.
+    :ivar float last_outage: The number of seconds from the last unexpected
+        close (or failed first attempt) to the connection opening or None if
+        there hasn't been one.
+    :ivar float first_message_delay: The number of seconds from the last time
+        the connection opened to the first message received over it or None
+        if no message has been received yet.
+    """
+
+    def __init__(self):
+        self.attempts = 0
+        self.total_attempts = 0
+        self.reconnects = 0
+        self.disconnected_at = None
+        self.time_disconnected = 0.0
+        self.last_outage = None
+        self.first_message_delay = None
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+class _MeteredDeflate:
+    """Wraps the permessage-deflate processor of a connection to count the
+    messages it decompresses and the CPU time it spends doing so.
+    """
+
+    def __init__(self, pmce, stats):
+        self._pmce = pmce
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._pmce, name)
+
+    def start_decompress_message(self):
+        self._stats.messages += 1
+        self._pmce.start_decompress_message()
+
+    def decompress_message_data(self, data):
+        started = time.process_time()
+        data = self._pmce.decompress_message_data(data)
+        self._stats.cpu_time += time.process_time() - started
+        return data
+
+    def end_decompress_message(self):
+        started = time.process_time()
+        self._pmce.end_decompress_message()
+        self._stats.cpu_time += time.process_time() - started
+
+
+class CompressionStats:
+    """Compression metrics of a WebSocket client.
+
+    The byte counts are of message payloads, excluding WebSocket frame
+    headers, over all of the client's connections. Without compression they
+    are equal.
+
+    :ivar dict negotiated: The permessage-deflate parameters of the current
+        (or last) connection, or None if compression wasn't negotiated.
+    :ivar int messages: The number of compressed messages received.
+    :ivar float cpu_time: The CPU time in seconds (per time.process_time)
+        spent decompressing them.
+    """
+
+    def __init__(self):
+        self.negotiated = None
+        self.messages = 0
+        self.cpu_time = 0.0
+        self._compressed_bytes = 0
+        self._uncompressed_bytes = 0
+        self._traffic = None
+
+    def __repr__(self):
+        return str({'negotiated': self.negotiated, 'messages': self.messages,
+                    'cpu_time': self.cpu_time,
+                    'compressed_bytes': self.compressed_bytes,
+                    'uncompressed_bytes': self.uncompressed_bytes})
+
+    @property
+    def compressed_bytes(self):
+        """The number of bytes received, before decompression."""
+        traffic = self._traffic
+        if traffic is None:
+            return self._compressed_bytes
+        return self._compressed_bytes + traffic.incomingOctetsWebSocketLevel
+
+    @property
+    def uncompressed_bytes(self):
+        """The number of bytes received, after decompression."""
+        traffic = self._traffic
+        if traffic is None:
+            return self._uncompressed_bytes
+        return self._uncompressed_bytes + traffic.incomingOctetsAppLevel
+
+    def ratio(self):
+        """Return the compressed bytes over the uncompressed bytes, or None
+        if nothing has been received.
+        """
+        uncompressed = self.uncompressed_bytes
+        return self.compressed_bytes / uncompressed if uncompressed else None
+
+    def cpu_per_message(self):
+        """Return the mean CPU time in seconds spent decompressing a
+        message, or None if no compressed message has been received.
+        """
+        return self.cpu_time / self.messages if self.messages else None
+
+    def _opened(self, protocol):
+        """Start counting the traffic of a newly opened connection."""
+        self._closed()
+        self._traffic = getattr(protocol, 'trafficStats', None)
+        pmce = getattr(protocol, '_perMessageCompress', None)
+        if pmce is None:
+            self.negotiated = None
+            return
+        self.negotiated = {key: value for key, value in pmce.__json__().items()
+                           if key not in ('extension', 'is_server')}
+        protocol._perMessageCompress = _MeteredDeflate(pmce, self)
+
+    def _closed(self):
+        """Add the traffic of the connection that closed to the totals."""
+        traffic = self._traffic
+        if traffic is not None:
+            self._compressed_bytes += traffic.incomingOctetsWebSocketLevel
+            self._uncompressed_bytes += traffic.incomingOctetsAppLevel
+            self._traffic = None
 
 
 class Client(WebSocketClientFactory):
@@ -77,7 +258,13 @@ class Client(WebSocketClientFactory):
     def __init__(self, loop, channels, feed_url=FEED_URL,
                  auth=False, key='', secret='', passphrase='',
                  auto_connect=True, auto_reconnect=True,
-                 name='WebSocket Client'):
+                 name='WebSocket Client', rest_client=None, decoder=None,
+                 reconnect_delay=1.0, max_reconnect_delay=60.0,
+                 reconnect_jitter=0.5, max_reconnect_attempts=None,
+                 pool=None, recorder=None, latency=None, timestamps=False,
+                 subscription_window=None, max_subscription_pairs=500,
+                 signer=None, lazy=False, compression=False,
+                 compression_window_bits=None, compression_mem_level=None):
         """
         
         :param loop: The asyncio loop that the client runs in.
@@ -110,12 +297,114 @@ class Client(WebSocketClientFactory):
             
         :param bool auto_reconnect: If True, the Client will attemp to autom-
             matically reconnect and resubscribe if the connection is closed any
-            way but by the Client explicitly itself. The default is True.
+            way but by the Client explicitly itself, or if a connection attempt
+            fails. The default is True.
                 
         :param str name: A name to identify this client in logging, etc.
+
+        :param rest_client: (optional) The REST client used to fetch a level 3
+            order book snapshot when a gap in the sequence numbers of a
+            product on the full channel is detected. If None, gaps are logged
+            but not repaired. The default is None.
+        :type rest_client: copra.rest.Client
+
+        :param decoder: (optional) The JSON decoder used to decode messages.
+            Either the name of a decoder ('orjson', 'ujson' or 'json') or a
+            callable that takes the UTF-8 encoded bytes of a message and
+            returns a dict. The default is None, in which case orjson or
+            ujson are used if installed and the standard library if not.
+        :type decoder: str or callable
+
+        :param float reconnect_delay: (optional) The base delay in seconds
+            between reconnect attempts. The first attempt is made immediately
+            and each one after that waits reconnect_delay * 2 ** (n - 2)
+            seconds, up to max_reconnect_delay. The default is 1.0.
+
+        :param float max_reconnect_delay: (optional) The maximum delay in
+            seconds between reconnect attempts. The default is 60.0.
+
+        :param float reconnect_jitter: (optional) The fraction, from 0 to 1, of
+            each delay that is randomized so that many clients disconnected
+            at once don't reconnect in lockstep. A delay d is drawn uniformly
+            from [d * (1 - reconnect_jitter), d]. The default is 0.5.
+
+        :param int max_reconnect_attempts: (optional) The number of consecutive
+            failed reconnect attempts after which the client gives up. An
+            attempt succeeds once a message is received over the new
+            connection. The default is None, in which case the client never
+            gives up.
+
+        :param pool: (optional) A pool of worker processes to decode and
+            process messages that have a product id. The pool is started when
+            the client is created and closed when it is closed. Records the
+            workers return are passed to on_record. The default is None, in
+            which case all messages are handled in the loop's thread.
+        :type pool: copra.websocket.ProcessPool
+
+        :param recorder: (optional) A recorder to write every raw message
+            received to, along with its receive times and connection id. The
+            default is None.
+        :type recorder: copra.websocket.Recorder
+
+        :param latency: (optional) A monitor to record the exchange to receive
+            and receive to handled latency of every message decoded, per
+            channel and product. The default is None.
+        :type latency: copra.websocket.LatencyMonitor
+
+        :param bool timestamps: (optional) If True, the time each message was
+            received, per time.time(), is added to it as 'received' before it
+            is dispatched. The default is False.
+
+        :param float subscription_window: (optional) If set, the subscribe
+            and unsubscribe calls made while connected are not sent at once.
+            Calls made within this many seconds (or, if 0, within the same
+            loop iteration) are merged into the smallest set of changes and
+            sent together. The default is None, in which case each call is
+            sent immediately.
+
+        :param int max_subscription_pairs: (optional) The maximum number of
+            channel and product id pairs sent in one subscribe or unsubscribe
+            message. Longer lists are split across several messages to keep
+            frames small. The default is 500.
+
+        :param signer: (optional) The signer to authenticate subscriptions
+            with, which may be shared with other clients. If provided, key,
+            secret, and passphrase are not needed. The default is None, in
+            which case a signer is created from key, secret, and passphrase
+            if auth is True.
+        :type signer: copra.signer.Signer
+
+        :param bool lazy: (optional) If True, messages are passed on as
+            :class:`copra.websocket.decoders.LazyMessage` objects, which
+            are only decoded once a handler reads a field other than type,
+            product_id or sequence. Messages no handler is registered for
+            are dropped, undecoded, and counted in the client's dropped
+            attribute, and neither handlers nor on_message are called for
+            them. The default is False.
+
+        :param bool compression: (optional) If True, permessage-deflate
+            compression is offered to the server when connecting. If the
+            server accepts, it sends messages compressed, which uses less
+            bandwidth but more CPU time to decompress them. The client's
+            compression_stats attribute counts both. The default is False.
+
+        :param int compression_window_bits: (optional) The base two logarithm,
+            from 8 to 15, of the largest compression window the server is
+            asked to use. Smaller windows use less memory at both ends and
+            compress less. The default is None, in which case the server
+            chooses, usually 15.
+
+        :param int compression_mem_level: (optional) The memory level, from 1
+            to 9, of the client's compressor, which only compresses the
+            (subscription) messages the client sends. The default is None,
+            in which case 8 is used.
         
-        :raises ValueError: If auth is True and key, secret, and passphrase are
-            not provided.
+        :raises ValueError:
+            * auth is True and neither a signer nor key, secret, and
+              passphrase are provided.
+            * decoder is the name of a decoder that is not installed.
+            * compression_window_bits or compression_mem_level is out of
+              range.
         """
 
         self.loop = loop
@@ -132,25 +421,91 @@ class Client(WebSocketClientFactory):
         self.feed_url = feed_url
 
         self.channels = {}
+        self._sequences = {}
+        self._resyncing = {}
         self.subscribe(channels)
 
-        if auth and not (key and secret and passphrase):
+        self._dispatch = HandlerTable()
+        self._queues = {}
+        self._blockers = set()
+        self.rest_client = rest_client
+        self.decode = get_decoder(decoder)
+        self.lazy = lazy
+        self.dropped = 0
+
+        if auth and signer is None and not (key and secret and passphrase):
             raise ValueError('auth requires key, secret, and passphrase')
 
         self.auth = auth
-        self.key = key
+        self.key = key if signer is None else signer.key
         self.secret = secret
-        self.passphrase = passphrase
+        self.passphrase = passphrase if signer is None else signer.passphrase
+        if auth and signer is None:
+            signer = Signer(key, secret, passphrase)
+        self.signer = signer
+
+        if compression_window_bits is not None and not (
+                8 <= compression_window_bits <= 15):
+            raise ValueError('compression_window_bits must be from 8 to 15')
+        if compression_mem_level is not None and not (
+                1 <= compression_mem_level <= 9):
+            raise ValueError('compression_mem_level must be from 1 to 9')
+        self.compression = compression
+        self.compression_window_bits = compression_window_bits
+        self.compression_mem_level = compression_mem_level
+        self.compression_stats = CompressionStats()
 
         self.auto_connect = auto_connect
         self.auto_reconnect = auto_reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.reconnect_jitter = reconnect_jitter
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.reconnect_stats = ReconnectStats()
+        self.recorder = recorder
+        self.latency = latency
+        self.timestamps = timestamps
+        self.subscription_window = subscription_window
+        self.max_subscription_pairs = max_subscription_pairs
+        self._pending_subscribe = {}
+        self._pending_unsubscribe = {}
+        self._flush_handle = None
+        self.connection_id = 0
+        self.pool = pool
+        if pool is not None:
+            pool.start(loop, self.on_record)
+        self._reconnect_handle = None
+        self._connect_task = None
+        self._never_opened = False
+        self._opened_at = None
         self.name = name
 
         super().__init__(self.feed_url)
+        if compression:
+            self.setProtocolOptions(
+                perMessageCompressionOffers=[PerMessageDeflateOffer(
+                    request_max_window_bits=compression_window_bits or 0)],
+                perMessageCompressionAccept=self._accept_compression)
+        # An instance rather than autobahn's protocol class, so that patching
+        # it before the first connection doesn't patch every client.
+        self.protocol = ClientProtocol()
         
         if self.auto_connect:
             self.add_as_task_to_loop()
 
+    def _accept_compression(self, response):
+        """Accept the server's permessage-deflate response.
+
+        :param response: The compression parameters the server chose.
+        :type response: autobahn.websocket.compress.PerMessageDeflateResponse
+
+        :returns: The accepted response, or None to fail the connection.
+        """
+        if isinstance(response, PerMessageDeflateResponse):
+            return PerMessageDeflateResponseAccept(
+                response, mem_level=self.compression_mem_level)
+        return None
+
     def _get_subscribe_message(self, channels, unsubscribe=False, timestamp=None):
         """Create and return the subscription message for the provided channels.
         
@@ -160,6 +515,11 @@ class Client(WebSocketClientFactory):
         :param bool unsubscribe:  If True, returns an unsubscribe message
             instead of a subscribe method. The default is False.
 
+        :param str timestamp: (optional) A UNIX timestamp. This parameter
+            exists for testing purposes and generally should not be used. The
+            default is None, in which case the signer's estimate of the
+            server time is used.
+
         :returns: JSON-formatted, UTF-8 encoded bytes object representing the
             subscription message for the provided channels.
         """
@@ -168,18 +528,12 @@ class Client(WebSocketClientFactory):
                'channels': [channel._as_dict() for channel in channels]}
 
         if self.auth:
-            if not timestamp:
-                timestamp = str(time.time())
-            message = timestamp + 'GET' + '/users/self/verify'
-            message = message.encode('ascii')
-            hmac_key = base64.b64decode(self.secret)
-            signature = hmac.new(hmac_key, message, hashlib.sha256)
-            signature_b64 = base64.b64encode(signature.digest())
-            signature_b64 = signature_b64.decode('utf-8').rstrip('\n')
-
-            msg['signature'] = signature_b64
-            msg['key'] = self.key
-            msg['passphrase'] = self.passphrase
+            signer = self.signer
+            timestamp, signature = signer.sign('/users/self/verify',
+                                               timestamp=timestamp)
+            msg['signature'] = signature
+            msg['key'] = signer.key
+            msg['passphrase'] = signer.passphrase
             msg['timestamp'] = timestamp
 
         return json.dumps(msg).encode('utf8')
@@ -206,9 +560,15 @@ class Client(WebSocketClientFactory):
                 self.channels[channel.name] = channel
                 sub_channels.append(channel)
 
-        if self.connected.is_set():
-            msg = self._get_subscribe_message(sub_channels)
-            self.protocol.sendMessage(msg)
+            if channel.name == 'full':
+                for product_id in channel.product_ids:
+                    self._sequences.setdefault(product_id, None)
+
+        if self.connected.is_set() and sub_channels:
+            if self.subscription_window is None:
+                self._send_subscriptions(sub_channels)
+            else:
+                self._queue_subscriptions(sub_channels)
 
     def unsubscribe(self, channels):
         """Unsubscribe from the given channels. 
@@ -225,9 +585,350 @@ class Client(WebSocketClientFactory):
                 if not self.channels[channel.name]:
                     del self.channels[channel.name]
 
+            if channel.name == 'full':
+                for product_id in channel.product_ids:
+                    self._sequences.pop(product_id, None)
+
         if self.connected.is_set():
-            msg = self._get_subscribe_message(channels, unsubscribe=True)
-            self.protocol.sendMessage(msg)
+            if self.subscription_window is None:
+                self._send_subscriptions(channels, unsubscribe=True)
+            else:
+                self._queue_subscriptions(channels, unsubscribe=True)
+
+    def _send_subscriptions(self, channels, unsubscribe=False):
+        """Send a subscribe or unsubscribe message, split into several if it
+        has more than max_subscription_pairs channel and product id pairs.
+
+        :param channels: The channels to subscribe to or unsubscribe from.
+        :type channels: list of Channel
+
+        :param bool unsubscribe: If True, send unsubscribe messages. The
+            default is False.
+        """
+        limit = self.max_subscription_pairs
+        if sum(len(channel.product_ids) for channel in channels) <= limit:
+            self.protocol.sendMessage(
+                self._get_subscribe_message(channels, unsubscribe))
+            return
+
+        chunk, size = [], 0
+        for channel in channels:
+            product_ids = sorted(channel.product_ids)
+            while product_ids:
+                piece = product_ids[:limit - size]
+                product_ids = product_ids[len(piece):]
+                chunk.append(Channel(channel.name, piece))
+                size += len(piece)
+                if size == limit:
+                    self.protocol.sendMessage(
+                        self._get_subscribe_message(chunk, unsubscribe))
+                    chunk, size = [], 0
+        if chunk:
+            self.protocol.sendMessage(
+                self._get_subscribe_message(chunk, unsubscribe))
+
+    def _queue_subscriptions(self, channels, unsubscribe=False):
+        """Add channels to the changes sent by the next
+        :meth:`flush_subscriptions`, cancelling out opposite changes.
+
+        :param channels: The channels to subscribe to or unsubscribe from.
+        :type channels: list of Channel
+
+        :param bool unsubscribe: If True, queue an unsubscribe. The default
+            is False.
+        """
+        if unsubscribe:
+            queue, opposite = (self._pending_unsubscribe,
+                               self._pending_subscribe)
+        else:
+            queue, opposite = (self._pending_subscribe,
+                               self._pending_unsubscribe)
+        for channel in channels:
+            cancelled = opposite.get(channel.name, set())
+            for product_id in channel.product_ids:
+                if product_id in cancelled:
+                    cancelled.discard(product_id)
+                else:
+                    queue.setdefault(channel.name, set()).add(product_id)
+
+        if self._flush_handle is None:
+            if self.subscription_window:
+                self._flush_handle = self.loop.call_later(
+                    self.subscription_window, self.flush_subscriptions)
+            else:
+                self._flush_handle = self.loop.call_soon(
+                    self.flush_subscriptions)
+
+    def flush_subscriptions(self):
+        """Send the subscribe and unsubscribe changes queued within the
+        current subscription_window now.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending = ((self._pending_unsubscribe, True),
+                   (self._pending_subscribe, False))
+        self._pending_subscribe, self._pending_unsubscribe = {}, {}
+        if not self.connected.is_set():
+            return
+        for queue, unsubscribe in pending:
+            channels = [Channel(name, list(product_ids))
+                        for name, product_ids in sorted(queue.items())
+                        if product_ids]
+            if channels:
+                self._send_subscriptions(channels, unsubscribe)
+
+    def on(self, msg_type, handler, product_id=None):
+        """Register a handler for messages of a type and/or product.
+
+        Handlers are looked up in a dispatch table keyed by message type and
+        product id, so each message costs a single dict lookup no matter how
+        many handlers are registered, and a handler is only called with the
+        messages it asked for. Handlers are called before on_message, so
+        on_message sees any state handlers (order books, etc.) have derived
+        from the message.
+
+        For each message, handlers registered for its type and product are
+        called first, then those for its type and any product, then those for
+        any type and its product and finally those for every message. Within
+        each group, handlers are called in the order they were registered.
+        See :class:`copra.websocket.dispatch.HandlerTable`.
+
+        :param str msg_type: The message type (eg., 'l2update', 'match' or
+            'heartbeat') or None for messages of every type.
+
+        :param handler: A callable that takes the message dict as its only
+            argument.
+
+        :param str product_id: (optional) If provided, the handler is only
+            called for messages about this product. The default is None, in
+            which case the handler is called for messages about any product
+            (and messages without a product, such as subscriptions).
+        """
+        self._dispatch.add(msg_type, handler, product_id)
+
+    def off(self, msg_type, handler, product_id=None):
+        """Remove a handler registered with :meth:`on`.
+
+        :param str msg_type: The message type the handler was registered for.
+
+        :param handler: The callable to remove.
+
+        :param str product_id: (optional) The product id the handler was
+            registered for. The default is None.
+
+        :raises ValueError: If the handler was not registered for msg_type and
+            product_id.
+        """
+        self._dispatch.remove(msg_type, handler, product_id)
+
+    def messages(self, maxsize=1000, policy=BLOCK, msg_type=None,
+                 product_id=None):
+        """Return a bounded queue of messages to iterate over asynchronously.
+
+        This decouples consumers from the client's message callback, which
+        runs synchronously as messages are read from the socket::
+
+            queue = client.messages(maxsize=100, policy='conflate')
+            async for message in queue:
+                await slow_consumer(message)
+
+        See :class:`copra.websocket.queue.MessageQueue` for a description of
+        the overflow policies and counters. Queues are closed when the client
+        is closed, and can be closed earlier with their close method.
+
+        :param int maxsize: (optional) The maximum number of messages in the
+            queue. The default is 1000.
+
+        :param str policy: (optional) What to do when the queue is full:
+            'block', 'drop-oldest', 'drop-newest' or 'conflate'. The default
+            is 'block'.
+
+        :param str msg_type: (optional) Only queue messages of this type. The
+            default is None, in which case messages of every type are queued.
+
+        :param str product_id: (optional) Only queue messages about this
+            product. The default is None, in which case messages about every
+            product are queued.
+
+        :returns: A :class:`copra.websocket.queue.MessageQueue`.
+
+        :raises ValueError: If maxsize is not positive or policy is not valid.
+        """
+        queue = MessageQueue(self, maxsize, policy)
+        self.on(msg_type, queue.put, product_id=product_id)
+        self._queues[queue] = (msg_type, product_id)
+        return queue
+
+    def _remove_queue(self, queue):
+        """Stop feeding a queue created with messages.
+
+        Queues fed by something else, such as
+        :class:`copra.websocket.ProductWorkers`, are ignored.
+        """
+        if queue not in self._queues:
+            return
+        msg_type, product_id = self._queues.pop(queue)
+        self.off(msg_type, queue.put, product_id=product_id)
+
+    def _pause_reading(self, blocker):
+        """Stop reading from the socket until every blocker has resumed.
+        """
+        if not self._blockers:
+            transport = getattr(self.protocol, 'transport', None)
+            if transport is not None:
+                transport.pause_reading()
+        self._blockers.add(blocker)
+
+    def _resume_reading(self, blocker):
+        """Resume reading from the socket if no other blockers remain.
+        """
+        self._blockers.discard(blocker)
+        if not self._blockers:
+            transport = getattr(self.protocol, 'transport', None)
+            if transport is not None:
+                transport.resume_reading()
+
+    def _process_message(self, message):
+        """Pass a message received from the server to the handlers registered
+        for it and then on_message.
+
+        If the client is lazy, messages without handlers are dropped instead.
+
+        :param dict message: Dictionary representing the message.
+
+        :returns: True if the message was passed on, False if it was stale,
+            buffered while its product is resynced, or dropped.
+        """
+        if self._opened_at is not None:
+            stats = self.reconnect_stats
+            stats.first_message_delay = time.monotonic() - self._opened_at
+            stats.attempts = 0
+            self._opened_at = None
+
+        product_id = message.get('product_id')
+        if (product_id in self._sequences and
+                message['type'] in SEQUENCED_TYPES and
+                not self._check_sequence(product_id, message)):
+            return False
+
+        key = (message['type'], product_id)
+        handlers = self._dispatch.cache.get(key)
+        if handlers is None:
+            handlers = self._dispatch.lookup(key)
+        if not handlers and self.lazy:
+            self.dropped += 1
+            return False
+        for handler in handlers:
+            handler(message)
+        self.on_message(message)
+        return True
+
+    def _check_sequence(self, product_id, message):
+        """Check the sequence number of a full channel message.
+
+        :param str product_id: The product id of the message.
+        :param dict message: Dictionary representing the message.
+
+        :returns: True if the message should be passed on, False if it is
+            stale or has been buffered while the product is resynced.
+        """
+        sequence = message['sequence']
+        buffer = self._resyncing.get(product_id)
+        if buffer is not None:
+            buffer.append(message)
+            return False
+
+        last = self._sequences[product_id]
+        if last is not None:
+            if sequence <= last:
+                logger.debug('{} dropped stale message {} for {}.'.format(
+                    self.name, sequence, product_id))
+                return False
+            if sequence != last + 1:
+                msg = '{} missed messages {}-{} for {}.'
+                logger.warning(msg.format(self.name, last + 1, sequence - 1,
+                                          product_id))
+                if self.rest_client is not None:
+                    self._resyncing[product_id] = [message]
+                    self.loop.create_task(self._repair(product_id))
+                    return False
+
+        self._sequences[product_id] = sequence
+        return True
+
+    async def resync(self, product_id):
+        """Resynchronize a product on the full channel with a fresh snapshot.
+
+        While the snapshot is fetched with rest_client, full channel messages
+        for the product are buffered. Once it arrives, a message of type
+        'resync' is passed to the handlers and on_message. Its 'snapshot'
+        key holds the level 3 order book returned by
+        :meth:`copra.rest.Client.order_book`, and its 'sequence' key the
+        snapshot's sequence number. The buffered messages newer than the
+        snapshot are then passed on as usual.
+
+        This is done automatically when a gap in sequence numbers is detected.
+        It can also be awaited directly, for instance to seed order books.
+
+        :param str product_id: The product id to resynchronize.
+
+        :raises ValueError: If the client has no rest_client.
+
+        :raises APIRequestError: Any error generated by the Coinbase Pro API
+            server.
+        """
+        if self.rest_client is None:
+            raise ValueError('resync requires a rest_client')
+
+        self._resyncing.setdefault(product_id, [])
+        try:
+            snapshot = await self.rest_client.order_book(product_id, level=3)
+        except Exception:
+            self._resyncing.pop(product_id, None)
+            raise
+        self._apply_snapshot(product_id, snapshot)
+
+    async def _repair(self, product_id):
+        """Fetch a snapshot after a sequence gap, retrying with a growing
+        delay (up to 30 seconds) until it succeeds or the client is closed.
+
+        :param str product_id: The product id to resynchronize.
+        """
+        delay = 1
+        while not self.closing:
+            try:
+                snapshot = await self.rest_client.order_book(product_id,
+                                                             level=3)
+            except Exception:
+                msg = '{} failed to resync {}, retrying in {}s.'
+                logger.exception(msg.format(self.name, product_id, delay))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            else:
+                self._apply_snapshot(product_id, snapshot)
+                return
+        self._resyncing.pop(product_id, None)
+
+    def _apply_snapshot(self, product_id, snapshot):
+        """Emit a resync message for a snapshot and pass on the messages
+        buffered while it was fetched.
+
+        :param str product_id: The product id of the snapshot.
+        :param dict snapshot: The level 3 order book.
+        """
+        sequence = int(snapshot['sequence'])
+        buffer = self._resyncing.pop(product_id, [])
+        if product_id in self._sequences:
+            self._sequences[product_id] = sequence
+
+        logger.info('{} resynced {} at {}.'.format(self.name, product_id,
+                                                   sequence))
+        self._process_message({'type': 'resync', 'product_id': product_id,
+                               'sequence': sequence, 'snapshot': snapshot})
+        for message in sorted(buffer, key=lambda m: m['sequence']):
+            if message['sequence'] > sequence:
+                self._process_message(message)
 
     def add_as_task_to_loop(self):
         """Add the client to the asyncio loop.
@@ -235,24 +936,98 @@ class Client(WebSocketClientFactory):
         Creates a coroutine for making a connection to the WebSocket server and
         adds it as a task to the asyncio loop.
         """
+        self._reconnect_handle = None
         self.protocol = ClientProtocol()
         url = urlparse(self.url)
         self.coro = self.loop.create_connection(self, url.hostname, url.port,
                                                 ssl=(url.scheme == 'wss'))
-        self.loop.create_task(self.coro)
+        self._connect_task = self.loop.create_task(self._connect(self.coro))
+
+    async def _connect(self, coro):
+        """Open the connection, scheduling a reconnect if it fails.
+
+        :param coro: The create_connection coroutine.
+        """
+        try:
+            await coro
+        except Exception as e:
+            msg = '{} failed to connect to {}. {}'
+            logger.error(msg.format(self.name, self.url, e))
+            if self.closing:
+                return
+            # An outage may start with the first connection attempt.
+            if self.reconnect_stats.disconnected_at is None:
+                self.reconnect_stats.disconnected_at = time.monotonic()
+                self._never_opened = True
+            if self.auto_reconnect:
+                self._reconnect()
+
+    def get_reconnect_delay(self, attempt):
+        """Return the number of seconds to wait before a reconnect attempt.
+
+        :param int attempt: The number of the attempt, starting at 1.
+
+        :returns: 0 for the first attempt, and an exponentially increasing,
+            capped and jittered delay for the rest.
+        """
+        if attempt <= 1:
+            return 0.0
+        delay = min(self.max_reconnect_delay,
+                    self.reconnect_delay * 2 ** (attempt - 2))
+        return delay * (1 - self.reconnect_jitter * random.random())
+
+    def _reconnect(self):
+        """Schedule the next reconnect attempt unless the attempt budget has
+        been used up.
+        """
+        stats = self.reconnect_stats
+        if (self.max_reconnect_attempts is not None and
+                stats.attempts >= self.max_reconnect_attempts):
+            msg = '{} giving up reconnecting to {} after {} attempts.'
+            logger.error(msg.format(self.name, self.url, stats.attempts))
+            return
+
+        stats.attempts += 1
+        stats.total_attempts += 1
+        delay = self.get_reconnect_delay(stats.attempts)
+        msg = '{} attempting to reconnect to {} in {:.1f}s (attempt {}).'
+        logger.info(msg.format(self.name, self.url, delay, stats.attempts))
+
+        if delay:
+            self._reconnect_handle = self.loop.call_later(
+                delay, self.add_as_task_to_loop)
+        else:
+            self.add_as_task_to_loop()
 
     def on_open(self):
         """Callback fired on initial WebSocket opening handshake completion.
 
         The WebSocket is open. This method sends the subscription message to
-        the server.
+        the server if there are any channels to subscribe to.
         """
         self.connected.set()
         self.disconnected.clear()
         self.closing = False
         logger.info('{} connected to {}'.format(self.name, self.url))
-        msg = self._get_subscribe_message(self.channels.values())
-        self.protocol.sendMessage(msg)
+
+        now = time.monotonic()
+        stats = self.reconnect_stats
+        if stats.disconnected_at is not None:
+            if not self._never_opened:
+                stats.reconnects += 1
+            self._never_opened = False
+            stats.last_outage = now - stats.disconnected_at
+            stats.time_disconnected += stats.last_outage
+            stats.disconnected_at = None
+        self._opened_at = now
+        self.connection_id = next(_CONNECTION_IDS)
+
+        if self._blockers:
+            self.protocol.transport.pause_reading()
+        # Everything is (re)subscribed to at once, so drop queued changes.
+        self._pending_subscribe, self._pending_unsubscribe = {}, {}
+        if self.channels:
+            self._send_subscriptions(list(self.channels.values()))
 
     def on_close(self, was_clean, code, reason):
         """Callback fired when the WebSocket connection has been closed.
@@ -276,11 +1051,11 @@ class Client(WebSocketClientFactory):
 
         logger.info(msg.format(self.name, self.url, expected, reason))
 
-        if not self.closing and self.auto_reconnect:
-            msg = '{} attempting to reconnect to {}.'
-            logger.info(msg.format(self.name, self.url))
-
-            self.add_as_task_to_loop()
+        if not self.closing:
+            if self.reconnect_stats.disconnected_at is None:
+                self.reconnect_stats.disconnected_at = time.monotonic()
+            if self.auto_reconnect:
+                self._reconnect()
 
     def on_error(self, message, reason=''):
         """Callback fired when an error message is received.
@@ -300,12 +1075,44 @@ class Client(WebSocketClientFactory):
         """
         print(message)
 
+    def on_record(self, record):
+        """Callback fired when a worker of the client's pool returns a record.
+
+        Records for a product arrive in the order of the messages they were
+        made from. You will likely want to override this method if the client
+        has a pool.
+
+        :param record: The record returned by the pool's processor.
+        """
+        print(record)
+
     async def close(self):
         """Close the WebSocket connection.
+
+        If the client isn't connected, e.g. while it waits to reconnect, the
+        pending connection attempt is cancelled instead.
         """
         self.closing = True
-        self.protocol.sendClose()
-        await self.disconnected.wait()
+        if self._reconnect_handle is not None:
+            self._reconnect_handle.cancel()
+            self._reconnect_handle = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self.connected.is_set():
+            self.protocol.sendClose()
+            await self.disconnected.wait()
+        else:
+            if self._connect_task is not None:
+                self._connect_task.cancel()
+            # A connection whose opening handshake is still in progress.
+            transport = getattr(self.protocol, 'transport', None)
+            if transport is not None:
+                transport.abort()
+        for queue in list(self._queues):
+            queue.close()
+        if self.pool is not None:
+            await self.pool.close()
 
 if __name__ == '__main__':
     # A sanity check.
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""JSON decoders for WebSocket messages.
+
+orjson and ujson are used when they are installed since they decode messages
+several times faster than the standard library. All decoders take the raw
+UTF-8 encoded bytes of a message and return a dict.
+
+:class:`LazyMessage` defers decoding a message until a field other than its
+type, product id or sequence number is read.
+
+"""
+
+from collections.abc import MutableMapping
+import json
+import re
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+def _json_loads(payload):
+    # json.loads accepts bytes on 3.6+, but only by sniffing the encoding and
+    # decoding them itself, which benchmarks slower than decoding up front.
+    return json.loads(payload.decode('utf8'))
+
+
+DECODERS = {'json': _json_loads}
+if ujson is not None:
+    DECODERS['ujson'] = ujson.loads
+if orjson is not None:
+    DECODERS['orjson'] = orjson.loads
+
+
+def get_decoder(decoder=None):
+    """Return a function that decodes a JSON message.
+
+    :param decoder: (optional) The name of a decoder ('orjson', 'ujson' or
+        'json') or a callable that takes bytes and returns a dict. The default
+        is None, in which case the fastest installed decoder is returned.
+    :type decoder: str or callable
+
+    :returns: A callable that takes the UTF-8 encoded bytes of a JSON message
+        and returns a dict.
+
+    :raises ValueError: If decoder is the name of a decoder that is not
+        installed.
+    """
+    if callable(decoder):
+        return decoder
+    if decoder is None:
+        for name in ('orjson', 'ujson', 'json'):
+            if name in DECODERS:
+                return DECODERS[name]
+    if decoder not in DECODERS:
+        raise ValueError('decoder {} is not available'.format(decoder))
+    return DECODERS[decoder]
+
+
+# The fields read from a message without decoding it.
+ROUTING_FIELDS = frozenset(('type', 'product_id', 'sequence'))
+
+_NUMBER = re.compile(rb'\s*(-?\d+)')
+
+_MISSING = object()
+
+# The routing fields' names as they appear in a message that has them.
+_QUOTED = {key: '"{}"'.format(key).encode('utf8') for key in ROUTING_FIELDS}
+
+# Decoded types and product ids, keyed by their bytes.
+_NAMES = {}
+
+
+def _string(payload, compact, spaced):
+    """Read a top level string field of a message without decoding it.
+
+    Coinbase Pro messages are flat JSON objects, so the first occurrence of
+    the field is taken to be the top level one.
+
+    :param bytes payload: The UTF-8 encoded bytes of a JSON message.
+    :param bytes compact: The field's start as Coinbase Pro sends it, e.g.
+        b'"type":"'.
+    :param bytes spaced: The field's start as json.dumps writes it, e.g.
+        b'"type": "'.
+
+    :returns: The value, or _MISSING if the message doesn't have the field.
+    """
+    start = payload.find(compact)
+    if start >= 0:
+        start += len(compact)
+    else:
+        start = payload.find(spaced)
+        if start < 0:
+            return _MISSING
+        start += len(spaced)
+    raw = payload[start:payload.find(b'"', start)]
+    name = _NAMES.get(raw)
+    if name is None:
+        if len(_NAMES) > 10000:
+            _NAMES.clear()
+        name = _NAMES[raw] = raw.decode('utf8')
+    return name
+
+
+def _sequence(payload):
+    """Read the sequence number of a message without decoding it.
+
+    :returns: The sequence number, or _MISSING if the message doesn't have
+        one.
+    """
+    start = payload.find(b'"sequence":')
+    if start < 0:
+        return _MISSING
+    match = _NUMBER.match(payload, start + 11)
+    return int(match.group(1)) if match else _MISSING
+
+
+def parse_routing(payload):
+    """Read the type, product id and sequence number of a message without
+    decoding it.
+
+    If a field is in the message but spelled in a way the byte search
+    doesn't recognize (e.g. with whitespace before the colon), the message
+    is decoded with the standard library to read it.
+
+    :param bytes payload: The UTF-8 encoded bytes of a JSON message.
+
+    :returns: A dict with those of the 'type', 'product_id' and 'sequence'
+        keys that the message has.
+    """
+    fields = {}
+    decoded = None
+    for key, value in (
+            ('type', _string(payload, b'"type":"', b'"type": "')),
+            ('product_id', _string(payload, b'"product_id":"',
+                                   b'"product_id": "')),
+            ('sequence', _sequence(payload))):
+        if value is _MISSING and _QUOTED[key] in payload:
+            if decoded is None:
+                decoded = _json_loads(payload)
+            value = decoded.get(key, _MISSING)
+        if value is not _MISSING:
+            fields[key] = value
+    return fields
+
+
+class LazyMessage(MutableMapping):
+    """A message that is only decoded once a field other than its routing
+    fields (type, product_id and sequence) is read.
+
+    The type and product id are found in the raw message with a byte search
+    when the LazyMessage is made, and the sequence number the first time it
+    is read, so the client can dispatch a message, check its sequence
+    number, or drop it, without decoding it. A routing field the search
+    doesn't find is only taken to be missing if its quoted name isn't in the
+    message; otherwise the message is decoded to read it (e.g. if it was
+    written with whitespace before the colon). Reading any other field,
+    iterating over the message or taking its length decodes the rest of it
+    with decode. Fields set before then are kept.
+
+    Otherwise a LazyMessage behaves like the dict decode would return;
+    :meth:`copy` returns that dict.
+    """
+
+    __slots__ = ('_fields', '_payload', '_decode', '_changes')
+
+    def __init__(self, payload, decode):
+        """
+
+        :param bytes payload: The UTF-8 encoded bytes of a JSON message.
+
+        :param decode: A callable that takes payload and returns a dict.
+        """
+        self._payload = payload
+        self._decode = decode
+        self._changes = None
+        self._fields = fields = {}
+        value = _string(payload, b'"type":"', b'"type": "')
+        if value is not _MISSING:
+            fields['type'] = value
+        value = _string(payload, b'"product_id":"', b'"product_id": "')
+        if value is not _MISSING:
+            fields['product_id'] = value
+
+    @property
+    def decoded(self):
+        """True if the whole message has been decoded."""
+        return self._payload is None
+
+    def _load(self):
+        """Decode the message, if it hasn't been, and return its fields."""
+        if self._payload is None:
+            return self._fields
+        fields = self._decode(self._payload)
+        if self._changes:
+            fields.update(self._changes)
+        self._fields = fields
+        self._payload = self._changes = None
+        return fields
+
+    def _lookup(self, key):
+        """Return a field that hasn't been read yet, or _MISSING."""
+        payload = self._payload
+        if payload is None:
+            return _MISSING
+        if key in ROUTING_FIELDS:
+            if key == 'sequence':
+                value = _sequence(payload)
+                if value is not _MISSING:
+                    self._fields[key] = value
+                    return value
+            # The byte search in __init__ missed type and product_id.
+            if _QUOTED[key] not in payload:
+                return _MISSING
+        return self._load().get(key, _MISSING)
+
+    def __getitem__(self, key):
+        try:
+            return self._fields[key]
+        except KeyError:
+            pass
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self._fields[key]
+        except KeyError:
+            pass
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key):
+        return key in self._fields or self._lookup(key) is not _MISSING
+
+    def __setitem__(self, key, value):
+        self._fields[key] = value
+        if self._payload is not None:
+            if self._changes is None:
+                self._changes = {}
+            self._changes[key] = value
+
+    def __delitem__(self, key):
+        del self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __repr__(self):
+        return 'LazyMessage({!r})'.format(self._load())
+
+    def copy(self):
+        """Return the decoded message as a new dict."""
+        return dict(self._load())
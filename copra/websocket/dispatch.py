@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""The (message type, product id) dispatch table of message handlers.
+
+"""
+
+
+class HandlerTable:
+    """Handlers keyed by message type and product id, with a cache of the
+    handlers to call for each (type, product id) pair seen.
+
+    For each message, handlers registered for its type and product are
+    called first, then those for its type and any product, then those for
+    any type and its product and finally those for every message. Within
+    each group, handlers are called in the order they were registered.
+
+    Look handlers up with ``table.cache.get(key)`` and fall back to
+    :meth:`lookup` on a miss, so the common case is a single dict lookup.
+
+    :ivar dict handlers: The lists of handlers registered for each
+        (message type, product id) key.
+    :ivar dict cache: The tuple of handlers to call for each (message type,
+        product id) key looked up since the handlers last changed.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.cache = {}
+
+    def __repr__(self):
+        return 'HandlerTable({!r})'.format(self.handlers)
+
+    def add(self, msg_type, handler, product_id=None):
+        """Register a handler.
+
+        :param str msg_type: The message type or None for every type.
+        :param handler: The handler.
+        :param str product_id: (optional) The product id or None for every
+            product. The default is None.
+        """
+        self.handlers.setdefault((msg_type, product_id), []).append(handler)
+        self.cache.clear()
+
+    def remove(self, msg_type, handler, product_id=None):
+        """Remove a handler registered with :meth:`add`.
+
+        :param str msg_type: The message type the handler was registered for.
+        :param handler: The handler.
+        :param str product_id: (optional) The product id the handler was
+            registered for. The default is None.
+
+        :raises ValueError: If the handler was not registered for msg_type and
+            product_id.
+        """
+        key = (msg_type, product_id)
+        handlers = self.handlers.get(key, [])
+        if handler not in handlers:
+            raise ValueError('handler not registered for {}'.format(key))
+        handlers.remove(handler)
+        if not handlers:
+            del self.handlers[key]
+        self.cache.clear()
+
+    def lookup(self, key):
+        """Build and cache the handlers to call for a message type and
+        product id.
+
+        :param tuple key: A (message type, product id) tuple.
+
+        :returns: A tuple of the handlers to call.
+        """
+        msg_type, product_id = key
+        if product_id is None:
+            lookups = ((msg_type, None), (None, None))
+        else:
+            lookups = ((msg_type, product_id), (msg_type, None),
+                       (None, product_id), (None, None))
+        found = []
+        for lookup in lookups:
+            found.extend(self.handlers.get(lookup, ()))
+        handlers = self.cache[key] = tuple(found)
+        return handlers
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""Latency histograms for WebSocket messages.
+
+"""
+
+import calendar
+import time
+
+# Messages types and the channel they are received on. Match messages are
+# attributed to the matches channel even though the full channel sends them
+# too.
+CHANNELS = {
+    'heartbeat': 'heartbeat',
+    'ticker': 'ticker',
+    'snapshot': 'level2',
+    'l2update': 'level2',
+    'match': 'matches',
+    'last_match': 'matches',
+    'received': 'full',
+    'open': 'full',
+    'done': 'full',
+    'change': 'full',
+    'activate': 'full',
+}
+
+
+# The Unix time of each 'YYYY-MM-DDTHH:MM' minute parsed by parse_time.
+_MINUTES = {}
+
+
+def parse_time(timestamp):
+    """Convert a message time to seconds since the epoch.
+
+    Only the seconds are parsed for every message. The rest is parsed with
+    the standard library once per minute, so this is several times faster
+    than datetime.strptime.
+
+    :param str timestamp: An ISO 8601 UTC time like
+        '2019-01-07T23:41:39.123456Z'.
+
+    :returns: The time as a float.
+    """
+    minute = _MINUTES.get(timestamp[:16])
+    if minute is None:
+        if len(_MINUTES) > 1000:
+            _MINUTES.clear()
+        minute = _MINUTES[timestamp[:16]] = calendar.timegm(
+            time.strptime(timestamp[:16], '%Y-%m-%dT%H:%M'))
+    return minute + float(timestamp[17:].rstrip('Z'))
+
+
+class Histogram:
+    """A histogram of durations with HDR-style log-linear buckets.
+
+    Durations are counted in whole microseconds. Each power of two range is
+    split into 2 ** (significant_bits - 1) equal buckets, so recording costs a
+    few integer operations and any value is reported to within a relative
+    error of 2 ** (1 - significant_bits), regardless of magnitude.
+
+    :ivar int count: The number of durations recorded.
+    :ivar float total: The sum of the durations recorded, in seconds.
+    :ivar float max: The longest duration recorded, in seconds.
+    """
+
+    def __init__(self, significant_bits=6, max_seconds=3600.0):
+        """
+
+        :param int significant_bits: (optional) The number of significant bits
+            of each bucket boundary. The default of 6 keeps the error within
+            3.2%.
+
+        :param float max_seconds: (optional) Longer durations are counted in
+            the last bucket. The default is 3600.0.
+        """
+        self.significant_bits = significant_bits
+        self._bits = significant_bits
+        self._half = 1 << (significant_bits - 1)
+        self._max = int(max_seconds * 1e6)
+        self.counts = [0] * (self._index(self._max) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _index(self, micros):
+        shift = micros.bit_length() - self.significant_bits
+        if shift <= 0:
+            return micros
+        return shift * self._half + (micros >> shift)
+
+    def _lowest(self, index):
+        """Return the lowest value, in microseconds, counted in a bucket."""
+        if index < 2 * self._half:
+            return index
+        shift = index // self._half - 1
+        return (index - shift * self._half) << shift
+
+    def record(self, seconds):
+        """Record a duration.
+
+        :param float seconds: The duration. Negative durations are counted
+            as 0.
+        """
+        micros = int(seconds * 1e6)
+        if micros < 0:
+            micros = 0
+        elif micros > self._max:
+            micros = self._max
+        # _index, inlined.
+        shift = micros.bit_length() - self._bits
+        if shift > 0:
+            micros = shift * self._half + (micros >> shift)
+        self.counts[micros] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Add the counts of another histogram to this one.
+
+        :param Histogram other: A histogram with the same significant_bits
+            and max_seconds.
+        """
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def clear(self):
+        """Remove all recorded durations."""
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def mean(self):
+        """The mean duration in seconds, or 0.0 if nothing is recorded."""
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """Return the duration below which a fraction of durations fall.
+
+        :param float q: The fraction, from 0 to 1 (e.g. 0.99).
+
+        :returns: The duration in seconds, or 0.0 if nothing is recorded.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                # The upper bound of the bucket, so quantiles are never under
+                # reported.
+                return min((self._lowest(index + 1) - 1) / 1e6, self.max)
+        return self.max
+
+
+class RollingHistogram:
+    """A histogram of the durations recorded during the last window seconds.
+
+    The window is divided into slices, each with its own :class:`Histogram`.
+    A slice is cleared and reused once it falls out of the window, so
+    recording stays O(1) and durations age out a slice at a time.
+    """
+
+    def __init__(self, window=60.0, slices=6, **kwargs):
+        """
+
+        :param float window: (optional) The length of the window in seconds.
+            The default is 60.0.
+
+        :param int slices: (optional) The number of slices the window is
+            divided into. The default is 6.
+
+        :param kwargs: Passed to :class:`Histogram`.
+        """
+        self.window = window
+        self._length = window / slices
+        self._slices = [Histogram(**kwargs) for _ in range(slices)]
+        self._epochs = [None] * slices
+        self._kwargs = kwargs
+        self._current = None
+        self._current_start = self._current_end = float('-inf')
+
+    def record(self, seconds, now=None):
+        """Record a duration.
+
+        :param float seconds: The duration.
+
+        :param float now: (optional) The current time per time.monotonic().
+            The default is now.
+        """
+        if now is None:
+            now = time.monotonic()
+        if not self._current_start <= now < self._current_end:
+            epoch = int(now // self._length)
+            index = epoch % len(self._slices)
+            if self._epochs[index] != epoch:
+                self._slices[index].clear()
+                self._epochs[index] = epoch
+            self._current = self._slices[index]
+            self._current_start = epoch * self._length
+            self._current_end = self._current_start + self._length
+        self._current.record(seconds)
+
+    def snapshot(self, now=None):
+        """Return a histogram of the durations recorded in the window.
+
+        :param float now: (optional) The current time per time.monotonic().
+            The default is now.
+
+        :returns: A new :class:`Histogram`.
+        """
+        if now is None:
+            now = time.monotonic()
+        oldest = int(now // self._length) - len(self._slices) + 1
+        merged = Histogram(**self._kwargs)
+        for epoch, histogram in zip(self._epochs, self._slices):
+            if epoch is not None and epoch >= oldest:
+                merged.merge(histogram)
+        return merged
+
+
+class LatencyMonitor:
+    """Rolling latency histograms of the messages received by a client.
+
+    Pass a LatencyMonitor to :class:`copra.websocket.Client` as ``latency``
+    and, for every message it decodes, the client records two durations per
+    channel and product id:
+
+    * network: from the exchange's ``time`` field of the message to the
+      moment the client received it. This includes any clock offset between
+      the exchange and this machine, so watch its changes rather than its
+      absolute value. Messages without a time field aren't counted.
+    * handler: from the moment the client received the message to the moment
+      its handlers and on_message returned.
+
+    If the network latency rises, the delay is upstream of the client; if
+    the handler latency rises, it is in the client's own handlers.
+
+    :ivar dict network: The network latency RollingHistograms, keyed by
+        (channel, product id).
+    :ivar dict handler: The handler latency RollingHistograms, keyed by
+        (channel, product id).
+    """
+
+    def __init__(self, window=60.0, slices=6, significant_bits=6):
+        """
+
+        :param float window: (optional) The number of seconds of messages the
+            histograms cover. The default is 60.0.
+
+        :param int slices: (optional) The number of slices each window is
+            divided into. The default is 6.
+
+        :param int significant_bits: (optional) The precision of the
+            histograms. See :class:`Histogram`. The default is 6.
+        """
+        self.window = window
+        self.slices = slices
+        self.significant_bits = significant_bits
+        self.network = {}
+        self.handler = {}
+
+    def _histograms(self, key):
+        kwargs = {'significant_bits': self.significant_bits}
+        self.handler[key] = RollingHistogram(self.window, self.slices,
+                                             **kwargs)
+        self.network[key] = RollingHistogram(self.window, self.slices,
+                                             **kwargs)
+        return self.handler[key], self.network[key]
+
+    def parse_time(self, timestamp):
+        """Convert a message time to seconds since the epoch.
+
+        See :func:`parse_time`.
+
+        :param str timestamp: An ISO 8601 UTC time like
+            '2019-01-07T23:41:39.123456Z'.
+
+        :returns: The time as a float.
+        """
+        return parse_time(timestamp)
+
+    def observe(self, message, received, started, finished):
+        """Record the latencies of a message.
+
+        :param dict message: The decoded message.
+
+        :param float received: The time the message was received per
+            time.time().
+
+        :param float started: The time the message was received per
+            time.monotonic().
+
+        :param float finished: The time its handlers returned per
+            time.monotonic().
+        """
+        msg_type = message.get('type')
+        key = (CHANNELS.get(msg_type, msg_type), message.get('product_id'))
+        handler = self.handler.get(key)
+        if handler is None:
+            handler, network = self._histograms(key)
+        else:
+            network = self.network[key]
+        handler.record(finished - started, finished)
+
+        timestamp = message.get('time')
+        if timestamp:
+            try:
+                sent = self.parse_time(timestamp)
+            except ValueError:
+                return
+            network.record(received - sent, finished)
+
+    def summary(self, quantiles=(0.5, 0.99, 0.999)):
+        """Summarize the latencies in the current window.
+
+        :param quantiles: (optional) The quantiles to report. The default is
+            (0.5, 0.99, 0.999).
+        :type quantiles: tuple of float
+
+        :returns: A dict keyed by (channel, product id) of dicts with
+            'network' and 'handler' keys, each a dict with the count, mean,
+            max and requested quantiles (as 'p50', 'p99', 'p99.9' etc.) in
+            seconds. Histograms with nothing recorded in the window are
+            left out.
+        """
+        now = time.monotonic()
+        summary = {}
+        for name, histograms in (('network', self.network),
+                                 ('handler', self.handler)):
+            for key, rolling in histograms.items():
+                histogram = rolling.snapshot(now)
+                if not histogram.count:
+                    continue
+                stats = {'count': histogram.count, 'mean': histogram.mean,
+                         'max': histogram.max}
+                for q in quantiles:
+                    stats['p{:g}'.format(q * 100)] = histogram.quantile(q)
+                summary.setdefault(key, {})[name] = stats
+        return summary
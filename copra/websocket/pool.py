@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""Pool of worker processes for decoding and processing WebSocket messages.
+
+"""
+
+import logging
+import multiprocessing
+import queue
+import re
+import threading
+import time
+import zlib
+
+from copra.websocket.decoders import get_decoder
+
+logger = logging.getLogger(__name__)
+
+_PRODUCT_ID = re.compile(rb'"product_id"\s*:\s*"([^"]*)"')
+
+
+def _work(conn, processor, decoder):
+    """The main function of a worker process.
+
+    Receives batches of raw messages, decodes them, passes each to processor
+    and sends back the batch of non-None results. A None batch stops the
+    worker.
+    """
+    decode = get_decoder(decoder)
+    while True:
+        try:
+            batch = conn.recv()
+        except EOFError:
+            break
+        if batch is None:
+            break
+        records = []
+        for payload in batch:
+            try:
+                record = processor(decode(payload))
+            except Exception:
+                logger.exception('processor failed')
+                continue
+            if record is not None:
+                records.append(record)
+        if records:
+            conn.send(records)
+    conn.close()
+
+
+class ProcessPool:
+    """A pool of worker processes that decode and process raw WebSocket
+    messages.
+
+    When a ProcessPool is passed to :class:`copra.websocket.Client`, each
+    message with a product id is handed, still encoded, to the worker that
+    owns its product. Products are assigned to workers by a stable hash of
+    their product id, and each worker processes its messages in the order they
+    were received, so ordering is preserved per product. Messages without a
+    product id (subscriptions, errors, etc.) are handled by the client as
+    usual.
+
+    In the worker, each message is decoded and passed to ``processor``, which
+    returns a compact, picklable record (a tuple, for instance) or None to
+    send nothing back. Records are sent back over a pipe in batches and passed,
+    in order per product, to the client's ``on_record`` method. The processor
+    is copied into each worker, so it can keep state (an order book, say) for
+    the products its worker owns.
+
+    Raw messages are sent to the workers in batches, once per pass of the
+    event loop, so the cost of the pipe is shared by many messages. Batches
+    are written to the pipes by a thread per worker, so a slow worker whose
+    pipe is full holds up its own products only, never the event loop.
+
+    .. note:: Messages handled by the pool skip the client's handlers,
+        sequence checking and on_message. Do that work in the processor.
+
+    :ivar int workers: The number of worker processes.
+    :ivar int submitted: The number of messages sent to the workers.
+    :ivar int records: The number of records received from the workers.
+    """
+
+    def __init__(self, processor, workers=None, decoder=None):
+        """
+
+        :param processor: A picklable callable (a module level function or an
+            instance of a module level class) that takes a message dict and
+            returns a picklable record or None.
+
+        :param int workers: (optional) The number of worker processes. The
+            default is None, in which case one worker is started per CPU.
+
+        :param decoder: (optional) The name of the JSON decoder for the
+            workers to use. See :func:`copra.websocket.decoders.get_decoder`.
+            The default is None, the fastest installed decoder.
+        :type decoder: str
+        """
+        self.processor = processor
+        self.workers = workers or multiprocessing.cpu_count()
+        self.decoder = decoder
+        self.submitted = 0
+        self.records = 0
+        self.callback = None
+        self._worker_of = {}
+        self._batches = [[] for _ in range(self.workers)]
+        self._conns = []
+        self._outboxes = []
+        self._processes = []
+        self._threads = []
+        self._flush_scheduled = False
+        self.loop = None
+
+    @property
+    def started(self):
+        """True if the worker processes have been started and not closed.
+        """
+        return bool(self._processes)
+
+    def start(self, loop, callback):
+        """Start the worker processes.
+
+        This is called by the client the pool is passed to.
+
+        :param loop: The asyncio loop to deliver records in.
+        :type loop: asyncio loop
+
+        :param callback: A callable that takes a record as its only argument.
+        """
+        if self.started:
+            return
+        self.loop = loop
+        self.callback = callback
+        for _ in range(self.workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_work, args=(child_conn, self.processor, self.decoder),
+                daemon=True)
+            process.start()
+            child_conn.close()
+            # Records are read in a thread per worker so that a worker blocked
+            # sending records can never deadlock with the loop sending it
+            # messages.
+            reader = threading.Thread(target=self._read, args=(parent_conn,),
+                                      daemon=True)
+            reader.start()
+            outbox = queue.Queue()
+            writer = threading.Thread(target=self._write,
+                                      args=(parent_conn, outbox), daemon=True)
+            writer.start()
+            self._conns.append(parent_conn)
+            self._outboxes.append(outbox)
+            self._processes.append(process)
+            self._threads.extend((reader, writer))
+
+    def _write(self, conn, outbox):
+        while True:
+            batch = outbox.get()
+            try:
+                conn.send(batch)
+            except (OSError, ValueError):  # The worker has gone.
+                break
+            if batch is None:
+                break
+
+    def _read(self, conn):
+        while True:
+            try:
+                records = conn.recv()
+            except (EOFError, OSError):
+                break
+            try:
+                self.loop.call_soon_threadsafe(self._deliver, records)
+            except RuntimeError:  # The loop has been closed.
+                break
+
+    def _deliver(self, records):
+        self.records += len(records)
+        callback = self.callback
+        for record in records:
+            callback(record)
+
+    def worker_for(self, product_id):
+        """Return the index of the worker that owns a product.
+
+        :param str product_id: The product id.
+        """
+        index = self._worker_of.get(product_id)
+        if index is None:
+            index = zlib.crc32(product_id.encode('utf8')) % self.workers
+            self._worker_of[product_id] = index
+        return index
+
+    def submit(self, payload):
+        """Queue a raw message for the worker that owns its product.
+
+        :param bytes payload: The UTF-8 encoded JSON message.
+
+        :returns: True if the message was queued, False if it has no product
+            id (or the pool isn't started) and should be handled by the
+            client.
+        """
+        if not self._processes:
+            return False
+        match = _PRODUCT_ID.search(payload)
+        if match is None:
+            return False
+        product_id = match.group(1).decode('utf8')
+        self._batches[self.worker_for(product_id)].append(payload)
+        self.submitted += 1
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.loop.call_soon(self._flush)
+        return True
+
+    def _flush(self):
+        """Send the queued messages to the workers.
+        """
+        self._flush_scheduled = False
+        for index, batch in enumerate(self._batches):
+            if batch:
+                self._outboxes[index].put(batch)
+                self._batches[index] = []
+
+    async def close(self, timeout=10.0):
+        """Stop the worker processes once they have processed the messages
+        already submitted.
+
+        The workers are waited for in an executor, so the event loop keeps
+        running meanwhile.
+
+        :param float timeout: (optional) The number of seconds to wait for
+            the workers to finish before terminating them. The default is
+            10.0.
+        """
+        if not self._processes:
+            return
+        self._flush()
+        for outbox in self._outboxes:
+            outbox.put(None)
+        processes, threads, conns = self._processes, self._threads, self._conns
+        self._conns, self._outboxes = [], []
+        self._processes, self._threads = [], []
+        await self.loop.run_in_executor(None, self._join, processes, threads,
+                                        conns, timeout)
+
+    @staticmethod
+    def _join(processes, threads, conns, timeout):
+        deadline = time.monotonic() + timeout
+        for process in processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning('terminating worker {}'.format(process.pid))
+                process.terminate()
+                process.join()
+        # The workers have exited, so their pipes are closed and the
+        # threads finish.
+        for thread in threads:
+            thread.join(max(1.0, deadline - time.monotonic()))
+        for conn in conns:
+            conn.close()
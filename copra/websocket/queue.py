@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Bounded message queue for consuming WebSocket messages asynchronously.
+
+"""
+
+import asyncio
+from collections import deque, OrderedDict
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+CONFLATE = 'conflate'
+
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, CONFLATE)
+
+
+class MessageQueue:
+    """A bounded queue of WebSocket messages that can be iterated over
+    asynchronously.
+
+    MessageQueues are created with :meth:`copra.websocket.Client.messages`.
+    Messages are put on the queue as they are received, inside the client's
+    message callback, and a consumer takes them off at its own pace with
+    ``async for``. What happens when the consumer falls behind and the queue
+    is full depends on the queue's policy:
+
+    * **block** - the client stops reading from its socket until the queue
+      has drained to half its size, pushing back on the server through TCP
+      flow control. No messages are lost, but note that this pauses all of
+      the client's messages and that the server may disconnect a client that
+      reads too slowly.
+    * **drop-oldest** - the oldest message in the queue is discarded.
+    * **drop-newest** - the new message is discarded.
+    * **conflate** - the queue holds only the latest message of each type for
+      each product. A new message replaces a queued one with the same type
+      and product id and keeps its place in line. If the queue is full of
+      messages with other keys, the oldest is discarded.
+
+    :ivar int maxsize: The maximum number of messages in the queue.
+    :ivar str policy: The overflow policy.
+    :ivar int received: The number of messages put on the queue.
+    :ivar int dropped: The number of messages discarded because the queue was
+        full.
+    :ivar int conflated: The number of queued messages replaced by newer ones
+        (conflate policy only).
+    :ivar int blocked: The number of times the client stopped reading because
+        the queue was full (block policy only).
+    :ivar int high_water: The largest number of messages the queue has held.
+    :ivar bool closed: True once the queue has been closed.
+    """
+
+    def __init__(self, client, maxsize=1000, policy=BLOCK):
+        """
+
+        :param client: The client the queue is fed by.
+        :type client: copra.websocket.Client
+
+        :param int maxsize: (optional) The maximum number of messages in the
+            queue. The default is 1000.
+
+        :param str policy: (optional) The overflow policy: 'block',
+            'drop-oldest', 'drop-newest' or 'conflate'. The default is
+            'block'.
+
+        :raises ValueError: If maxsize is not positive or policy is not valid.
+        """
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        if policy not in POLICIES:
+            raise ValueError('invalid policy {}'.format(policy))
+
+        self.client = client
+        self.maxsize = maxsize
+        self.policy = policy
+        self.received = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.blocked = 0
+        self.high_water = 0
+        self.closed = False
+        self._items = OrderedDict() if policy == CONFLATE else deque()
+        self._not_empty = asyncio.Event()
+        self._paused = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.get()
+        except EOFError:
+            raise StopAsyncIteration
+
+    def put(self, message):
+        """Put a message on the queue, applying the overflow policy if the
+        queue is full.
+
+        :param dict message: Dictionary representing the message.
+        """
+        if self.closed:
+            return
+        self.received += 1
+        items = self._items
+        full = len(items) >= self.maxsize
+
+        if self.policy == CONFLATE:
+            key = (message['type'], message.get('product_id'))
+            if key in items:
+                items[key] = message
+                self.conflated += 1
+                return
+            if full:
+                items.popitem(last=False)
+                self.dropped += 1
+            items[key] = message
+        elif not full or self.policy == BLOCK:
+            items.append(message)
+            if self.policy == BLOCK and len(items) >= self.maxsize:
+                self._pause()
+        elif self.policy == DROP_OLDEST:
+            items.popleft()
+            items.append(message)
+            self.dropped += 1
+        else:
+            self.dropped += 1
+            return
+
+        if len(items) > self.high_water:
+            self.high_water = len(items)
+        self._not_empty.set()
+
+    async def get(self):
+        """Remove and return the next message, waiting until one is available.
+
+        :returns: A dict representing the message.
+
+        :raises EOFError: If the queue is closed and empty.
+        """
+        items = self._items
+        while not items:
+            if self.closed:
+                raise EOFError('queue closed')
+            self._not_empty.clear()
+            await self._not_empty.wait()
+
+        if self.policy == CONFLATE:
+            message = items.popitem(last=False)[1]
+        else:
+            message = items.popleft()
+        if self._paused and len(items) <= self.maxsize // 2:
+            self._resume()
+        return message
+
+    def close(self):
+        """Stop receiving messages.
+
+        Messages already on the queue can still be consumed. Iteration ends
+        once they have been.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.client._remove_queue(self)
+        if self._paused:
+            self._resume()
+        self._not_empty.set()
+
+    def _pause(self):
+        if not self._paused:
+            self._paused = True
+            self.blocked += 1
+            self.client._pause_reading(self)
+
+    def _resume(self):
+        self._paused = False
+        self.client._resume_reading(self)
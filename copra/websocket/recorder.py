@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""Compact, append-only recording of raw WebSocket messages.
+
+A recording is a directory of segment files. Each segment is a sequence of
+zlib compressed blocks of entries and has a sparse index file listing the
+time range and file offset of each block, so a time range can be read without
+decompressing the whole recording.
+
+Segment layout::
+
+    block  := header data
+    header := compressed size (uint32), entry count (uint32),
+              first wall time (float64), last wall time (float64)
+    data   := zlib(entry*)
+    entry  := wall time (float64), monotonic time (float64),
+              connection id (uint32), payload size (uint32), payload
+
+Index layout (one record per block)::
+
+    first wall time (float64), last wall time (float64), offset (uint64),
+    entry count (uint32)
+
+All values are little-endian.
+
+"""
+
+from collections import deque, namedtuple
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+_BLOCK = struct.Struct('<IIdd')
+_ENTRY = struct.Struct('<ddII')
+_INDEX = struct.Struct('<ddQI')
+
+Entry = namedtuple('Entry', 'wall_time monotonic_time connection_id payload')
+Entry.__doc__ = """A recorded message.
+
+:ivar float wall_time: The time the message was received per time.time().
+:ivar float monotonic_time: The time the message was received per
+    time.monotonic().
+:ivar int connection_id: The id of the connection it was received over.
+:ivar bytes payload: The raw message.
+"""
+
+
+class Recorder:
+    """Records raw WebSocket messages to disk.
+
+    Pass a Recorder to :class:`copra.websocket.Client` as ``recorder`` and the
+    client will record every message it receives along with its receive times
+    and connection id. Recording a message only appends it to an in-memory
+    queue. A background thread compresses and writes the queued messages in
+    blocks, every flush_interval seconds or whenever block_size messages are
+    waiting, and starts a new segment when the current one reaches
+    segment_size bytes.
+
+    A Recorder can be shared by several clients. Close it (or use it as a
+    context manager) to write the messages still queued.
+
+    :ivar str directory: The directory the recording is written to.
+    :ivar int recorded: The number of messages recorded.
+    :ivar int written: The number of messages written to disk.
+    :ivar int bytes_written: The number of (compressed) bytes written to disk.
+    """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024,
+                 block_size=1000, flush_interval=1.0, compression=6):
+        """
+
+        :param str directory: The directory to write the recording to. It is
+            created if it doesn't exist.
+
+        :param int segment_size: (optional) The size in bytes at which to start
+            a new segment. The default is 64 MiB.
+
+        :param int block_size: (optional) The maximum number of messages per
+            compressed block. The default is 1000.
+
+        :param float flush_interval: (optional) The maximum number of seconds
+            a message waits in memory before it is written. The default is
+            1.0.
+
+        :param int compression: (optional) The zlib compression level, from 0
+            to 9. The default is 6.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.compression = compression
+        self.recorded = 0
+        self.written = 0
+        self.bytes_written = 0
+        self.closed = False
+
+        os.makedirs(directory, exist_ok=True)
+        self._pending = deque()
+        self._wakeup = threading.Event()
+        self._segment = None
+        self._index = None
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='copra recorder')
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, payload, connection_id=0, wall_time=None,
+               monotonic_time=None):
+        """Queue a message to be written.
+
+        :param bytes payload: The raw message.
+
+        :param int connection_id: (optional) The id of the connection the
+            message was received over. The default is 0.
+
+        :param float wall_time: (optional) The time the message was received
+            per time.time(). The default is now.
+
+        :param float monotonic_time: (optional) The time the message was
+            received per time.monotonic(). The default is now.
+        """
+        if self.closed:
+            return
+        if wall_time is None:
+            wall_time = time.time()
+        if monotonic_time is None:
+            monotonic_time = time.monotonic()
+        self._pending.append((wall_time, monotonic_time, connection_id,
+                              payload))
+        self.recorded += 1
+        if len(self._pending) >= self.block_size:
+            self._wakeup.set()
+
+    def close(self):
+        """Write the queued messages and close the recording.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self.closed:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                self._write_pending()
+            self._write_pending()
+        except Exception:
+            logger.exception('recorder failed writing to {}'.format(
+                self.directory))
+        finally:
+            if self._segment is not None:
+                self._segment.close()
+                self._index.close()
+
+    def _write_pending(self):
+        pending = self._pending
+        while pending:
+            entries = []
+            while pending and len(entries) < self.block_size:
+                entries.append(pending.popleft())
+            self._write_block(entries)
+        if self._segment is not None:
+            self._segment.flush()
+            self._index.flush()
+
+    def _write_block(self, entries):
+        pack = _ENTRY.pack
+        data = b''.join(pack(wall, mono, conn, len(payload)) + payload
+                        for wall, mono, conn, payload in entries)
+        data = zlib.compress(data, self.compression)
+        first, last = entries[0][0], entries[-1][0]
+
+        if self._segment is None or self._segment.tell() >= self.segment_size:
+            self._open_segment(first)
+
+        offset = self._segment.tell()
+        self._segment.write(_BLOCK.pack(len(data), len(entries), first, last))
+        self._segment.write(data)
+        self._index.write(_INDEX.pack(first, last, offset, len(entries)))
+        self.written += len(entries)
+        self.bytes_written += _BLOCK.size + len(data)
+
+    def _open_segment(self, wall_time):
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+        name = 'segment-{:013d}'.format(int(wall_time * 1000))
+        path = os.path.join(self.directory, name)
+        suffix = 0
+        while os.path.exists(path + SEGMENT_SUFFIX):
+            suffix += 1
+            path = os.path.join(self.directory, '{}-{}'.format(name, suffix))
+        self._segment = open(path + SEGMENT_SUFFIX, 'wb')
+        self._index = open(path + INDEX_SUFFIX, 'wb')
+
+
+def segments(directory):
+    """Return the paths of the segments of a recording in time order.
+
+    :param str directory: The directory of the recording.
+
+    :returns: A list of segment paths (without their suffixes).
+    """
+    names = sorted(name[:-len(SEGMENT_SUFFIX)]
+                   for name in os.listdir(directory)
+                   if name.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(directory, name) for name in names]
+
+
+def read_index(path):
+    """Read the index of a segment.
+
+    :param str path: The path of the segment without its suffix.
+
+    :returns: A list of (first wall time, last wall time, offset, entry
+        count) tuples, one per block.
+    """
+    with open(path + INDEX_SUFFIX, 'rb') as f:
+        data = f.read()
+    end = len(data) - len(data) % _INDEX.size
+    return list(_INDEX.iter_unpack(data[:end]))
+
+
+def read(directory, start=None, end=None):
+    """Read the messages of a recording.
+
+    The sparse index is used to skip the blocks outside of [start, end].
+
+    :param str directory: The directory of the recording.
+
+    :param float start: (optional) Only read messages received at or after
+        this wall time (per time.time()). The default is None, the beginning
+        of the recording.
+
+    :param float end: (optional) Only read messages received at or before
+        this wall time. The default is None, the end of the recording.
+
+    :returns: A generator of :class:`Entry` in the order they were recorded.
+    """
+    for path in segments(directory):
+        blocks = [block for block in read_index(path)
+                  if (start is None or block[1] >= start) and
+                  (end is None or block[0] <= end)]
+        if not blocks:
+            continue
+        with open(path + SEGMENT_SUFFIX, 'rb') as f:
+            for first, last, offset, count in blocks:
+                f.seek(offset)
+                size = _BLOCK.unpack(f.read(_BLOCK.size))[0]
+                data = zlib.decompress(f.read(size))
+                pos = 0
+                for _ in range(count):
+                    wall, mono, conn, length = _ENTRY.unpack_from(data, pos)
+                    pos += _ENTRY.size
+                    if ((start is None or wall >= start) and
+                            (end is None or wall <= end)):
+                        yield Entry(wall, mono, conn, data[pos:pos + length])
+                    pos += length
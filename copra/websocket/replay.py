@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Replay of recorded WebSocket sessions through a client.
+
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from copra.websocket.client import ClientProtocol
+from copra.websocket.recorder import read
+
+logger = logging.getLogger(__name__)
+
+
+class Replayer:
+    """Replays a recorded WebSocket session through a client.
+
+    Each recorded message is passed, still encoded, to a
+    :class:`copra.websocket.client.ClientProtocol` bound to the client, so it
+    is decoded, sequence checked, dispatched to handlers and passed to
+    on_message exactly as a live message would be. No network connection is
+    made; create the client with auto_connect=False.
+
+    The messages are replayed in the order they were recorded. With a speed,
+    the gaps between them are reproduced from their recorded monotonic receive
+    times divided by the speed, so a speed of 1 replays in real time and a
+    speed of 10 ten times faster. With a speed of None, messages are replayed
+    as fast as possible and :attr:`rate` measures the throughput of the whole
+    client stack.
+
+    :ivar client: The client messages are replayed through.
+    :vartype client: copra.websocket.Client
+    :ivar float speed: The replay speed or None for as fast as possible.
+    :ivar int messages: The number of messages replayed.
+    :ivar float elapsed: The number of seconds the replay took.
+    """
+
+    def __init__(self, client, source, speed=None, start=None, end=None,
+                 yield_every=1000):
+        """
+
+        :param client: The client to replay messages through.
+        :type client: copra.websocket.Client
+
+        :param source: The directory of a recording made with
+            :class:`copra.websocket.Recorder` or an iterable of
+            :class:`copra.websocket.recorder.Entry`.
+        :type source: str or iterable
+
+        :param float speed: (optional) The replay speed as a multiple of real
+            time. The default is None, as fast as possible.
+
+        :param float start: (optional) Only replay messages received at or
+            after this wall time. The default is the beginning of the
+            recording.
+
+        :param float end: (optional) Only replay messages received at or
+            before this wall time. The default is the end of the recording.
+
+        :param int yield_every: (optional) When replaying as fast as possible,
+            the number of messages after which to yield to the event loop so
+            that tasks the handlers started can run. The default is 1000.
+
+        :raises ValueError: If speed is not positive.
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError('speed must be positive or None')
+        self.client = client
+        self.source = source
+        self.speed = speed
+        self.start = start
+        self.end = end
+        self.yield_every = yield_every
+        self.messages = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        """The number of messages replayed per second.
+        """
+        return self.messages / self.elapsed if self.elapsed else 0.0
+
+    def _entries(self):
+        if isinstance(self.source, str) and os.path.isdir(self.source):
+            return read(self.source, self.start, self.end)
+        return (entry for entry in self.source
+                if (self.start is None or entry.wall_time >= self.start) and
+                (self.end is None or entry.wall_time <= self.end))
+
+    async def run(self):
+        """Replay the messages.
+
+        :returns: The number of messages replayed.
+        """
+        protocol = ClientProtocol()
+        protocol.factory = self.client
+        on_message = protocol.onMessage
+        speed = self.speed
+        loop = self.client.loop
+
+        self.messages = 0
+        started = time.perf_counter()
+        first = last = None
+        for entry in self._entries():
+            if speed is None:
+                if self.messages % self.yield_every == 0:
+                    await asyncio.sleep(0)
+            else:
+                if last is None or entry.monotonic_time < last:
+                    # The start of the recording or of a recording made by
+                    # another process, whose monotonic clock is unrelated.
+                    first, loop_start = entry.monotonic_time, loop.time()
+                last = entry.monotonic_time
+                delay = loop_start + (last - first) / speed - loop.time()
+                if delay > 0.001:
+                    await asyncio.sleep(delay)
+            on_message(entry.payload, False)
+            self.messages += 1
+        self.elapsed = time.perf_counter() - started
+
+        logger.info('replayed {} messages in {:.3f}s ({:.0f}/s)'.format(
+            self.messages, self.elapsed, self.rate))
+        return self.messages
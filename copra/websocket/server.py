@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+"""A local stand-in for the Coinbase Pro WebSocket feed.
+
+The server speaks the subscribe/unsubscribe protocol of the real feed over
+plain (non-TLS) WebSockets and streams synthetic or recorded messages to each
+connection at a configurable rate. Disconnects, error messages and sequence
+gaps can be injected to exercise a client's recovery code.
+
+"""
+
+import asyncio
+from datetime import datetime
+import itertools
+import json
+import logging
+import random
+import struct
+
+from autobahn.asyncio.websocket import WebSocketServerFactory
+from autobahn.asyncio.websocket import WebSocketServerProtocol
+from autobahn.websocket.compress import (PerMessageDeflateOffer,
+                                         PerMessageDeflateOfferAccept)
+
+from copra.websocket.recorder import Entry, read
+
+logger = logging.getLogger(__name__)
+
+# The channels the server can generate synthetic messages for.
+CHANNELS = ('heartbeat', 'ticker', 'level2', 'matches', 'full')
+
+_SHORT = struct.Struct('!BB')
+_MEDIUM = struct.Struct('!BBH')
+_LONG = struct.Struct('!BBQ')
+
+_MATCH = ('{{"type":"match","trade_id":{trade},"maker_order_id":"{order}",'
+          '"taker_order_id":"{order}","side":"{side}","size":"0.01000000",'
+          '"price":"{price:.2f}","product_id":"{product_id}",'
+          '"sequence":{sequence},"time":"{time}"}}')
+
+_TEMPLATES = {
+    'heartbeat': ('{{"type":"heartbeat","last_trade_id":{trade},'
+                  '"product_id":"{product_id}","sequence":{sequence},'
+                  '"time":"{time}"}}'),
+    'ticker': ('{{"type":"ticker","trade_id":{trade},"sequence":{sequence},'
+               '"time":"{time}","product_id":"{product_id}",'
+               '"price":"{price:.2f}","side":"{side}",'
+               '"last_size":"0.01000000","best_bid":"{bid:.2f}",'
+               '"best_ask":"{ask:.2f}"}}'),
+    'level2': ('{{"type":"l2update","product_id":"{product_id}",'
+               '"time":"{time}","changes":[["{side}","{price:.2f}",'
+               '"0.01000000"]]}}'),
+    'matches': _MATCH,
+    'full': ('{{"type":"open","side":"{side}","price":"{price:.2f}",'
+             '"order_id":"{order}","remaining_size":"0.01000000",'
+             '"product_id":"{product_id}","sequence":{sequence},'
+             '"time":"{time}"}}',
+             '{{"type":"done","side":"{side}","order_id":"{order}",'
+             '"reason":"canceled","price":"{price:.2f}",'
+             '"remaining_size":"0.01000000","product_id":"{product_id}",'
+             '"sequence":{sequence},"time":"{time}"}}'),
+}
+
+
+def frame(payload):
+    """Return an unmasked, unfragmented WebSocket text frame.
+
+    Server frames are never masked, so a whole batch of messages can be framed
+    up front and written to the transport at once, which is much cheaper than
+    sending each through the protocol.
+
+    :param bytes payload: The UTF-8 encoded message.
+
+    :returns: The frame as bytes.
+    """
+    length = len(payload)
+    if length < 126:
+        return _SHORT.pack(0x81, length) + payload
+    if length < 65536:
+        return _MEDIUM.pack(0x81, 126, length) + payload
+    return _LONG.pack(0x81, 127, length) + payload
+
+
+def _accept_deflate(offers):
+    """Accept the first permessage-deflate offer of a client."""
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(offer)
+    return None
+
+
+class FeedServerProtocol(WebSocketServerProtocol):
+    """The server side of one connection to a :class:`FeedServer`.
+
+    :ivar dict channels: The product ids subscribed to, keyed by channel name.
+    :ivar int sent: The number of messages streamed to the connection.
+    """
+
+    def onOpen(self):
+        self.channels = {}
+        self.sent = 0
+        self._cursor = 0
+        self._entries = None
+        self._task = None
+        self.factory.connections.add(self)
+
+    def onClose(self, wasClean, code, reason):
+        self.factory.connections.discard(self)
+        if getattr(self, '_task', None) is not None:
+            self._task.cancel()
+
+    def onMessage(self, payload, isBinary):
+        try:
+            msg = json.loads(payload.decode('utf8'))
+            msg_type = msg['type']
+        except (ValueError, KeyError, TypeError):
+            self.send_error('Failed to subscribe', 'Malformed JSON')
+            return
+        if msg_type not in ('subscribe', 'unsubscribe'):
+            self.send_error('Failed to subscribe',
+                            'Type has to be either subscribe or unsubscribe')
+            return
+
+        channels = {}
+        for channel in msg.get('channels', []):
+            if isinstance(channel, str):
+                name, product_ids = channel, msg.get('product_ids', [])
+            else:
+                name, product_ids = channel['name'], channel['product_ids']
+            if name not in CHANNELS:
+                self.send_error('Failed to subscribe',
+                                '{} is not a valid channel'.format(name))
+                return
+            channels.setdefault(name, set()).update(product_ids)
+
+        snapshots = []
+        for name, product_ids in channels.items():
+            if msg_type == 'subscribe':
+                if name == 'level2':
+                    snapshots = sorted(product_ids -
+                                       self.channels.get(name, set()))
+                self.channels.setdefault(name, set()).update(product_ids)
+            elif name in self.channels:
+                self.channels[name] -= product_ids
+                if not self.channels[name]:
+                    del self.channels[name]
+
+        current = sorted(self.channels.items())
+        subscriptions = [{'name': name, 'product_ids': sorted(product_ids)}
+                         for name, product_ids in current]
+        self.send(json.dumps({'type': 'subscriptions',
+                              'channels': subscriptions}).encode('utf8'))
+        for product_id in snapshots:
+            self.send(self.factory.snapshot(product_id))
+
+        if self._task is None:
+            self._task = self.factory.loop.create_task(
+                self.factory._stream(self))
+
+    def send(self, payload):
+        """Send a message if the connection is still open.
+
+        :param bytes payload: The UTF-8 encoded message.
+        """
+        if self.state == self.STATE_OPEN:
+            self.sendMessage(payload)
+
+    def send_error(self, message, reason=''):
+        """Send an error message.
+
+        :param str message: A general description of the error.
+        :param str reason: A more detailed description of the error.
+        """
+        self.send(json.dumps({'type': 'error', 'message': message,
+                              'reason': reason}).encode('utf8'))
+
+    def next_batch(self, count):
+        """Return the next messages to stream to the connection.
+
+        :param int count: The maximum number of messages to return.
+
+        :returns: A list of UTF-8 encoded messages. It is empty if there is
+            nothing subscribed to and None once a recording has been streamed.
+        """
+        source = self.factory.source
+        if source is not None:
+            if self._entries is None:
+                if isinstance(source, str):
+                    source = read(source)
+                self._entries = iter(source)
+            batch = [entry.payload if isinstance(entry, Entry) else entry
+                     for entry in itertools.islice(self._entries, count)]
+            return batch or None
+
+        pairs = [(name, product_id)
+                 for name, product_ids in sorted(self.channels.items())
+                 for product_id in sorted(product_ids)]
+        if not pairs:
+            return []
+        start = self._cursor
+        self._cursor += count
+        return self.factory.synthetic(
+            pairs[i % len(pairs)] for i in range(start, start + count))
+
+
+class FeedServer(WebSocketServerFactory):
+    """A local WebSocket server emulating the Coinbase Pro feed.
+
+    Each connection subscribes and unsubscribes with the same messages as the
+    real feed and is answered with a subscriptions message (or an error
+    message). Once a connection has subscribed, the server streams messages
+    to it at rate messages per second.
+
+    By default the messages are synthetic: a round robin over the channels
+    and products the connection is subscribed to. Full channel messages
+    advance per-product sequence numbers shared by all connections, as on
+    the real feed, and the other channels report the latest one. Subscribing to
+    level2 sends a snapshot first. If source is given, its messages are
+    streamed verbatim instead, regardless of the subscriptions.
+
+    Connect a client to :attr:`url`::
+
+        server = FeedServer(loop, rate=100000, disconnect_every=1000000)
+        await server.start()
+        client = Client(loop, channels, feed_url=server.url)
+
+    :ivar str url: The url of the server, set by :meth:`start`.
+    :ivar set connections: The open connections.
+    :ivar int sent: The number of messages streamed to all connections.
+    """
+
+    protocol = FeedServerProtocol
+
+    def __init__(self, loop, host='127.0.0.1', port=0, source=None, rate=None,
+                 disconnect_every=None, error_every=None, gap_every=None,
+                 batch_size=1000, max_buffer=4 * 1024 * 1024, seed=None,
+                 compression=False, name='Feed Server'):
+        """
+
+        :param loop: The asyncio loop that the server runs in.
+        :type loop: asyncio loop
+
+        :param str host: (optional) The interface to listen on. The default is
+            '127.0.0.1'.
+
+        :param int port: (optional) The port to listen on. The default is 0,
+            a free port chosen by the operating system.
+
+        :param source: (optional) The directory of a recording made with
+            :class:`copra.websocket.Recorder`, or an iterable of
+            :class:`copra.websocket.recorder.Entry` or of UTF-8 encoded
+            messages, to stream to every connection. The default is None, in
+            which case synthetic messages are streamed.
+        :type source: str or iterable
+
+        :param int rate: (optional) The number of messages per second to
+            stream to each connection. The default is None, as fast as the
+            connection accepts them.
+
+        :param int disconnect_every: (optional) Drop a connection, without a
+            closing handshake, after streaming it this many messages. The
+            default is None, never.
+
+        :param int error_every: (optional) Send an error message after every
+            error_every messages streamed to a connection. The default is
+            None, never.
+
+        :param int gap_every: (optional) Skip a sequence number of a product
+            after every gap_every synthetic messages for it on the full
+            channel. The default is None, never.
+
+        :param int batch_size: (optional) The maximum number of messages
+            written to a connection before yielding to the loop. The default
+            is 1000.
+
+        :param int max_buffer: (optional) Streaming to a connection pauses
+            while more than this many bytes are waiting to be sent to it. The
+            default is 4 MiB.
+
+        :param seed: (optional) The seed of the synthetic prices and sides.
+            The default is None.
+
+        :param bool compression: (optional) If True, the server accepts
+            permessage-deflate compression when a client offers it and
+            compresses the messages it sends over those connections, which
+            is slower than sending them uncompressed. The default is False.
+
+        :param str name: A name to identify this server in logging, etc.
+        """
+        # The factory's session parameters include host, port and url, so
+        # set them up before overriding those.
+        super().__init__(loop=loop)
+
+        self.loop = loop
+        self.host = host
+        self.port = port
+        self.source = source
+        self.rate = rate
+        self.disconnect_every = disconnect_every
+        self.error_every = error_every
+        self.gap_every = gap_every
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.compression = compression
+        self.name = name
+        if compression:
+            self.setProtocolOptions(
+                perMessageCompressionAccept=_accept_deflate)
+
+        self.url = None
+        self.connections = set()
+        self.sent = 0
+        self._server = None
+        self._sequences = {}
+        self._counts = {}
+        self._full_counts = {}
+        self._prices = {}
+        self._random = random.Random(seed)
+
+    async def start(self):
+        """Start listening for connections."""
+        self._server = await self.loop.create_server(self, self.host,
+                                                     self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.url = 'ws://{}:{}'.format(self.host, self.port)
+        self.setSessionParameters(url=self.url)
+        logger.info('{} listening on {}'.format(self.name, self.url))
+
+    async def close(self):
+        """Drop all connections and stop listening."""
+        self.drop_connections()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def drop_connections(self):
+        """Drop all open connections without a closing handshake."""
+        for protocol in list(self.connections):
+            protocol.dropConnection(abort=True)
+
+    def send_error(self, message, reason=''):
+        """Send an error message to all open connections.
+
+        :param str message: A general description of the error.
+        :param str reason: A more detailed description of the error.
+        """
+        for protocol in list(self.connections):
+            protocol.send_error(message, reason)
+
+    def gap(self, product_id, count=1):
+        """Skip sequence numbers of a product.
+
+        :param str product_id: The product id.
+        :param int count: (optional) The number of sequence numbers to skip.
+            The default is 1.
+        """
+        sequence = self._sequences.get(product_id, 0)
+        self._sequences[product_id] = sequence + count
+
+    def snapshot(self, product_id):
+        """Return a level2 snapshot message around the current synthetic price.
+
+        :param str product_id: The product id.
+
+        :returns: The UTF-8 encoded message.
+        """
+        price = self._prices.setdefault(product_id, 100.0)
+        bids = [['{:.2f}'.format(price - 0.01 * i), '1.00000000']
+                for i in range(1, 51)]
+        asks = [['{:.2f}'.format(price + 0.01 * i), '1.00000000']
+                for i in range(1, 51)]
+        return json.dumps({'type': 'snapshot', 'product_id': product_id,
+                           'bids': bids, 'asks': asks}).encode('utf8')
+
+    def synthetic(self, pairs):
+        """Return synthetic messages.
+
+        :param pairs: The channel name and product id of each message.
+        :type pairs: iterable of (str, str)
+
+        :returns: A list of UTF-8 encoded messages.
+        """
+        now = datetime.utcnow().isoformat() + 'Z'
+        sequences = self._sequences
+        counts = self._counts
+        full_counts = self._full_counts
+        prices = self._prices
+        rand = self._random.random
+        gap_every = self.gap_every
+        batch = []
+        for name, product_id in pairs:
+            count = counts.get(product_id, 0) + 1
+            counts[product_id] = count
+            sequence = sequences.get(product_id, 0)
+            if name == 'full':
+                sequence += 1
+                full_count = full_counts.get(product_id, 0) + 1
+                full_counts[product_id] = full_count
+                if gap_every and full_count % gap_every == 0:
+                    sequence += 1
+                sequences[product_id] = sequence
+
+            price = prices.get(product_id, 100.0)
+            step = rand()
+            side = 'buy' if step < 0.5 else 'sell'
+            price = max(0.01, price + (0.01 if step < 0.5 else -0.01))
+            prices[product_id] = price
+
+            template = _TEMPLATES[name]
+            if name == 'full':
+                template = template[1 - sequence % 2]
+            batch.append(template.format(
+                sequence=sequence, trade=count, order=(sequence + 1) // 2,
+                side=side, price=price, bid=price - 0.01, ask=price + 0.01,
+                product_id=product_id, time=now).encode('utf8'))
+        return batch
+
+    async def _stream(self, protocol):
+        """Stream messages to a connection until it closes.
+
+        :param protocol: The connection.
+        :type protocol: FeedServerProtocol
+        """
+        interval = 0.01
+        started = self.loop.time()
+        streamed = 0
+        while protocol.state == protocol.STATE_OPEN:
+            transport = protocol.transport
+            if transport.get_write_buffer_size() > self.max_buffer:
+                await asyncio.sleep(interval)
+                # Don't burst to catch up on the time spent waiting.
+                started, streamed = self.loop.time(), 0
+                continue
+
+            count = self.batch_size
+            if self.rate is not None:
+                count = min(count, max(1, int(self.rate * interval)))
+            for limit in (self.disconnect_every, self.error_every):
+                if limit:
+                    count = min(count, limit - protocol.sent % limit)
+
+            batch = protocol.next_batch(count)
+            if batch is None:
+                break
+            if not batch:
+                await asyncio.sleep(interval)
+                started, streamed = self.loop.time(), 0
+                continue
+
+            if protocol._perMessageCompress is None:
+                transport.write(b''.join([frame(payload)
+                                          for payload in batch]))
+            else:
+                # Compressed frames depend on the previous ones, so leave
+                # them to autobahn.
+                for payload in batch:
+                    protocol.sendMessage(payload)
+            protocol.sent += len(batch)
+            self.sent += len(batch)
+            streamed += len(batch)
+
+            if self.error_every and protocol.sent % self.error_every == 0:
+                protocol.send_error('Injected error', 'error_every')
+            if (self.disconnect_every and
+                    protocol.sent % self.disconnect_every == 0):
+                msg = '{} dropping connection after {} messages.'
+                logger.info(msg.format(self.name, protocol.sent))
+                protocol.dropConnection(abort=True)
+                break
+
+            if self.rate is None:
+                await asyncio.sleep(0)
+            else:
+                delay = started + streamed / self.rate - self.loop.time()
+                await asyncio.sleep(max(0, delay))
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""WebSocket client that spreads products across several connections.
+
+"""
+
+import asyncio
+import logging
+import zlib
+
+from copra.websocket.client import Client
+
+logger = logging.getLogger(__name__)
+
+
+class _Shard(Client):
+    """A connection of a ShardedClient. Passes messages and errors on to the
+    ShardedClient.
+    """
+
+    def __init__(self, parent, *args, **kwargs):
+        self.parent = parent
+        super().__init__(*args, **kwargs)
+
+    def on_error(self, message, reason=''):
+        self.parent.on_error(message, reason)
+
+    def on_message(self, message):
+        self.parent.on_message(message)
+
+    def on_record(self, record):
+        self.parent.on_record(record)
+
+    async def close(self):
+        # The pool is shared by the shards and closed by the parent.
+        self.pool = None
+        await super().close()
+
+
+class ShardedClient:
+    """Asyncronous WebSocket client for Coinbase Pro that spreads its
+    products across several connections.
+
+    Each product is assigned to one shard (connection) the first time it is
+    subscribed to and stays there, so the messages for a product arrive in
+    order. Products are assigned either by a stable hash of the product id or,
+    if weights are provided, to the shard with the lowest total weight.
+
+    A ShardedClient has the same subscribe, unsubscribe, on, off and callback
+    methods as :class:`copra.websocket.Client`. Subclass it and override
+    on_message (and on_record) to handle the messages of every shard in one
+    place.
+
+    A shard only connects once it has channels to subscribe to, since the
+    server drops connections that don't subscribe. If a
+    :class:`copra.websocket.ProcessPool` is passed, it is shared by every
+    shard, its records are passed to the ShardedClient's on_record and it is
+    closed once every shard is.
+
+    :ivar shards: The clients of the individual connections.
+    :vartype shards: list of copra.websocket.Client
+    """
+
+    def __init__(self, loop, channels, shards=2, weights=None,
+                 name='Sharded WebSocket Client', **kwargs):
+        """
+
+        :param loop: The asyncio loop that the client runs in.
+        :type loop: asyncio loop
+
+        :param channels: The channels to initially subscribe to.
+        :type channels: Channel or list of Channels
+
+        :param int shards: (optional) The number of connections. The default
+            is 2.
+
+        :param dict weights: (optional) A dict of product id to the relative
+            load (eg., messages per second) of the product. If provided,
+            products are assigned heaviest first to the shard with the lowest
+            total weight. Products not in the dict have a weight of 1. The
+            default is None, in which case products are assigned by a hash of
+            their product id.
+
+        :param str name: (optional) A name to identify this client in logging,
+            etc. The shards are named after it.
+
+        :param kwargs: Any other keyword arguments accepted by
+            :class:`copra.websocket.Client` (feed_url, auth, key,
+            auto_connect, pool, etc.). They apply to every shard.
+
+        :raises ValueError: If shards is less than 1 or a shard raises it.
+        """
+        if shards < 1:
+            raise ValueError('shards must be at least 1')
+
+        self.loop = loop
+        self.name = name
+        self.weights = weights
+        self.auto_connect = kwargs.pop('auto_connect', True)
+        self.pool = kwargs.pop('pool', None)
+        self._shard_of = {}
+        self._loads = [0] * shards
+        # The shards added to the loop, and whether new ones should be.
+        self._started = set()
+        self._connecting = False
+
+        if not isinstance(channels, list):
+            channels = [channels]
+
+        if weights:
+            # Assign the initial products heaviest first for a better balance.
+            product_ids = set()
+            for channel in channels:
+                product_ids |= channel.product_ids
+            for product_id in sorted(product_ids,
+                                     key=lambda p: (-weights.get(p, 1), p)):
+                self._assign(product_id)
+
+        split = self._split(channels)
+        self.shards = [_Shard(self, loop, split[i],
+                              name='{} shard {}'.format(name, i),
+                              auto_connect=False, **kwargs)
+                       for i in range(shards)]
+        if self.pool is not None:
+            self.pool.start(loop, self.on_record)
+            for shard in self.shards:
+                shard.pool = self.pool
+
+        if self.auto_connect:
+            self.add_as_task_to_loop()
+
+    def _assign(self, product_id):
+        """Return the index of the shard for a product, assigning one if the
+        product hasn't been seen before.
+        """
+        index = self._shard_of.get(product_id)
+        if index is None:
+            if self.weights:
+                weight = self.weights.get(product_id, 1)
+                index = self._loads.index(min(self._loads))
+            else:
+                weight = 1
+                index = (zlib.crc32(product_id.encode('utf8')) %
+                         len(self._loads))
+            self._loads[index] += weight
+            self._shard_of[product_id] = index
+        return index
+
+    def _split(self, channels):
+        """Split channels into a list of channels for each shard.
+        """
+        if not isinstance(channels, list):
+            channels = [channels]
+        split = [[] for _ in self._loads]
+        for channel in channels:
+            by_shard = {}
+            for product_id in channel.product_ids:
+                index = self._assign(product_id)
+                by_shard.setdefault(index, []).append(product_id)
+            for index, product_ids in by_shard.items():
+                split[index].append(type(channel)(channel.name, product_ids))
+        return split
+
+    def shard_for(self, product_id):
+        """Return the shard a product is (or would be) assigned to.
+
+        :param str product_id: The product id.
+
+        :returns: The copra.websocket.Client of the shard.
+        """
+        return self.shards[self._assign(product_id)]
+
+    @property
+    def channels(self):
+        """The channels subscribed to across all shards, as a dict of channel
+        name to Channel.
+        """
+        channels = {}
+        for shard in self.shards:
+            for name, channel in shard.channels.items():
+                if name in channels:
+                    channels[name] = channels[name] + channel
+                else:
+                    channels[name] = channel
+        return channels
+
+    def subscribe(self, channels):
+        """Subscribe to the given channels.
+
+        :param channels: The channels to subscribe to.
+        :type channels: Channel or list of Channels
+        """
+        for shard, shard_channels in zip(self.shards, self._split(channels)):
+            if shard_channels:
+                shard.subscribe(shard_channels)
+        if self._connecting:
+            self._start()
+
+    def unsubscribe(self, channels):
+        """Unsubscribe from the given channels.
+
+        Products keep their shard assignment.
+
+        :param channels: The channels to unsubscribe from.
+        :type channels: Channel or list of Channels
+        """
+        for shard, shard_channels in zip(self.shards, self._split(channels)):
+            if shard_channels:
+                shard.unsubscribe(shard_channels)
+
+    def _shards_for(self, product_id):
+        if product_id is None:
+            return self.shards
+        return [self.shard_for(product_id)]
+
+    def on(self, msg_type, handler, product_id=None):
+        """Register a handler for messages of a type and/or product.
+
+        See :meth:`copra.websocket.Client.on`. Handlers for a product are
+        registered with its shard only, and the rest with every shard.
+        """
+        shards = self._shards_for(product_id)
+        for shard in shards:
+            shard.on(msg_type, handler, product_id=product_id)
+
+    def off(self, msg_type, handler, product_id=None):
+        """Remove a handler registered with :meth:`on`.
+
+        :raises ValueError: If the handler was not registered for msg_type and
+            product_id.
+        """
+        shards = self._shards_for(product_id)
+        for shard in shards:
+            shard.off(msg_type, handler, product_id=product_id)
+
+    def add_as_task_to_loop(self):
+        """Add every shard that has channels to the asyncio loop.
+
+        The other shards are added once they are subscribed to something.
+        """
+        self._connecting = True
+        self._started = set()
+        self._start()
+
+    def _start(self):
+        """Add the shards that have channels and haven't been added yet to
+        the asyncio loop.
+        """
+        for index, shard in enumerate(self.shards):
+            if shard.channels and index not in self._started:
+                self._started.add(index)
+                shard.add_as_task_to_loop()
+
+    def on_error(self, message, reason=''):
+        """Callback fired when an error message is received by any shard.
+
+        :param str message: A general description of the error.
+        :param str reason:  A more detailed description of the error.
+        """
+        logger.error('{}. {}'.format(message, reason))
+
+    def on_message(self, message):
+        """Callback fired when a complete WebSocket message was received by
+        any shard.
+
+        You will likely want to override this method.
+
+        :param dict message: Dictionary representing the message.
+        """
+        print(message)
+
+    def on_record(self, record):
+        """Callback fired when the pool returns a record.
+
+        You will likely want to override this method if the client has a
+        pool.
+
+        :param record: The record returned by the pool's processor.
+        """
+        print(record)
+
+    async def close(self):
+        """Close the WebSocket connections of every shard, then the pool.
+        """
+        self._connecting = False
+        await asyncio.gather(*[shard.close() for shard in self.shards])
+        if self.pool is not None:
+            await self.pool.close()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Detection of products, and connections, that have silently gone stale.
+
+"""
+
+import logging
+import time
+
+from copra.websocket.channel import Channel
+
+logger = logging.getLogger(__name__)
+
+
+class Watchdog:
+    """Flags products a client has stopped receiving messages for.
+
+    A half-open TCP connection, or a feed that stops publishing a product,
+    doesn't close the connection, so the client keeps waiting for messages
+    that never come. Once attached to a client, the watchdog subscribes to
+    the heartbeat channel for every product the client is subscribed to, so
+    each product gets at least one message a second even when its market is
+    quiet, and checks every interval seconds when each product last had a
+    message.
+
+    A product without a message for timeout seconds is stale. It is
+    resubscribed to on every channel the client has it on, and
+    :meth:`on_stale` is called. If every product is stale at once, the
+    connection itself is presumed dead and is dropped, which makes the
+    client reconnect (if auto_reconnect is set). A stale product is fresh
+    again as soon as a message for it arrives.
+
+    :ivar float timeout: The seconds of silence after which a product is
+        stale.
+    :ivar dict last_message: The time, per time.monotonic(), of the last
+        message for each product.
+    :ivar dict last_heartbeat: The time, per time.monotonic(), of the last
+        heartbeat for each product.
+    :ivar set stale: The products that are currently stale.
+    :ivar int resubscribes: The number of times a product was resubscribed.
+    :ivar int reconnects: The number of times the connection was dropped.
+    """
+
+    def __init__(self, timeout=5.0, interval=None, heartbeat=True):
+        """
+
+        :param float timeout: (optional) The seconds of silence after which a
+            product is stale. The default is 5.0.
+
+        :param float interval: (optional) The seconds between checks. The
+            default is None, a quarter of timeout.
+
+        :param bool heartbeat: (optional) If True, subscribe to the heartbeat
+            channel for the products being watched. The default is True.
+        """
+        self.timeout = timeout
+        self.interval = interval if interval is not None else timeout / 4
+        self.heartbeat = heartbeat
+        self.client = None
+        self.last_message = {}
+        self.last_heartbeat = {}
+        self.stale = set()
+        self.resubscribes = 0
+        self.reconnects = 0
+        self._connection_id = None
+        self._since = {}
+        self._handle = None
+
+    def attach(self, client):
+        """Start watching the products a WebSocket client is subscribed to.
+
+        :param client: The client to watch.
+        :type client: copra.websocket.Client
+        """
+        self.client = client
+        client.on(None, self.process)
+        if self.heartbeat:
+            product_ids = self.products()
+            if product_ids:
+                client.subscribe(Channel('heartbeat', list(product_ids)))
+        self._handle = client.loop.call_later(self.interval, self._tick)
+
+    def detach(self, client):
+        """Stop watching a WebSocket client.
+
+        The client remains subscribed to the heartbeat channel.
+
+        :param client: The client to stop watching.
+        :type client: copra.websocket.Client
+        """
+        client.off(None, self.process)
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self.client = None
+
+    def products(self):
+        """Return the product ids the client is subscribed to.
+
+        :returns: A set of product ids.
+        """
+        product_ids = set()
+        for channel in self.client.channels.values():
+            product_ids |= channel.product_ids
+        return product_ids
+
+    def is_stale(self, product_id):
+        """Return True if a product is stale.
+
+        :param str product_id: The product id.
+        """
+        return product_id in self.stale
+
+    def process(self, message):
+        """Note the arrival of a message.
+
+        :param dict message: Dictionary representing the message.
+        """
+        product_id = message.get('product_id')
+        if product_id is None:
+            return
+        now = time.monotonic()
+        self.last_message[product_id] = now
+        if message['type'] == 'heartbeat':
+            self.last_heartbeat[product_id] = now
+        if product_id in self.stale:
+            self.stale.discard(product_id)
+            logger.info('{} is receiving messages for {} again.'.format(
+                self.client.name, product_id))
+
+    def _tick(self):
+        self._handle = None
+        client = self.client
+        if client is None:
+            return
+        try:
+            self.check()
+        finally:
+            if self.client is not None:
+                self._handle = client.loop.call_later(self.interval,
+                                                      self._tick)
+
+    def check(self, now=None):
+        """Find the stale products and resubscribe them, or drop the
+        connection if every product is stale.
+
+        Called every interval seconds while attached. A product is given
+        timeout seconds from each new connection, and from being
+        resubscribed, before it can be (again) stale.
+
+        :param float now: (optional) The current time per time.monotonic().
+            The default is now.
+
+        :returns: The list of product ids found stale.
+        """
+        client = self.client
+        if not client.connected.is_set():
+            return []
+        if now is None:
+            now = time.monotonic()
+        if client.connection_id != self._connection_id:
+            self._connection_id = client.connection_id
+            self._since.clear()
+            self.stale.clear()
+
+        product_ids = self.products()
+        stale = []
+        for product_id in sorted(product_ids):
+            since = self._since.setdefault(product_id, now)
+            last = max(self.last_message.get(product_id, since), since)
+            if now - last > self.timeout:
+                stale.append(product_id)
+        if not stale:
+            return stale
+
+        self.stale.update(stale)
+        for product_id in stale:
+            self.on_stale(product_id)
+        if len(stale) == len(product_ids):
+            msg = '{} received nothing for {}s, dropping the connection.'
+            logger.warning(msg.format(client.name, self.timeout))
+            self.reconnects += 1
+            client.protocol.dropConnection(abort=True)
+        else:
+            for product_id in stale:
+                self.resubscribe(product_id)
+                self._since[product_id] = now
+        return stale
+
+    def resubscribe(self, product_id):
+        """Unsubscribe from and subscribe to every channel the client has a
+        product on.
+
+        The last full channel sequence number of the product is kept, so any
+        messages missed while it was stale are detected as a gap (and
+        repaired if the client has a rest_client).
+
+        :param str product_id: The product id.
+        """
+        client = self.client
+        channels = [Channel(name, product_id)
+                    for name, channel in sorted(client.channels.items())
+                    if product_id in channel.product_ids]
+        if channels:
+            self.resubscribes += 1
+            sequence = client._sequences.get(product_id)
+            client.unsubscribe(channels)
+            # Send the unsubscribe before the subscribe cancels it out.
+            client.flush_subscriptions()
+            client.subscribe(channels)
+            if product_id in client._sequences:
+                client._sequences[product_id] = sequence
+
+    def on_stale(self, product_id):
+        """Callback fired when a product goes stale, before it is
+        resubscribed or the connection is dropped.
+
+        Override this to, for instance, stop trading on the product's prices
+        until it is fresh again.
+
+        :param str product_id: The product id.
+        """
+        msg = '{} received nothing for {} for {}s.'
+        logger.warning(msg.format(self.client.name, product_id, self.timeout))
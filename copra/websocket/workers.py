@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""Per-product worker tasks for handling WebSocket messages asynchronously.
+
+"""
+
+import inspect
+import logging
+import time
+
+from copra.websocket.dispatch import HandlerTable
+from copra.websocket.queue import DROP_OLDEST, MessageQueue
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """The queue and task that handle the messages of a product or group of
+    products.
+
+    :ivar str name: The product id or group name of the worker.
+    :ivar queue: The worker's queue. Its length is the number of messages
+        waiting to be handled, and its received, dropped and high_water
+        counters apply to the worker.
+    :vartype queue: copra.websocket.queue.MessageQueue
+    :ivar task: The asyncio task running the worker, or None if it hasn't
+        received a message yet.
+    :ivar int handled: The number of messages handled.
+    :ivar int errors: The number of handlers that raised an exception.
+    :ivar float busy: The total seconds spent in handlers.
+    """
+
+    def __init__(self, name, queue):
+        self.name = name
+        self.queue = queue
+        self.task = None
+        self.handled = 0
+        self.errors = 0
+        self.busy = 0.0
+
+    def __repr__(self):
+        return 'Worker({!r}, depth={})'.format(self.name, len(self.queue))
+
+    @property
+    def depth(self):
+        """The number of messages waiting to be handled."""
+        return len(self.queue)
+
+    def stats(self):
+        """Return the worker's counters.
+
+        :returns: A dict with the worker's depth, high_water, received,
+            dropped, handled, errors and busy values.
+        """
+        queue = self.queue
+        return {'depth': len(queue), 'high_water': queue.high_water,
+                'received': queue.received, 'dropped': queue.dropped,
+                'handled': self.handled, 'errors': self.errors,
+                'busy': self.busy}
+
+
+class ProductWorkers:
+    """Handles the messages of each product, or group of products, in its own
+    asyncio task.
+
+    Handlers registered with :meth:`copra.websocket.Client.on` are called
+    inline as messages are read, one after another, so a slow handler for
+    one product delays the messages of every other product. Handlers
+    registered with :meth:`on` are instead called by a worker task, one per
+    product or group, fed by its own
+    :class:`copra.websocket.queue.MessageQueue`.
+
+    Each worker handles its messages in the order they were received, and a
+    handler may be a coroutine function: while it awaits, the workers of
+    other products carry on. The queues apply the usual overflow policies.
+    With the default 'drop-oldest' policy a worker that falls maxsize
+    messages behind discards its oldest messages, and the other workers are
+    unaffected. The 'block' policy opts back into backpressure: a worker
+    that falls behind pauses reading from the socket, and so holds up every
+    product, until it catches up.
+
+    Messages without a product id, such as subscriptions, are handled by a
+    worker named None.
+
+    :ivar dict workers: The :class:`Worker` of each product or group, keyed
+        by its name.
+    """
+
+    def __init__(self, groups=None, maxsize=1000, policy=DROP_OLDEST):
+        """
+
+        :param dict groups: (optional) Products to handle in a shared worker,
+            keyed by the worker's name, e.g. ``{'majors': ['BTC-USD',
+            'ETH-USD']}``. Other products get a worker each, named by their
+            product id. The default is None, a worker per product.
+
+        :param int maxsize: (optional) The maximum number of messages in each
+            worker's queue. The default is 1000.
+
+        :param str policy: (optional) What to do when a worker's queue is
+            full: 'block', 'drop-oldest', 'drop-newest' or 'conflate'. See
+            :class:`copra.websocket.queue.MessageQueue`. The default is
+            'drop-oldest'.
+        """
+        self.maxsize = maxsize
+        self.policy = policy
+        self.client = None
+        self.workers = {}
+        self._groups = {}
+        for name, product_ids in (groups or {}).items():
+            for product_id in product_ids:
+                self._groups[product_id] = name
+        # product id: the Worker handling it.
+        self._routes = {}
+        self._dispatch = HandlerTable()
+
+    def __repr__(self):
+        return 'ProductWorkers(workers={})'.format(len(self.workers))
+
+    def attach(self, client):
+        """Start handling the messages a WebSocket client receives.
+
+        Workers ended by :meth:`detach` are replaced by new ones, with new
+        counters.
+
+        :param client: The client to attach to.
+        :type client: copra.websocket.Client
+        """
+        self.workers = {name: worker for name, worker in self.workers.items()
+                        if not worker.queue.closed}
+        self._routes = {product_id: worker
+                        for product_id, worker in self._routes.items()
+                        if not worker.queue.closed}
+        self.client = client
+        client.on(None, self.put)
+
+    def detach(self, client):
+        """Stop handling the messages of a WebSocket client.
+
+        The workers' queues are closed. Each worker handles the messages
+        already on its queue and then ends; await :meth:`join` to wait for
+        them to.
+
+        :param client: The client to detach from.
+        :type client: copra.websocket.Client
+        """
+        client.off(None, self.put)
+        for worker in self.workers.values():
+            worker.queue.close()
+        self.client = None
+
+    async def join(self):
+        """Wait for every worker to end after :meth:`detach`."""
+        for worker in list(self.workers.values()):
+            if worker.task is not None:
+                await worker.task
+
+    def on(self, msg_type, handler, product_id=None):
+        """Register a handler to be called by the workers.
+
+        Handlers are matched to messages as by
+        :meth:`copra.websocket.Client.on`.
+
+        :param str msg_type: The message type or None for messages of every
+            type.
+
+        :param handler: A callable or coroutine function that takes the
+            message dict as its only argument.
+
+        :param str product_id: (optional) If provided, the handler is only
+            called for messages about this product. The default is None.
+        """
+        self._dispatch.add(msg_type, handler, product_id)
+
+    def off(self, msg_type, handler, product_id=None):
+        """Remove a handler registered with :meth:`on`.
+
+        :param str msg_type: The message type the handler was registered for.
+
+        :param handler: The callable to remove.
+
+        :param str product_id: (optional) The product id the handler was
+            registered for. The default is None.
+
+        :raises ValueError: If the handler was not registered for msg_type and
+            product_id.
+        """
+        self._dispatch.remove(msg_type, handler, product_id)
+
+    def worker(self, product_id):
+        """Return the worker that handles a product's messages, creating it
+        if need be.
+
+        :param str product_id: The product id, or None for messages without
+            one.
+
+        :returns: A :class:`Worker`.
+        """
+        worker = self._routes.get(product_id)
+        if worker is None:
+            name = self._groups.get(product_id, product_id)
+            worker = self.workers.get(name)
+            if worker is None:
+                queue = MessageQueue(self.client, self.maxsize, self.policy)
+                worker = self.workers[name] = Worker(name, queue)
+            self._routes[product_id] = worker
+        return worker
+
+    def put(self, message):
+        """Queue a message for the worker of its product.
+
+        :param dict message: Dictionary representing the message.
+        """
+        worker = self._routes.get(message.get('product_id'))
+        if worker is None:
+            worker = self.worker(message.get('product_id'))
+        if worker.task is None:
+            worker.task = self.client.loop.create_task(self._run(worker))
+        worker.queue.put(message)
+
+    async def _run(self, worker):
+        dispatch = self._dispatch
+        async for message in worker.queue:
+            key = (message['type'], message.get('product_id'))
+            handlers = dispatch.cache.get(key)
+            if handlers is None:
+                handlers = dispatch.lookup(key)
+            started = time.monotonic()
+            for handler in handlers:
+                try:
+                    result = handler(message)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    worker.errors += 1
+                    logger.exception('Handler for {} failed.'.format(
+                        worker.name))
+            worker.busy += time.monotonic() - started
+            worker.handled += 1
+
+    def stats(self):
+        """Return the counters of every worker.
+
+        :returns: A dict of :meth:`Worker.stats` dicts keyed by worker name.
+        """
+        return {name: worker.stats() for name, worker in self.workers.items()}
@@ -31,12 +31,15 @@ setup(
     ],
     description="Asyncronous Python REST and WebSocket Clients for the Coinbase Pro virtual currency trading platform.",
     install_requires=requirements,
+    extras_require={'numpy': ['numpy'], 'orjson': ['orjson'],
+                    'ujson': ['ujson']},
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
     keywords='copra coinbase pro gdax api bitcoin litecoin etherium rest websocket client',
     name='copra',
-    packages=['copra', 'copra.rest', 'copra.websocket'],
+    packages=['copra', 'copra.book', 'copra.market', 'copra.rest',
+              'copra.websocket'],
     setup_requires=setup_requirements,
     test_suite='tests',
     tests_require=test_requirements,
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.book.bbo` module."""
+
+from asynctest import TestCase, MagicMock
+
+from copra.book import BBOStream
+from copra.websocket import Channel, Client
+
+
+SNAPSHOT = {
+    'type': 'snapshot',
+    'product_id': 'BTC-USD',
+    'bids': [['6500.10', '0.5'], ['6500.00', '1.25']],
+    'asks': [['6500.20', '0.75'], ['6501.00', '2']]
+}
+
+
+def update(*changes, product_id='BTC-USD'):
+    return {'type': 'l2update', 'product_id': product_id,
+            'time': '2019-01-07T23:41:39.123456Z', 'changes': list(changes)}
+
+
+class TestBBOStream(TestCase):
+    """Tests for copra.book.BBOStream"""
+
+    def setUp(self):
+        self.stream = BBOStream('BTC-USD')
+        self.stream.on_bbo = MagicMock()
+
+    def test_process(self):
+        stream = self.stream
+        self.assertIsNone(stream.process(update(['buy', '6500.05', '1'])))
+        event = stream.process(SNAPSHOT)
+        self.assertEqual(event, {'type': 'bbo', 'product_id': 'BTC-USD',
+                                 'time': None,
+                                 'bid': (6500.10, 0.5), 'ask': (6500.20, 0.75),
+                                 'old_bid': None, 'old_ask': None})
+        stream.on_bbo.assert_called_once_with(event)
+
+        # away from the top of the book
+        self.assertIsNone(stream.process(update(['buy', '6499.00', '1'],
+                                                ['sell', '6501.00', '0'])))
+
+        # size at the best bid
+        event = stream.process(update(['buy', '6500.10', '0.7']))
+        self.assertEqual(event['bid'], (6500.10, 0.7))
+        self.assertEqual(event['old_bid'], (6500.10, 0.5))
+        self.assertEqual(event['ask'], event['old_ask'])
+        self.assertEqual(event['time'], '2019-01-07T23:41:39.123456Z')
+
+        # best ask removed
+        event = stream.process(update(['sell', '6500.20', '0']))
+        self.assertIsNone(event['ask'])
+        self.assertEqual(event['old_ask'], (6500.20, 0.75))
+        self.assertEqual(stream.bbo('BTC-USD'), ((6500.10, 0.7), None))
+
+        # other products
+        self.assertIsNone(stream.process(dict(SNAPSHOT, product_id='ETH-USD')))
+
+        self.assertEqual(stream.updates, 4)
+        self.assertEqual(stream.events, 3)
+
+    def test_attach(self):
+        client = Client(self.loop, Channel('heartbeat', 'BTC-USD'),
+                        auto_connect=False)
+        client.on_message = MagicMock()
+        handler = MagicMock()
+        client.on('bbo', handler, product_id='BTC-USD')
+        self.stream.attach(client)
+        self.assertIn('BTC-USD', client.channels['level2'].product_ids)
+
+        client._process_message(SNAPSHOT)
+        client._process_message(update(['buy', '6499.00', '1']))
+        client._process_message(update(['sell', '6500.15', '1']))
+        self.assertEqual(handler.call_count, 2)
+        self.assertEqual(handler.call_args[0][0]['ask'], (6500.15, 1.0))
+
+        self.stream.detach(client)
+        client._process_message(update(['sell', '6500.12', '1']))
+        self.assertEqual(handler.call_count, 2)
+        self.assertIsNone(self.stream.client)
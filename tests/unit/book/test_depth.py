@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.book.depth` module."""
+
+from decimal import Decimal
+import random
+
+from asynctest import TestCase, CoroutineMock, MagicMock, skipIf
+
+from copra.book import DepthLadder
+from copra.book import depth
+from copra.websocket import Channel
+
+
+SNAPSHOT = {
+    'type': 'snapshot',
+    'product_id': 'BTC-USD',
+    'bids': [['6500.10', '0.5'], ['6500.00', '1.25'], ['6489.99', '3']],
+    'asks': [['6500.20', '0.75'], ['6510.00', '2'], ['6510.01', '0.1']]
+}
+
+
+def update(*changes):
+    return {'type': 'l2update', 'product_id': 'BTC-USD',
+            'changes': list(changes)}
+
+
+class TestDepthLadder(TestCase):
+    """Tests for copra.book.DepthLadder"""
+
+    def setUp(self):
+        self.ladder = DepthLadder('BTC-USD', ['1', 10], '0.01')
+        self.ladder.process(SNAPSHOT)
+
+    def test__init__(self):
+        self.assertEqual(self.ladder.bucket_sizes,
+                         (Decimal('1'), Decimal('10')))
+        self.assertEqual(self.ladder.quote_increment, Decimal('0.01'))
+        with self.assertRaises(ValueError):
+            DepthLadder('BTC-USD', ['0.005'], '0.01')
+        with self.assertRaises(ValueError):
+            DepthLadder('BTC-USD', ['0'], '0.01')
+        with self.assertRaises(ValueError):
+            DepthLadder('BTC-USD', ['abc'], '0.01')
+        DepthLadder('ETH-BTC', ['0.001'], '0.00001')
+
+    async def test_from_rest(self):
+        rest_client = MagicMock()
+        rest_client.products = CoroutineMock(return_value=[
+            {'id': 'ETH-BTC', 'quote_increment': '0.00001'},
+            {'id': 'BTC-USD', 'quote_increment': '0.01'}])
+        ladder = await DepthLadder.from_rest(rest_client, 'ETH-BTC',
+                                             ['0.0001'])
+        self.assertEqual(ladder.quote_increment, Decimal('0.00001'))
+        with self.assertRaises(ValueError):
+            await DepthLadder.from_rest(rest_client, 'BTC-USD', ['0.001'])
+        with self.assertRaises(ValueError):
+            await DepthLadder.from_rest(rest_client, 'LTC-USD', ['1'])
+
+    def test_levels(self):
+        ladder = self.ladder
+        self.assertEqual(ladder.levels('buy', 1), [(6500.0, 1.75),
+                                                   (6489.0, 3.0)])
+        self.assertEqual(ladder.levels('sell', '1'), [(6501.0, 0.75),
+                                                      (6510.0, 2.0),
+                                                      (6511.0, 0.1)])
+        self.assertEqual(ladder.levels('buy', 10), [(6500.0, 1.75),
+                                                    (6480.0, 3.0)])
+        self.assertEqual(ladder.levels('sell', 10), [(6510.0, 2.75),
+                                                     (6520.0, 0.1)])
+        self.assertEqual(ladder.levels('sell', 10, depth=1), [(6510.0, 2.75)])
+        with self.assertRaises(ValueError):
+            ladder.levels('buy', 5)
+
+    def test_apply_changes(self):
+        ladder = self.ladder
+        ladder.process(update(['buy', '6500.10', '0.25'],
+                              ['buy', '6500.00', '0'],
+                              ['sell', '6510.00', '0'],
+                              ['sell', '6505.50', '1']))
+        self.assertEqual(ladder.levels('buy', 1), [(6500.0, 0.25),
+                                                   (6489.0, 3.0)])
+        self.assertEqual(ladder.levels('sell', 10), [(6510.0, 1.75),
+                                                     (6520.0, 0.1)])
+        ladder.process(update(['buy', '6500.10', '0']))
+        self.assertEqual(ladder.levels('buy', 1), [(6489.0, 3.0)])
+        self.assertEqual(ladder.book.bids(), [(6489.99, 3.0)])
+
+    def test_matches_book(self):
+        rng = random.Random(1)
+        ladder = self.ladder
+        for _ in range(500):
+            side = rng.choice(['buy', 'sell'])
+            base = 6480 if side == 'buy' else 6501
+            price = '{:.2f}'.format(base + rng.randrange(2000) / 100)
+            size = rng.choice(['0', '0.1', '0.37', '2'])
+            ladder.process(update([side, price, size]))
+        for size in (1, 10):
+            for side, levels in (('buy', ladder.book.bids()),
+                                 ('sell', ladder.book.asks())):
+                expected = {}
+                for price, amount in levels:
+                    ticks = int(round(price * 100))
+                    width = size * 100
+                    index = (-(-ticks // width) if side == 'sell'
+                             else ticks // width)
+                    expected[index * size] = (expected.get(index * size, 0)
+                                              + Decimal(str(amount)))
+                actual = ladder.levels(side, size)
+                self.assertEqual([price for price, _ in actual],
+                                 sorted(expected, reverse=side == 'buy'))
+                # The bucket totals are exact, without float drift.
+                for price, amount in actual:
+                    self.assertEqual(amount, float(expected[price]))
+
+    @skipIf(depth.numpy is None, 'NumPy is not installed')
+    def test_to_numpy(self):
+        prices, sizes, cumulative = self.ladder.to_numpy('sell', 1)
+        self.assertEqual(prices.tolist(), [6501.0, 6510.0, 6511.0])
+        self.assertEqual(sizes.tolist(), [0.75, 2.0, 0.1])
+        self.assertEqual(cumulative.tolist(), [0.75, 2.75, 2.85])
+
+        prices, sizes, cumulative = DepthLadder(
+            'ETH-USD', [1], '0.01').to_numpy('buy', 1)
+        self.assertEqual(prices.shape, (0,))
+        self.assertEqual(cumulative.shape, (0,))
+
+    def test_attach(self):
+        client = MagicMock()
+        self.ladder.attach(client)
+        client.subscribe.assert_called_with(Channel('level2', 'BTC-USD'))
+        client.on.assert_any_call('l2update', self.ladder.process,
+                                  product_id='BTC-USD')
+        self.ladder.detach(client)
+        client.off.assert_any_call('snapshot', self.ladder.process,
+                                   product_id='BTC-USD')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.book.level2` module."""
+
+import unittest
+from unittest.mock import MagicMock
+
+from copra.book import L2Book
+from copra.websocket import Channel
+
+
+SNAPSHOT = {
+    'type': 'snapshot',
+    'product_id': 'BTC-USD',
+    'bids': [['6500.10', '0.5'], ['6500.00', '1.25'], ['6499.50', '3']],
+    'asks': [['6500.20', '0.75'], ['6501.00', '2'], ['6502.00', '0.1']]
+}
+
+
+class TestL2Book(unittest.TestCase):
+    """Tests for copra.book.L2Book"""
+
+    def setUp(self):
+        self.book = L2Book('BTC-USD')
+        self.book.process(SNAPSHOT)
+
+    def test__init__(self):
+        book = L2Book('ETH-USD')
+        self.assertEqual(book.product_id, 'ETH-USD')
+        self.assertFalse(book.ready)
+        self.assertIsNone(book.best_bid)
+        self.assertIsNone(book.best_ask)
+        self.assertIsNone(book.spread)
+        self.assertEqual(book.bids(), [])
+        self.assertEqual(book.asks(), [])
+
+    def test_load_snapshot(self):
+        self.assertTrue(self.book.ready)
+        self.assertEqual(self.book.best_bid, (6500.10, 0.5))
+        self.assertEqual(self.book.best_ask, (6500.20, 0.75))
+        self.assertAlmostEqual(self.book.spread, 0.1)
+        self.assertEqual(self.book.bids(),
+                         [(6500.10, 0.5), (6500.00, 1.25), (6499.50, 3.0)])
+        self.assertEqual(self.book.asks(),
+                         [(6500.20, 0.75), (6501.00, 2.0), (6502.00, 0.1)])
+
+        # REST level 2 books include the number of orders
+        self.book.load_snapshot([['1.0', '2.0', 3]], [['1.5', '1.0', 1]])
+        self.assertEqual(self.book.bids(), [(1.0, 2.0)])
+        self.assertEqual(self.book.asks(), [(1.5, 1.0)])
+
+    def test_depth(self):
+        self.assertEqual(self.book.bids(1), [(6500.10, 0.5)])
+        self.assertEqual(self.book.asks(2), [(6500.20, 0.75), (6501.00, 2.0)])
+        self.assertEqual(self.book.asks(10), self.book.asks())
+        self.assertEqual(self.book.bids(0), [])
+
+    def test_apply_changes(self):
+        self.book.process({'type': 'l2update', 'product_id': 'BTC-USD',
+                           'changes': [['buy', '6500.15', '0.2'],
+                                       ['sell', '6500.20', '0'],
+                                       ['sell', '6501.00', '1.5'],
+                                       ['buy', '6499.50', '0.00000000']]})
+        self.assertEqual(self.book.best_bid, (6500.15, 0.2))
+        self.assertEqual(self.book.best_ask, (6501.00, 1.5))
+        self.assertEqual(self.book.bids(),
+                         [(6500.15, 0.2), (6500.10, 0.5), (6500.00, 1.25)])
+        self.assertEqual(self.book.asks(), [(6501.00, 1.5), (6502.00, 0.1)])
+        self.assertEqual(self.book.size_at('buy', '6500.00'), 1.25)
+        self.assertEqual(self.book.size_at('sell', '6500.20'), 0.0)
+
+        # Removing a level that does not exist is a no-op
+        self.book.apply_changes([['sell', '7000', '0']])
+        self.assertEqual(len(self.book.asks()), 2)
+
+        # Empty a side
+        self.book.apply_changes([['sell', '6501.00', '0'], ['sell', '6502.00', '0']])
+        self.assertIsNone(self.book.best_ask)
+        self.assertIsNone(self.book.spread)
+
+    def test_process(self):
+        # Other products and message types are ignored
+        self.book.process({'type': 'l2update', 'product_id': 'ETH-USD',
+                           'changes': [['buy', '6600', '1']]})
+        self.book.process({'type': 'heartbeat', 'product_id': 'BTC-USD'})
+        self.assertEqual(self.book.best_bid, (6500.10, 0.5))
+
+        # Updates before the snapshot are ignored
+        book = L2Book('BTC-USD')
+        book.process({'type': 'l2update', 'product_id': 'BTC-USD',
+                      'changes': [['buy', '6600', '1']]})
+        self.assertIsNone(book.best_bid)
+
+    def test_clear(self):
+        self.book.clear()
+        self.assertFalse(self.book.ready)
+        self.assertIsNone(self.book.best_bid)
+        self.assertEqual(self.book.asks(), [])
+
+    def test_attach(self):
+        client = MagicMock()
+        self.book.attach(client)
+        for msg_type in ('snapshot', 'l2update'):
+            client.on.assert_any_call(msg_type, self.book.process,
+                                      product_id='BTC-USD')
+        client.subscribe.assert_called_with(Channel('level2', 'BTC-USD'))
+
+        self.book.detach(client)
+        for msg_type in ('snapshot', 'l2update'):
+            client.off.assert_any_call(msg_type, self.book.process,
+                                       product_id='BTC-USD')
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.book.level3` module."""
+
+from asynctest import TestCase, CoroutineMock, MagicMock
+
+from copra.book import L3Book
+from copra.websocket import Channel
+
+
+def snapshot():
+    return {
+        'sequence': 100,
+        'bids': [['6500.10', '0.5', 'b1'], ['6500.10', '0.25', 'b2'],
+                 ['6499.00', '1', 'b3']],
+        'asks': [['6500.20', '0.75', 'a1'], ['6501.00', '2', 'a2']]
+    }
+
+
+def msg(sequence, msg_type, **kwargs):
+    kwargs.update({'type': msg_type, 'sequence': sequence,
+                   'product_id': 'BTC-USD'})
+    return kwargs
+
+
+class TestL3Book(TestCase):
+    """Tests for copra.book.L3Book"""
+
+    def setUp(self):
+        self.book = L3Book('BTC-USD', capacity=2)
+        self.book.load_snapshot(snapshot())
+
+    def test__init__(self):
+        book = L3Book('ETH-USD')
+        self.assertEqual(book.product_id, 'ETH-USD')
+        self.assertFalse(book.ready)
+        self.assertIsNone(book.sequence)
+        self.assertEqual(len(book), 0)
+        self.assertEqual(book.capacity, 1024)
+        self.assertIsNone(book.best_bid)
+        self.assertIsNone(book.best_ask)
+
+    def test_load_snapshot(self):
+        self.assertTrue(self.book.ready)
+        self.assertEqual(self.book.sequence, 100)
+        self.assertEqual(len(self.book), 5)
+        self.assertGreaterEqual(self.book.capacity, 5)
+        self.assertIn('b1', self.book)
+        self.assertEqual(self.book.best_bid, (6500.10, 0.75))
+        self.assertEqual(self.book.best_ask, (6500.20, 0.75))
+        self.assertEqual(self.book.bids(), [(6500.10, 0.75, 2), (6499.0, 1.0, 1)])
+        self.assertEqual(self.book.asks(1), [(6500.20, 0.75, 1)])
+        self.assertEqual(self.book.order('b2'), ('buy', 6500.10, 0.25))
+        self.assertEqual(self.book.order('a2'), ('sell', 6501.0, 2.0))
+        self.assertIsNone(self.book.order('nope'))
+        self.assertEqual(self.book.orders_at('buy', '6500.10'),
+                         [('b1', 0.5), ('b2', 0.25)])
+
+    def test_open(self):
+        self.book.process(msg(101, 'open', order_id='b4', side='buy',
+                              price='6500.10', remaining_size='0.1'))
+        self.book.process(msg(102, 'open', order_id='a3', side='sell',
+                              price='6500.15', remaining_size='0.3'))
+        self.assertEqual(self.book.sequence, 102)
+        self.assertEqual(self.book.orders_at('buy', 6500.10),
+                         [('b1', 0.5), ('b2', 0.25), ('b4', 0.1)])
+        self.assertEqual(self.book.best_bid, (6500.10, 0.85))
+        self.assertEqual(self.book.best_ask, (6500.15, 0.3))
+
+    def test_done(self):
+        self.book.process(msg(101, 'done', order_id='b1', reason='canceled',
+                              side='buy', price='6500.10', remaining_size='0.5'))
+        self.assertNotIn('b1', self.book)
+        self.assertEqual(self.book.orders_at('buy', 6500.10), [('b2', 0.25)])
+        self.book.process(msg(102, 'done', order_id='b2', reason='canceled',
+                              side='buy', price='6500.10', remaining_size='0.25'))
+        self.assertEqual(self.book.orders_at('buy', 6500.10), [])
+        self.assertEqual(self.book.best_bid, (6499.0, 1.0))
+        # Orders that never rested on the book
+        self.book.process(msg(103, 'done', order_id='market', reason='filled',
+                              side='buy'))
+        self.assertEqual(len(self.book), 3)
+
+        # Freed slots are reused
+        capacity = self.book.capacity
+        self.book.process(msg(104, 'open', order_id='b5', side='buy',
+                              price='6498', remaining_size='1'))
+        self.book.process(msg(105, 'open', order_id='b6', side='buy',
+                              price='6498', remaining_size='1'))
+        self.assertEqual(self.book.capacity, capacity)
+        self.assertEqual(self.book.orders_at('buy', 6498), [('b5', 1.0), ('b6', 1.0)])
+
+    def test_done_middle_of_queue(self):
+        self.book.process(msg(101, 'open', order_id='b4', side='buy',
+                              price='6500.10', remaining_size='0.1'))
+        self.book.process(msg(102, 'done', order_id='b2', reason='canceled'))
+        self.assertEqual(self.book.orders_at('buy', 6500.10),
+                         [('b1', 0.5), ('b4', 0.1)])
+        self.book.process(msg(103, 'done', order_id='b4', reason='canceled'))
+        self.book.process(msg(104, 'open', order_id='b7', side='buy',
+                              price='6500.10', remaining_size='0.2'))
+        self.assertEqual(self.book.orders_at('buy', 6500.10),
+                         [('b1', 0.5), ('b7', 0.2)])
+
+    def test_match(self):
+        self.book.process(msg(101, 'match', maker_order_id='a1',
+                              taker_order_id='t1', side='sell', size='0.25',
+                              price='6500.20'))
+        self.assertEqual(self.book.order('a1'), ('sell', 6500.20, 0.5))
+        self.assertEqual(self.book.best_ask, (6500.20, 0.5))
+        self.book.process(msg(102, 'match', maker_order_id='a1',
+                              taker_order_id='t1', side='sell', size='0.5',
+                              price='6500.20'))
+        self.book.process(msg(103, 'done', order_id='a1', reason='filled'))
+        self.assertEqual(self.book.best_ask, (6501.0, 2.0))
+
+    def test_change(self):
+        self.book.process(msg(101, 'change', order_id='b1', new_size='0.1',
+                              old_size='0.5', price='6500.10', side='buy'))
+        self.assertEqual(self.book.orders_at('buy', 6500.10),
+                         [('b1', 0.1), ('b2', 0.25)])
+        self.assertEqual(self.book.bids(1), [(6500.10, 0.35, 2)])
+        # Market order changes have no new_size
+        self.book.process(msg(102, 'change', order_id='b1', new_funds='5',
+                              old_funds='6', side='buy'))
+        self.assertEqual(self.book.order('b1'), ('buy', 6500.10, 0.1))
+
+    def test_process(self):
+        # old messages
+        self.book.process(msg(100, 'done', order_id='b1', reason='canceled'))
+        self.assertIn('b1', self.book)
+        # other products
+        message = msg(101, 'done', order_id='b1', reason='canceled')
+        message['product_id'] = 'ETH-USD'
+        self.book.process(message)
+        self.assertIn('b1', self.book)
+        self.assertEqual(self.book.sequence, 100)
+        # messages that don't change the book
+        self.book.process(msg(101, 'received', order_id='x', side='buy'))
+        self.assertEqual(self.book.sequence, 101)
+        self.assertEqual(len(self.book), 5)
+        # not ready and not seeding
+        book = L3Book('BTC-USD')
+        book.process(msg(1, 'open', order_id='b4', side='buy', price='1',
+                         remaining_size='1'))
+        self.assertEqual(len(book), 0)
+
+    def test_grow(self):
+        for i in range(10):
+            self.book.process(msg(101 + i, 'open', order_id='n{}'.format(i),
+                                  side='sell', price='6600', remaining_size='1'))
+        self.assertEqual(len(self.book), 15)
+        self.assertGreaterEqual(self.book.capacity, 15)
+        self.assertEqual(self.book.asks()[-1], (6600.0, 10.0, 10))
+        self.assertEqual(self.book.order('b3'), ('buy', 6499.0, 1.0))
+
+    def test_nbytes(self):
+        nbytes = self.book.nbytes
+        self.assertGreater(nbytes, 0)
+        for i in range(100):
+            self.book.process(msg(101 + i, 'open', order_id='n{}'.format(i),
+                                  side='sell', price=str(6600 + i),
+                                  remaining_size='1'))
+        self.assertGreater(self.book.nbytes, nbytes)
+
+    def test_resync(self):
+        self.book.process(msg(101, 'done', order_id='b1', reason='canceled'))
+        self.book.process({'type': 'resync', 'product_id': 'BTC-USD',
+                           'sequence': 90, 'snapshot': snapshot()})
+        self.assertEqual(self.book.sequence, 100)
+        self.assertIn('b1', self.book)
+
+    async def test_seed(self):
+        book = L3Book('BTC-USD')
+        rest_client = MagicMock()
+
+        async def order_book(product_id, level=1):
+            # Messages arriving while the snapshot is fetched
+            book.process(msg(100, 'done', order_id='b1', reason='canceled'))
+            book.process(msg(101, 'done', order_id='b2', reason='canceled'))
+            return snapshot()
+
+        rest_client.order_book = CoroutineMock(side_effect=order_book)
+        await book.seed(rest_client)
+        rest_client.order_book.assert_called_with('BTC-USD', level=3)
+        self.assertTrue(book.ready)
+        self.assertEqual(book.sequence, 101)
+        self.assertIn('b1', book)
+        self.assertNotIn('b2', book)
+
+        rest_client.order_book = CoroutineMock(side_effect=ValueError)
+        book = L3Book('BTC-USD')
+        with self.assertRaises(ValueError):
+            await book.seed(rest_client)
+        book.process(msg(1, 'received', order_id='x'))
+        self.assertIsNone(book._pending)
+
+    def test_attach(self):
+        client = MagicMock()
+        self.book.attach(client)
+        for msg_type in ('open', 'done', 'match', 'change', 'resync'):
+            client.on.assert_any_call(msg_type, self.book.process,
+                                      product_id='BTC-USD')
+        client.subscribe.assert_called_with(Channel('full', 'BTC-USD'))
+
+        self.book.detach(client)
+        for msg_type in ('open', 'done', 'match', 'change', 'resync'):
+            client.off.assert_any_call(msg_type, self.book.process,
+                                       product_id='BTC-USD')
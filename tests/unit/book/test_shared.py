@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.book.shared` module."""
+
+import multiprocessing
+import unittest
+from unittest.mock import MagicMock
+
+from copra.book import BookPublisher, BookReader
+from copra.book.shared import _COUNTER
+from copra.websocket import Channel
+
+
+SNAPSHOT = {
+    'type': 'snapshot',
+    'product_id': 'BTC-USD',
+    'bids': [['6500.10', '0.5'], ['6500.00', '1.25'], ['6499.50', '3']],
+    'asks': [['6500.20', '0.75'], ['6501.00', '2'], ['6502.00', '0.1']]
+}
+
+
+def read(name, results):
+    reader = BookReader(name)
+    results.put(tuple(reader.snapshot('BTC-USD')))
+    reader.close()
+
+
+class TestBookPublisher(unittest.TestCase):
+    """Tests for copra.book.BookPublisher and copra.book.BookReader"""
+
+    def setUp(self):
+        self.publisher = BookPublisher(['BTC-USD', 'ETH-USD'], depth=2)
+        self.reader = BookReader(self.publisher.name)
+
+    def tearDown(self):
+        self.reader.close()
+        self.publisher.close()
+
+    def test__init__(self):
+        self.assertEqual(self.reader.product_ids, ('BTC-USD', 'ETH-USD'))
+        self.assertEqual(self.reader.depth, 2)
+        self.assertEqual(self.reader.version('BTC-USD'), 0)
+        self.assertIsNone(self.reader.snapshot('BTC-USD'))
+        with self.assertRaises(KeyError):
+            self.reader.snapshot('LTC-USD')
+        with self.assertRaises(ValueError):
+            BookPublisher('X' * 17)
+
+    def test_attach(self):
+        client = MagicMock()
+        self.publisher.attach(client)
+        client.subscribe.assert_any_call(Channel('level2', 'BTC-USD'))
+        client.on.assert_any_call('l2update', self.publisher._on_update,
+                                  product_id='ETH-USD')
+        self.publisher.detach(client)
+        client.off.assert_any_call('l2update', self.publisher._on_update,
+                                   product_id='ETH-USD')
+
+    def test_publish(self):
+        book = self.publisher.books['BTC-USD']
+        book.process(SNAPSHOT)
+        self.publisher._on_update(SNAPSHOT)
+        snapshot = self.reader.snapshot('BTC-USD')
+        self.assertEqual(snapshot.product_id, 'BTC-USD')
+        self.assertEqual(snapshot.version, 1)
+        self.assertEqual(snapshot.bids, ((6500.10, 0.5), (6500.00, 1.25)))
+        self.assertEqual(snapshot.asks, ((6500.20, 0.75), (6501.00, 2.0)))
+        self.assertGreater(snapshot.time, 0)
+
+        # fewer levels than the depth
+        book.process({'type': 'l2update', 'product_id': 'BTC-USD',
+                      'changes': [['sell', '6500.20', '0'],
+                                  ['sell', '6501.00', '0']]})
+        self.publisher.publish('BTC-USD')
+        snapshot = self.reader.snapshot('BTC-USD')
+        self.assertEqual(snapshot.version, 2)
+        self.assertEqual(snapshot.asks, ((6502.00, 0.1),))
+        self.assertEqual(self.reader.version('BTC-USD'), 2)
+        self.assertEqual(self.reader.version('ETH-USD'), 0)
+        self.assertEqual(self.publisher.publishes, 2)
+
+    def test_seqlock(self):
+        self.publisher.books['BTC-USD'].process(SNAPSHOT)
+        self.publisher.publish('BTC-USD')
+        # a write in progress
+        buf = self.publisher._segment.buf
+        offset = self.publisher._offsets['BTC-USD']
+        _COUNTER.pack_into(buf, offset, 3)
+        self.reader.retries = 3
+        with self.assertRaises(RuntimeError):
+            self.reader.snapshot('BTC-USD')
+        _COUNTER.pack_into(buf, offset, 4)
+        self.assertEqual(self.reader.snapshot('BTC-USD').version, 2)
+
+    def test_other_process(self):
+        self.publisher.books['BTC-USD'].process(SNAPSHOT)
+        self.publisher.publish('BTC-USD')
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=read, args=(self.publisher.name, results))
+        process.start()
+        snapshot = results.get(timeout=10)
+        process.join()
+        self.assertEqual(snapshot[:2], ('BTC-USD', 1))
+        self.assertEqual(snapshot[3], ((6500.10, 0.5), (6500.00, 1.25)))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.market.candles` module."""
+
+import asyncio
+import calendar
+import time
+
+from asynctest import TestCase, CoroutineMock, MagicMock, patch
+
+from copra.market import Candle, CandleBuilder
+from copra.websocket import Channel, Client
+
+T0 = calendar.timegm((2019, 1, 7, 12, 0, 0))
+
+
+def match(trade_id, seconds, price, size='1.0', product_id='BTC-USD'):
+    stamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(T0 + int(seconds)))
+    stamp += '.{:06d}Z'.format(int(round(seconds % 1 * 1e6)))
+    return {'type': 'match', 'trade_id': trade_id, 'product_id': product_id,
+            'price': str(price), 'size': str(size), 'time': stamp}
+
+
+class TestCandleBuilder(TestCase):
+    """Tests for copra.market.CandleBuilder"""
+
+    def setUp(self):
+        self.builder = CandleBuilder(['BTC-USD', 'ETH-USD'],
+                                     granularities=(60, 1), capacity=3)
+        self.closed = []
+        self.builder.on_candle = lambda *args: self.closed.append(args)
+
+    def test__init__(self):
+        builder = CandleBuilder('BTC-USD')
+        self.assertEqual(builder.product_ids, ('BTC-USD',))
+        self.assertEqual(builder.granularities,
+                         (1, 60, 300, 900, 3600, 21600, 86400))
+        self.assertEqual(self.builder.granularities, (1, 60))
+        self.assertEqual(repr(self.builder),
+                         "CandleBuilder(['BTC-USD', 'ETH-USD'], (1, 60))")
+
+    def test_process(self):
+        self.builder.process(match(1, 0.5, 100))
+        self.builder.process(match(2, 0.7, 102, '0.5'))
+        self.builder.process(match(3, 0.9, 99, '2'))
+        self.builder.process(match(3, 0.9, 99, '2'))  # duplicate
+        self.builder.process({'type': 'last_match', 'trade_id': 4})
+        self.builder.process(match(5, 1.0, 50, product_id='LTC-USD'))
+        self.assertEqual(self.builder.trades, 3)
+        self.assertEqual(self.builder.current('BTC-USD', 1),
+                         Candle(T0, 99.0, 102.0, 100.0, 99.0, 3.5))
+        self.assertEqual(self.builder.current('BTC-USD', 60),
+                         Candle(T0, 99.0, 102.0, 100.0, 99.0, 3.5))
+        self.assertEqual(self.closed, [])
+
+        self.builder.process(match(6, 2.1, 101))
+        self.assertEqual(self.closed, [('BTC-USD', 1,
+                                        Candle(T0, 99.0, 102.0, 100.0, 99.0, 3.5))])
+        self.assertEqual(self.builder.current('BTC-USD', 1),
+                         Candle(T0 + 2, 101.0, 101.0, 101.0, 101.0, 1.0))
+        self.assertEqual(self.builder.current('BTC-USD', 60).volume, 4.5)
+
+        # a late trade for the closed candle is dropped
+        self.builder.process(match(7, 0.95, 500))
+        self.assertEqual(self.builder.candles('BTC-USD', 1)[-1].high, 102.0)
+        self.assertEqual(self.builder.current('BTC-USD', 60).high, 500.0)
+
+        self.builder.process(match(8, 61, 103))
+        self.assertEqual([(pid, g) for pid, g, candle in self.closed],
+                         [('BTC-USD', 1), ('BTC-USD', 1), ('BTC-USD', 60)])
+        self.assertIsNone(self.builder.current('ETH-USD', 60))
+
+    def test_candles(self):
+        for n in range(5):
+            self.builder.process(match(n + 1, n, 100 + n))
+        candles = self.builder.candles('BTC-USD', 1)
+        self.assertEqual([c.time - T0 for c in candles], [1, 2, 3])
+        self.assertEqual(self.builder.candles('BTC-USD', 1, 2), candles[1:])
+        self.assertEqual(self.builder.candles('BTC-USD', 1, 0), [])
+        self.assertEqual(self.builder.candles('BTC-USD', 60), [])
+        with self.assertRaises(ValueError):
+            self.builder.candles('BTC-USD', 300)
+        with self.assertRaises(ValueError):
+            self.builder.current('LTC-USD', 60)
+
+    def test_close_candles(self):
+        self.builder.process(match(1, 0.5, 100))
+        self.builder.close_candles(now=T0 + 1.4)
+        self.assertEqual(self.closed, [])
+        self.builder.close_candles(now=T0 + 1.5)
+        self.assertEqual([(g, c.time) for _, g, c in self.closed], [(1, T0)])
+        self.builder.close_candles(now=T0 + 61)
+        self.assertEqual([(g, c.time) for _, g, c in self.closed],
+                         [(1, T0), (60, T0)])
+        self.assertIsNone(self.builder.current('BTC-USD', 60))
+
+    def test_attach(self):
+        client = Client(self.loop, Channel('heartbeat', 'BTC-USD'),
+                        auto_connect=False)
+        client.on_message = MagicMock()
+        self.builder.attach(client)
+        self.assertEqual(client.channels['matches'],
+                         Channel('matches', ['BTC-USD', 'ETH-USD']))
+        self.assertIsNotNone(self.builder._handle)
+
+        client._process_message(match(1, 0.5, 100, product_id='ETH-USD'))
+        self.assertEqual(self.builder.current('ETH-USD', 60).open, 100.0)
+
+        self.builder.detach(client)
+        self.assertIsNone(self.builder._handle)
+        client._process_message(match(2, 0.6, 120, product_id='ETH-USD'))
+        self.assertEqual(self.builder.current('ETH-USD', 60).high, 100.0)
+
+    async def test_reconcile(self):
+        builder = CandleBuilder('BTC-USD', granularities=(1, 60))
+        builder.process(match(1, 125, 100))
+        rest_client = MagicMock()
+        rest_client.historic_rates = CoroutineMock(return_value=[
+            [T0 + 120, 95, 105, 98, 101, 10.0],
+            [T0 + 60, 90, 99, 91, 92, 5.0],
+            [T0, 80, 89, 81, 82, 4.0]])
+        await builder.reconcile(rest_client)
+        rest_client.historic_rates.assert_called_once_with('BTC-USD', 60)
+        self.assertEqual(builder.candles('BTC-USD', 60), [
+            Candle(T0, 80.0, 89.0, 81.0, 82.0, 4.0),
+            Candle(T0 + 60, 90.0, 99.0, 91.0, 92.0, 5.0)])
+        self.assertEqual(builder.current('BTC-USD', 60),
+                         Candle(T0 + 120, 95.0, 105.0, 98.0, 100.0, 10.0))
+        self.assertEqual(builder.candles('BTC-USD', 1), [])
+
+        # reconciling from a time fetches that range only
+        rest_client.historic_rates.reset_mock()
+        with patch('time.time', return_value=T0 + 130):
+            await builder.reconcile(rest_client, start=T0 + 70)
+        rest_client.historic_rates.assert_called_once_with(
+            'BTC-USD', 60, start='2019-01-07T12:01:00+00:00',
+            end='2019-01-07T12:02:10+00:00')
+
+    async def test_reconcile_seed(self):
+        builder = CandleBuilder('BTC-USD', granularities=(60,))
+        rest_client = MagicMock()
+        now = time.time()
+        current = int(now // 60) * 60
+        rest_client.historic_rates = CoroutineMock(return_value=[
+            [current, 1, 2, 1, 2, 1.0], [current - 60, 3, 4, 3, 4, 1.0]])
+        await builder.reconcile(rest_client)
+        self.assertEqual(builder.candles('BTC-USD', 60),
+                         [Candle(current - 60, 3.0, 4.0, 3.0, 4.0, 1.0)])
+        self.assertEqual(builder.current('BTC-USD', 60).time, current)
+
+    async def test_reconcile_on_reconnect(self):
+        rest_client = MagicMock()
+        rest_client.historic_rates = CoroutineMock(return_value=[])
+        client = Client(self.loop, [], auto_connect=False,
+                        rest_client=rest_client)
+        client.on_message = MagicMock()
+        self.builder.attach(client)
+        self.addCleanup(self.builder.detach, client)
+
+        client.connection_id = 1
+        client._process_message({'type': 'subscriptions', 'channels': []})
+        client._process_message(match(1, 0.5, 100))
+        await asyncio.sleep(0.01)
+        rest_client.historic_rates.assert_not_called()
+
+        client.connection_id = 2
+        client._process_message({'type': 'subscriptions', 'channels': []})
+        await asyncio.sleep(0.01)
+        self.assertEqual(
+            [c[0][:2] for c in rest_client.historic_rates.call_args_list],
+            [('BTC-USD', 60), ('ETH-USD', 60)])
+        self.assertIn('start', rest_client.historic_rates.call_args[1])
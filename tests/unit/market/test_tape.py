@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.market.tape` module."""
+
+import calendar
+import time
+
+from asynctest import TestCase, MagicMock, patch, skipIf
+
+from copra.market import TradeTape
+from copra.market import tape
+from copra.websocket import Channel, Client
+
+T0 = calendar.timegm((2019, 1, 7, 12, 0, 0))
+
+
+def match(trade_id, seconds, price, size='1.0', side='sell',
+          product_id='BTC-USD'):
+    stamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(T0 + int(seconds)))
+    stamp += '.{:06d}Z'.format(int(round(seconds % 1 * 1e6)))
+    return {'type': 'match', 'trade_id': trade_id, 'product_id': product_id,
+            'price': str(price), 'size': str(size), 'side': side,
+            'time': stamp}
+
+
+@skipIf(tape.numpy is None, 'NumPy is not installed')
+class TestTradeTape(TestCase):
+    """Tests for copra.market.TradeTape"""
+
+    def setUp(self):
+        self.tape = TradeTape(['BTC-USD', 'ETH-USD'], windows=(60, 10),
+                              capacity=4)
+
+    def test__init__(self):
+        tape_ = TradeTape('BTC-USD')
+        self.assertEqual(tape_.product_ids, ('BTC-USD',))
+        self.assertEqual(tape_.windows, (60, 300, 3600))
+        self.assertEqual(self.tape.windows, (10, 60))
+        self.assertEqual(repr(self.tape),
+                         "TradeTape(['BTC-USD', 'ETH-USD'], windows=(10, 60))")
+
+        with patch.object(tape, 'numpy', None):
+            with self.assertRaises(ImportError):
+                TradeTape('BTC-USD')
+
+    def test_attach(self):
+        client = Client(self.loop, Channel('heartbeat', 'BTC-USD'),
+                        auto_connect=False)
+        self.tape.attach(client)
+        self.assertEqual(client.channels['matches'].product_ids,
+                         {'BTC-USD', 'ETH-USD'})
+        client._process_message(match(1, 0, 100))
+        self.assertEqual(self.tape.trades, 1)
+
+        self.tape.detach(client)
+        client._process_message(match(2, 1, 100))
+        self.assertEqual(self.tape.trades, 1)
+
+    def test_process(self):
+        self.tape.process(match(1, 0, 100, '1', side='sell'))
+        self.tape.process(match(2, 5, 110, '3', side='buy'))
+        self.tape.process(match(2, 5, 110, '3', side='buy'))
+        self.tape.process(match(1, 5, 110, product_id='LTC-USD'))
+        self.tape.process({'type': 'heartbeat', 'product_id': 'BTC-USD'})
+        self.assertEqual(self.tape.trades, 2)
+
+        stats = self.tape.stats('BTC-USD', 10)
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['volume'], 4.0)
+        self.assertEqual(stats['buy_volume'], 1.0)
+        self.assertEqual(stats['sell_volume'], 3.0)
+        self.assertEqual(stats['vwap'], 107.5)
+        self.assertEqual(stats['imbalance'], -0.5)
+
+        times, prices, sizes, sides = self.tape.to_numpy('BTC-USD')
+        self.assertEqual(times.tolist(), [T0, T0 + 5])
+        self.assertEqual(prices.tolist(), [100.0, 110.0])
+        self.assertEqual(sizes.tolist(), [1.0, 3.0])
+        self.assertEqual(sides.tolist(), [tape.BUY, tape.SELL])
+
+        self.assertEqual(self.tape.stats('ETH-USD', 60)['count'], 0)
+        self.assertIsNone(self.tape.stats('ETH-USD', 60)['vwap'])
+
+    def test_windows(self):
+        self.tape.process(match(1, 0, 100))
+        self.tape.process(match(2, 8, 200))
+        self.tape.process(match(3, 12, 300, '2'))
+
+        short = self.tape.stats('BTC-USD', 10)
+        self.assertEqual(short['count'], 2)
+        self.assertAlmostEqual(short['vwap'], 800 / 3)
+        self.assertEqual(self.tape.stats('BTC-USD', 60)['count'], 3)
+
+        # the window ends at now
+        short = self.tape.stats('BTC-USD', 10, now=T0 + 19)
+        self.assertEqual(short['count'], 1)
+        self.assertEqual(short['vwap'], 300.0)
+        empty = self.tape.stats('BTC-USD', 10, now=T0 + 30)
+        self.assertEqual(empty, {'count': 0, 'volume': 0.0,
+                                 'buy_volume': 0.0, 'sell_volume': 0.0,
+                                 'vwap': None, 'imbalance': 0.0})
+        self.assertEqual(self.tape.stats('BTC-USD', 60, now=T0 + 30)['count'],
+                         3)
+
+        self.tape.process(match(4, 31, 400))
+        self.assertEqual(self.tape.stats('BTC-USD', 10)['vwap'], 400.0)
+
+        with self.assertRaises(ValueError):
+            self.tape.stats('BTC-USD', 5)
+        with self.assertRaises(ValueError):
+            self.tape.stats('LTC-USD', 10)
+
+    def test_capacity(self):
+        for trade_id in range(1, 7):
+            self.tape.process(match(trade_id, trade_id, trade_id * 10))
+
+        # only the last 4 trades are kept
+        times, prices, sizes, sides = self.tape.to_numpy('BTC-USD')
+        self.assertEqual(prices.tolist(), [30.0, 40.0, 50.0, 60.0])
+        self.assertEqual(self.tape.to_numpy('BTC-USD', 2)[1].tolist(),
+                         [50.0, 60.0])
+        stats = self.tape.stats('BTC-USD', 60)
+        self.assertEqual(stats['count'], 4)
+        self.assertEqual(stats['vwap'], 45.0)
+        self.assertEqual(self.tape.truncated('BTC-USD'), 4)
+
+    def test_expire_many(self):
+        tape_ = TradeTape('BTC-USD', windows=(10,), capacity=32)
+        for trade_id in range(1, 41):
+            tape_.process(match(trade_id, trade_id * 0.1, trade_id,
+                                side='buy' if trade_id % 2 else 'sell'))
+        stats = tape_.stats('BTC-USD', 10, now=T0 + 13.55)
+        self.assertEqual(stats['count'], 5)
+        self.assertEqual(stats['volume'], 5.0)
+        self.assertAlmostEqual(stats['vwap'], 38.0)
+        self.assertEqual(stats['buy_volume'], 3.0)
+        self.assertAlmostEqual(stats['imbalance'], 0.2)
+        self.assertEqual(tape_.truncated('BTC-USD'), 8)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.market.ticker` module."""
+
+from asynctest import TestCase, MagicMock
+
+from copra.market import TickerStore
+from copra.websocket import Channel, Client
+
+
+def ticker(product_id, sequence, price):
+    return {'type': 'ticker', 'product_id': product_id, 'sequence': sequence,
+            'price': str(price)}
+
+
+class TestTickerStore(TestCase):
+    """Tests for copra.market.TickerStore"""
+
+    def setUp(self):
+        self.store = TickerStore()
+
+    def test__init__(self):
+        self.assertIsNone(self.store.product_ids)
+        self.assertEqual(TickerStore('BTC-USD').product_ids, ('BTC-USD',))
+        self.assertEqual(self.store.version, 0)
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(repr(self.store), 'TickerStore(products=0, version=0)')
+
+    def test_latest(self):
+        self.assertIsNone(self.store.latest('BTC-USD'))
+        self.store.process(ticker('BTC-USD', 1, 100))
+        self.store.process(ticker('BTC-USD', 3, 101))
+        self.store.process(ticker('BTC-USD', 2, 99))
+        self.assertEqual(self.store.latest('BTC-USD'), ticker('BTC-USD', 3, 101))
+        self.assertEqual(self.store.version, 2)
+        self.assertEqual(self.store.dropped, 1)
+
+    def test_changed_since(self):
+        self.assertEqual(self.store.changed_since(0), (0, {}))
+        for n, product_id in enumerate(['BTC-USD', 'ETH-USD', 'LTC-USD']):
+            self.store.process(ticker(product_id, n, 100 + n))
+        version, changed = self.store.changed_since(0)
+        self.assertEqual(version, 3)
+        self.assertEqual(sorted(changed), ['BTC-USD', 'ETH-USD', 'LTC-USD'])
+        self.assertEqual(self.store.changed_since(version), (3, {}))
+
+        for n in range(10):
+            self.store.process(ticker('BTC-USD', 10 + n, 200 + n))
+        self.store.process(ticker('LTC-USD', 30, 300))
+        version, changed = self.store.changed_since(version)
+        self.assertEqual(version, 14)
+        self.assertEqual(changed, {'BTC-USD': ticker('BTC-USD', 19, 209),
+                                   'LTC-USD': ticker('LTC-USD', 30, 300)})
+
+    def test_attach(self):
+        client = Client(self.loop, Channel('heartbeat', 'BTC-USD'),
+                        auto_connect=False)
+        client.on_message = MagicMock()
+        store = TickerStore(['BTC-USD', 'ETH-USD'])
+        store.attach(client)
+        self.assertEqual(client.channels['ticker'],
+                         Channel('ticker', ['BTC-USD', 'ETH-USD']))
+        client._process_message(ticker('ETH-USD', 1, 100))
+        client._process_message(ticker('LTC-USD', 1, 100))
+        self.assertEqual(len(store), 1)
+        store.detach(client)
+        client._process_message(ticker('ETH-USD', 2, 101))
+        self.assertEqual(store.latest('ETH-USD')['sequence'], 1)
+
+        self.store.attach(client)
+        self.assertEqual(client.channels['ticker'],
+                         Channel('ticker', ['BTC-USD', 'ETH-USD']))
+        client._process_message(ticker('LTC-USD', 1, 100))
+        self.assertEqual(len(self.store), 1)
+        self.store.detach(client)
+        client._process_message(ticker('ETH-USD', 3, 100))
+        self.assertEqual(len(self.store), 1)
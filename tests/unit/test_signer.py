@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.signer` module."""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import time
+
+from asynctest import TestCase, CoroutineMock, MagicMock, patch
+
+from copra.rest import Client as RestClient
+from copra.signer import Signer
+from copra.websocket import Channel, Client
+
+TEST_KEY = 'a035b37f42394a6d343231f7f772b99d'
+TEST_SECRET = 'aVGe54dHHYUSudB3sJdcQx4BfQ6K5oVdcYv4eRtDN6fBHEQf5Go6BACew4G0iFjfLKJHmWY5ZEwlqxdslop4CC=='
+TEST_PASSPHRASE = 'a2f9ee4dx2b'
+
+
+def expected_signature(message):
+    key = base64.b64decode(TEST_SECRET)
+    digest = hmac.new(key, message.encode('ascii'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+class TestSigner(TestCase):
+    """Tests for copra.signer.Signer"""
+
+    def setUp(self):
+        self.signer = Signer(TEST_KEY, TEST_SECRET, TEST_PASSPHRASE)
+
+    def tearDown(self):
+        self.signer.stop()
+
+    def test__init__(self):
+        with self.assertRaises(ValueError):
+            Signer(TEST_KEY, '', TEST_PASSPHRASE)
+        self.assertEqual(self.signer.key, TEST_KEY)
+        self.assertEqual(self.signer.passphrase, TEST_PASSPHRASE)
+        self.assertEqual(self.signer.offset, 0.0)
+        self.assertIsNone(self.signer.synced_at)
+
+    def test_sign(self):
+        timestamp, signature = self.signer.sign('/orders', 'POST', '{"a": 1}',
+                                                timestamp=1546384260.5)
+        self.assertEqual(timestamp, '1546384260.5')
+        self.assertEqual(signature,
+                         expected_signature('1546384260.5POST/orders{"a": 1}'))
+
+        # The prepared HMAC isn't consumed by signing.
+        timestamp, signature = self.signer.sign('/accounts',
+                                                timestamp='1546384261.0')
+        self.assertEqual(signature,
+                         expected_signature('1546384261.0GET/accounts'))
+
+    def test_timestamp(self):
+        self.signer.offset = 100.0
+        with patch('copra.signer.time.time', return_value=1000.0):
+            self.assertEqual(self.signer.timestamp(), '1100.0')
+            timestamp, signature = self.signer.sign('/accounts')
+        self.assertEqual(timestamp, '1100.0')
+        self.assertEqual(signature, expected_signature('1100.0GET/accounts'))
+
+    async def test_sync(self):
+        rest_client = MagicMock()
+        rest_client.server_time = CoroutineMock(
+            return_value={'iso': '', 'epoch': 1012.5})
+        with patch('copra.signer.time.time', side_effect=[1000.0, 1001.0]):
+            offset = await self.signer.sync(rest_client)
+        self.assertEqual(offset, 12.0)
+        self.assertEqual(self.signer.offset, 12.0)
+        self.assertEqual(self.signer.synced_at, 1001.0)
+
+    async def test_start(self):
+        rest_client = MagicMock(loop=self.loop)
+        rest_client.server_time = CoroutineMock(
+            side_effect=[Exception('down'),
+                         {'iso': '', 'epoch': time.time() + 30}])
+        with self.assertLogs('copra.signer'):
+            task = self.signer.start(rest_client, interval=0.01)
+            await asyncio.sleep(0.05)
+        self.assertAlmostEqual(self.signer.offset, 30, delta=1)
+        self.signer.stop()
+        await asyncio.sleep(0)
+        self.assertTrue(task.cancelled())
+
+    async def test_shared(self):
+        rest_client = RestClient(self.loop, auth=True, signer=self.signer)
+        self.addCleanup(self.loop.create_task, rest_client.close())
+        ws_client = Client(self.loop, Channel('user', 'BTC-USD'), auth=True,
+                           signer=self.signer, auto_connect=False)
+        self.assertIs(rest_client.signer, self.signer)
+        self.assertIs(ws_client.signer, self.signer)
+        self.assertEqual(rest_client.key, TEST_KEY)
+
+        self.signer.offset = -5.0
+        with patch('copra.signer.time.time', return_value=1000.0):
+            headers = rest_client._get_auth_headers('/orders')
+            message = ws_client._get_subscribe_message([Channel('user',
+                                                                'BTC-USD')])
+        self.assertEqual(headers['CB-ACCESS-TIMESTAMP'], '995.0')
+        self.assertEqual(headers['CB-ACCESS-SIGN'],
+                         expected_signature('995.0GET/orders'))
+        self.assertIn(expected_signature('995.0GET/users/self/verify').encode(),
+                      message)
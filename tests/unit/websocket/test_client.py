@@ -9,9 +9,11 @@ import sys
 from urllib.parse import urlparse
 
 from asynctest import TestCase, patch, CoroutineMock, MagicMock, skipUnless
+from autobahn.websocket.compress import PerMessageDeflateResponse
 
 from copra.websocket import Channel, Client, FEED_URL, SANDBOX_FEED_URL
 from copra.websocket.client import ClientProtocol
+from copra.websocket.decoders import DECODERS
 
 # These are made up
 TEST_KEY = 'a035b37f42394a6d343231f7f772b99d'
@@ -24,7 +26,12 @@ class TestClientProtocol(TestCase):
 
     def setUp(self):
         self.protocol = ClientProtocol()
-        self.protocol.factory = MagicMock()
+        self.protocol.factory = Client(self.loop, Channel('heartbeat', 'BTC-USD'),
+                                       auto_connect=False)
+        self.protocol.factory.on_open = MagicMock()
+        self.protocol.factory.on_close = MagicMock()
+        self.protocol.factory.on_message = MagicMock()
+        self.protocol.factory.on_error = MagicMock()
 
     def tearDown(self):
         """Tear down test fixtures, if any."""
@@ -51,6 +58,39 @@ class TestClientProtocol(TestCase):
         msg = json.dumps(msg_dict).encode('utf8')
         self.protocol.onMessage(msg, True)
         self.protocol.factory.on_error.called_with(404, 'testing')
+
+    def test_onMessage_lazy(self):
+        factory = self.protocol.factory
+        factory.lazy = True
+        factory.decode = MagicMock(side_effect=DECODERS['json'])
+        handler = MagicMock(side_effect=lambda message: message['price'])
+        factory.on('open', handler, product_id='BTC-USD')
+
+        # no handler, dropped undecoded
+        msg = {'type': 'open', 'product_id': 'ETH-USD', 'price': '1'}
+        self.protocol.onMessage(json.dumps(msg).encode('utf8'), False)
+        self.assertEqual(factory.dropped, 1)
+        factory.on_message.assert_not_called()
+        factory.decode.assert_not_called()
+
+        # handler, decoded when the handler reads it
+        msg = {'type': 'open', 'product_id': 'BTC-USD', 'price': '1'}
+        self.protocol.onMessage(json.dumps(msg).encode('utf8'), False)
+        handler.assert_called_once_with(msg)
+        factory.on_message.assert_called_once_with(msg)
+        self.assertEqual(factory.decode.call_count, 1)
+
+        # errors
+        msg = {'type': 'error', 'message': 'Failed', 'reason': 'testing'}
+        self.protocol.onMessage(json.dumps(msg).encode('utf8'), False)
+        factory.on_error.assert_called_once_with('Failed', 'testing')
+
+        # non-compact JSON is routed after decoding it
+        msg = {'type': 'open', 'product_id': 'BTC-USD', 'price': '2'}
+        payload = json.dumps(msg, separators=(' , ', ' : ')).encode('utf8')
+        self.protocol.onMessage(payload, False)
+        handler.assert_called_with(msg)
+        self.assertEqual(factory.dropped, 1)
         
 
 class TestClient(TestCase):
@@ -89,6 +129,16 @@ class TestClient(TestCase):
         client = Client(self.loop, [channel1, channel2], name="Test", auto_connect=False)
         self.assertEqual(client.name, "Test")
         
+        decode = lambda payload: {}
+        client = Client(self.loop, channel1, auto_connect=False, decoder=decode)
+        self.assertIs(client.decode, decode)
+        
+        client = Client(self.loop, channel1, auto_connect=False, decoder='json')
+        self.assertIs(client.decode, DECODERS['json'])
+        
+        with self.assertRaises(ValueError):
+            client = Client(self.loop, channel1, auto_connect=False, decoder='nope')
+        
         #auth, no key, secret, or passphrase
         with self.assertRaises(ValueError):
             client = Client(self.loop, channel1, auth=True, auto_connect=False)
@@ -135,6 +185,29 @@ class TestClient(TestCase):
         self.assertTrue(client.disconnected.is_set())
         self.assertFalse(client.closing)
 
+    def test__init__compression(self):
+        channel = Channel('heartbeat', 'BTC-USD')
+        client = Client(self.loop, channel, auto_connect=False)
+        self.assertFalse(client.compression)
+        self.assertEqual(client.perMessageCompressionOffers, [])
+
+        client = Client(self.loop, channel, auto_connect=False,
+                        compression=True, compression_window_bits=10,
+                        compression_mem_level=4)
+        offer, = client.perMessageCompressionOffers
+        self.assertEqual(offer.request_max_window_bits, 10)
+        response = PerMessageDeflateResponse(0, False, 10, False)
+        accept = client.perMessageCompressionAccept(response)
+        self.assertEqual(accept.mem_level, 4)
+        self.assertIsNone(client.perMessageCompressionAccept(MagicMock()))
+
+        with self.assertRaises(ValueError):
+            Client(self.loop, channel, auto_connect=False, compression=True,
+                   compression_window_bits=16)
+        with self.assertRaises(ValueError):
+            Client(self.loop, channel, auto_connect=False, compression=True,
+                   compression_mem_level=0)
+
     @skipUnless(sys.version_info >= (3, 6), 'MagicMock.assert_called_once not implemented.')
     def test__init__auto_connect(self):
         channel1 = Channel('heartbeat', ['BTC-USD', 'LTC-USD'])
@@ -255,6 +328,228 @@ class TestClient(TestCase):
         client.protocol.sendMessage.assert_called_with(msg)
 
     
+    async def test_subscription_window(self):
+        client = Client(self.loop, Channel('heartbeat', 'BTC-USD'),
+                        auto_connect=False, subscription_window=0)
+        client.protocol.sendMessage = MagicMock()
+        client.connected.set()
+
+        for product_id in ('ETH-USD', 'LTC-USD', 'BCH-USD'):
+            client.subscribe(Channel('ticker', product_id))
+        client.unsubscribe(Channel('ticker', 'LTC-USD'))
+        client.unsubscribe(Channel('heartbeat', 'BTC-USD'))
+        client.subscribe(Channel('heartbeat', 'BTC-USD'))
+        client.unsubscribe(Channel('level2', 'ETH-EUR'))
+        client.protocol.sendMessage.assert_not_called()
+
+        await asyncio.sleep(0)
+        sent = [json.loads(c[0][0].decode('utf8'))
+                for c in client.protocol.sendMessage.call_args_list]
+        self.assertEqual([msg['type'] for msg in sent],
+                         ['unsubscribe', 'subscribe'])
+        self.assertEqual(sent[0]['channels'],
+                         [{'name': 'level2', 'product_ids': ['ETH-EUR']}])
+        self.assertEqual(len(sent[1]['channels']), 1)
+        self.assertEqual(sent[1]['channels'][0]['name'], 'ticker')
+        self.assertEqual(sorted(sent[1]['channels'][0]['product_ids']),
+                         ['BCH-USD', 'ETH-USD'])
+        self.assertEqual(client.channels['ticker'],
+                         Channel('ticker', ['BCH-USD', 'ETH-USD']))
+
+        client.subscription_window = 10
+        client.protocol.sendMessage.reset_mock()
+        client.subscribe(Channel('ticker', 'LTC-USD'))
+        await asyncio.sleep(0)
+        client.protocol.sendMessage.assert_not_called()
+        client.flush_subscriptions()
+        self.assertEqual(client.protocol.sendMessage.call_count, 1)
+        self.assertIsNone(client._flush_handle)
+
+        # changes queued before a reconnect are covered by on_open
+        client.subscribe(Channel('ticker', 'BTC-EUR'))
+        client.on_open()
+        client.flush_subscriptions()
+        self.assertEqual(client.protocol.sendMessage.call_count, 2)
+
+    def test_send_subscriptions(self):
+        client = Client(self.loop, [], auto_connect=False,
+                        max_subscription_pairs=3)
+        client.protocol.sendMessage = MagicMock()
+        channels = [Channel('ticker', ['A-USD', 'B-USD']),
+                    Channel('level2', ['C-USD', 'D-USD', 'E-USD', 'F-USD'])]
+        client._send_subscriptions(channels, unsubscribe=True)
+        sent = [json.loads(c[0][0].decode('utf8'))
+                for c in client.protocol.sendMessage.call_args_list]
+        self.assertEqual([msg['type'] for msg in sent], ['unsubscribe'] * 2)
+        self.assertEqual([[(c['name'], sorted(c['product_ids']))
+                           for c in msg['channels']] for msg in sent], [
+            [('ticker', ['A-USD', 'B-USD']), ('level2', ['C-USD'])],
+            [('level2', ['D-USD', 'E-USD', 'F-USD'])]])
+
+    def test_on(self):
+        client = Client(self.loop, Channel('heartbeat', 'BTC-USD'), auto_connect=False)
+        client.on_message = MagicMock()
+        calls = []
+        
+        def handler(name):
+            return lambda msg: calls.append((name, msg['type'], msg.get('product_id')))
+            
+        h_all = handler('all')
+        h_btc = handler('btc')
+        h_l2 = handler('l2update')
+        h_l2_btc = handler('l2update btc')
+        h_l2_btc2 = handler('l2update btc 2')
+            
+        client.on(None, h_all)
+        client.on(None, h_btc, product_id='BTC-USD')
+        client.on('l2update', h_l2)
+        client.on('l2update', h_l2_btc, product_id='BTC-USD')
+        client.on('l2update', h_l2_btc2, product_id='BTC-USD')
+        
+        msg = {'type': 'l2update', 'product_id': 'BTC-USD'}
+        client._process_message(msg)
+        self.assertEqual([c[0] for c in calls], 
+                         ['l2update btc', 'l2update btc 2', 'l2update', 'btc', 'all'])
+        client.on_message.assert_called_with(msg)
+        
+        calls.clear()
+        client._process_message({'type': 'l2update', 'product_id': 'LTC-USD'})
+        self.assertEqual([c[0] for c in calls], ['l2update', 'all'])
+        
+        calls.clear()
+        client._process_message({'type': 'heartbeat', 'product_id': 'BTC-USD'})
+        self.assertEqual([c[0] for c in calls], ['btc', 'all'])
+        
+        calls.clear()
+        client._process_message({'type': 'subscriptions'})
+        self.assertEqual(calls, [('all', 'subscriptions', None)])
+        
+        # The dispatch table is rebuilt when handlers change
+        client.off(None, h_all)
+        client.off('l2update', h_l2_btc, product_id='BTC-USD')
+        calls.clear()
+        client._process_message(msg)
+        self.assertEqual([c[0] for c in calls], ['l2update btc 2', 'l2update', 'btc'])
+        
+        client.off(None, h_btc, product_id='BTC-USD')
+        client.off('l2update', h_l2)
+        client.off('l2update', h_l2_btc2, product_id='BTC-USD')
+        self.assertEqual(client._dispatch.handlers, {})
+        
+        calls.clear()
+        client._process_message(msg)
+        self.assertEqual(calls, [])
+        
+        with self.assertRaises(ValueError):
+            client.off('l2update', h_l2_btc, product_id='BTC-USD')
+
+    def test_sequence_tracking(self):
+        channel1 = Channel('full', ['BTC-USD', 'LTC-USD'])
+        channel2 = Channel('ticker', ['ETH-USD'])
+        client = Client(self.loop, [channel1, channel2], auto_connect=False)
+        self.assertEqual(client._sequences, {'BTC-USD': None, 'LTC-USD': None})
+        client.subscribe(Channel('full', 'ETH-USD'))
+        self.assertIn('ETH-USD', client._sequences)
+        client.unsubscribe(Channel('full', 'ETH-USD'))
+        self.assertNotIn('ETH-USD', client._sequences)
+        
+        received = []
+        client.on_message = received.append
+        
+        def full(sequence, product_id='BTC-USD', msg_type='open'):
+            return {'type': msg_type, 'product_id': product_id, 'sequence': sequence}
+        
+        client._process_message(full(10))
+        client._process_message(full(11))
+        self.assertEqual(client._sequences['BTC-USD'], 11)
+        # stale and duplicate messages are dropped
+        client._process_message(full(11))
+        client._process_message(full(9))
+        self.assertEqual([m['sequence'] for m in received], [10, 11])
+        # gaps are passed on without a rest client
+        client._process_message(full(15))
+        self.assertEqual(client._sequences['BTC-USD'], 15)
+        self.assertEqual([m['sequence'] for m in received], [10, 11, 15])
+        # messages from other channels are not checked
+        client._process_message(full(3, msg_type='ticker'))
+        client._process_message(full(3, product_id='ETH-USD'))
+        self.assertEqual(len(received), 5)
+        
+    async def test_resync(self):
+        rest_client = MagicMock()
+        snapshot = {'sequence': 13, 'bids': [], 'asks': []}
+        fetched = asyncio.Event()
+        
+        async def order_book(product_id, level=1):
+            await fetched.wait()
+            return snapshot
+            
+        rest_client.order_book = CoroutineMock(side_effect=order_book)
+        client = Client(self.loop, Channel('full', 'BTC-USD'), auto_connect=False,
+                        rest_client=rest_client)
+        self.assertIs(client.rest_client, rest_client)
+        received = []
+        client.on_message = received.append
+        
+        def full(sequence):
+            return {'type': 'open', 'product_id': 'BTC-USD', 'sequence': sequence}
+        
+        client._process_message(full(10))
+        client._process_message(full(12))
+        # buffered while resyncing
+        client._process_message(full(15))
+        client._process_message(full(14))
+        client._process_message(full(13))
+        self.assertEqual([m['sequence'] for m in received], [10])
+        
+        await asyncio.sleep(0)
+        rest_client.order_book.assert_called_with('BTC-USD', level=3)
+        fetched.set()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        
+        self.assertEqual(received[1], {'type': 'resync', 'product_id': 'BTC-USD',
+                                       'sequence': 13, 'snapshot': snapshot})
+        self.assertEqual([m['sequence'] for m in received[2:]], [14, 15])
+        self.assertEqual(client._sequences['BTC-USD'], 15)
+        self.assertEqual(client._resyncing, {})
+        
+        # explicit resync
+        await client.resync('BTC-USD')
+        self.assertEqual(received[-1]['type'], 'resync')
+        self.assertEqual(client._sequences['BTC-USD'], 13)
+        
+        rest_client.order_book = CoroutineMock(side_effect=ValueError)
+        with self.assertRaises(ValueError):
+            await client.resync('BTC-USD')
+        self.assertEqual(client._resyncing, {})
+        
+        client = Client(self.loop, Channel('full', 'BTC-USD'), auto_connect=False)
+        with self.assertRaises(ValueError):
+            await client.resync('BTC-USD')
+
+        
+    async def test__repair(self):
+        rest_client = MagicMock()
+        snapshot = {'sequence': 13, 'bids': [], 'asks': []}
+        rest_client.order_book = CoroutineMock(side_effect=[ValueError, ValueError, snapshot])
+        client = Client(self.loop, Channel('full', 'BTC-USD'), auto_connect=False,
+                        rest_client=rest_client)
+        client.on_message = MagicMock()
+        client._resyncing['BTC-USD'] = [{'type': 'open', 'product_id': 'BTC-USD',
+                                         'sequence': 14}]
+        with patch('asyncio.sleep', new=CoroutineMock()) as mock_sleep:
+            await client._repair('BTC-USD')
+            self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [1, 2])
+        self.assertEqual(client._sequences['BTC-USD'], 14)
+        self.assertEqual(client._resyncing, {})
+        
+        client.closing = True
+        client._resyncing['BTC-USD'] = []
+        await client._repair('BTC-USD')
+        self.assertEqual(client._resyncing, {})
+
+    
     def test_add_as_task_to_loop(self):
         channel1 = Channel('heartbeat', ['BTC-USD', 'LTC-USD'])
         client = Client(self.loop, channel1, auto_connect=False)
@@ -315,11 +610,86 @@ class TestClient(TestCase):
         client.add_as_task_to_loop.assert_called_once()
         
         
+    def test_get_reconnect_delay(self):
+        channel1 = Channel('heartbeat', ['BTC-USD'])
+        client = Client(self.loop, [channel1], auto_connect=False, reconnect_delay=2,
+                        max_reconnect_delay=10, reconnect_jitter=0)
+        self.assertEqual([client.get_reconnect_delay(n) for n in range(1, 7)],
+                         [0, 2, 4, 8, 10, 10])
+        
+        client.reconnect_jitter = 0.5
+        for n in range(2, 7):
+            delay = client.get_reconnect_delay(n)
+            self.assertLessEqual(delay, min(10, 2 * 2 ** (n - 2)))
+            self.assertGreaterEqual(delay, min(10, 2 * 2 ** (n - 2)) / 2)
+        
+    def test_reconnect(self):
+        channel1 = Channel('heartbeat', ['BTC-USD'])
+        client = Client(self.loop, [channel1], auto_connect=False,
+                        max_reconnect_attempts=3)
+        client.add_as_task_to_loop = MagicMock()
+        client.loop = MagicMock()
+        
+        client.on_close(False, None, None)
+        self.assertEqual(client.reconnect_stats.attempts, 1)
+        self.assertIsNotNone(client.reconnect_stats.disconnected_at)
+        self.assertEqual(client.add_as_task_to_loop.call_count, 1)
+        
+        client.on_close(False, None, None)
+        client.on_close(False, None, None)
+        self.assertEqual(client.reconnect_stats.attempts, 3)
+        self.assertEqual(client.loop.call_later.call_count, 2)
+        client.loop.call_later.assert_called_with(
+            client.loop.call_later.call_args[0][0], client.add_as_task_to_loop)
+        
+        # budget used up
+        client.on_close(False, None, None)
+        self.assertEqual(client.reconnect_stats.attempts, 3)
+        self.assertEqual(client.reconnect_stats.total_attempts, 3)
+        self.assertEqual(client.loop.call_later.call_count, 2)
+        self.assertEqual(client.add_as_task_to_loop.call_count, 1)
+
+        # a message over a new connection resets the attempts
+        client.protocol.sendMessage = MagicMock()
+        client.on_message = MagicMock()
+        client.on_open()
+        stats = client.reconnect_stats
+        self.assertEqual(stats.reconnects, 1)
+        self.assertIsNone(stats.disconnected_at)
+        self.assertGreaterEqual(stats.last_outage, 0)
+        self.assertEqual(stats.time_disconnected, stats.last_outage)
+        self.assertEqual(stats.attempts, 3)
+        self.assertIsNone(stats.first_message_delay)
+        client._process_message({'type': 'heartbeat', 'product_id': 'BTC-USD'})
+        self.assertEqual(stats.attempts, 0)
+        self.assertGreaterEqual(stats.first_message_delay, 0)
+        
+        # no reconnect
+        client.auto_reconnect = False
+        client.on_close(False, None, None)
+        self.assertEqual(stats.attempts, 0)
+        self.assertIsNotNone(stats.disconnected_at)
+
+    async def test__connect(self):
+        channel1 = Channel('heartbeat', ['BTC-USD'])
+        client = Client(self.loop, [channel1], auto_connect=False)
+        client._reconnect = MagicMock()
+        await client._connect(CoroutineMock()())
+        client._reconnect.assert_not_called()
+        
+        await client._connect(CoroutineMock(side_effect=OSError)())
+        self.assertEqual(client._reconnect.call_count, 1)
+        
+        client.closing = True
+        await client._connect(CoroutineMock(side_effect=OSError)())
+        self.assertEqual(client._reconnect.call_count, 1)
+        
     @skipUnless(sys.version_info >= (3, 6), 'MagicMock.assert_called_once not implemented. ')   
     async def test_close(self):
         channel1 = Channel('heartbeat', ['BTC-USD', 'LTC-USD', 'LTC-EUR'])
         client = Client(self.loop, [channel1], auto_connect=False)
         client.protocol.sendClose = MagicMock(side_effect=lambda: client.disconnected.set())
+        client.connected.set()
         client.disconnected.clear()
         self.assertFalse(client.closing)
         
@@ -327,4 +697,64 @@ class TestClient(TestCase):
         self.assertTrue(client.closing)
         client.protocol.sendClose.assert_called_once()
         
+        # pending reconnect
+        client.closing = False
+        handle = client._reconnect_handle = MagicMock()
+        await client.close()
+        handle.cancel.assert_called_once()
+        self.assertIsNone(client._reconnect_handle)
+
+    async def test_close_disconnected(self):
+        # nothing listens on the port
+        server = await self.loop.create_server(asyncio.Protocol,
+                                               '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+
+        client = Client(self.loop, Channel('heartbeat', 'BTC-USD'),
+                        feed_url='ws://127.0.0.1:{}'.format(port),
+                        reconnect_delay=10, reconnect_jitter=0)
+        for _ in range(100):
+            if client._reconnect_handle is not None:
+                break
+            await asyncio.sleep(0.01)
+        stats = client.reconnect_stats
+        self.assertEqual(stats.attempts, 2)
+        self.assertIsNotNone(stats.disconnected_at)
+
+        # during the backoff
+        await client.close()
+        self.assertIsNone(client._reconnect_handle)
+        self.assertTrue(client.closing)
+
+        # after giving up
+        client = Client(self.loop, Channel('heartbeat', 'BTC-USD'),
+                        feed_url='ws://127.0.0.1:{}'.format(port),
+                        max_reconnect_attempts=0)
+        await asyncio.sleep(0.1)
+        self.assertEqual(client.reconnect_stats.attempts, 0)
+        await client.close()
+        self.assertFalse(client.connected.is_set())
+
+    async def test_on_open_after_failed_connect(self):
+        client = Client(self.loop, Channel('heartbeat', 'BTC-USD'),
+                        auto_connect=False)
+        client._reconnect = MagicMock()
+        client.protocol.sendMessage = MagicMock()
+        await client._connect(CoroutineMock(side_effect=OSError)())
+        stats = client.reconnect_stats
+        self.assertIsNotNone(stats.disconnected_at)
+
+        # the outage is counted, but the first open isn't a reconnect
+        client.on_open()
+        self.assertEqual(stats.reconnects, 0)
+        self.assertIsNone(stats.disconnected_at)
+        self.assertGreaterEqual(stats.time_disconnected, 0)
+        self.assertEqual(stats.time_disconnected, stats.last_outage)
+
+        client.on_close(False, None, None)
+        client.on_open()
+        self.assertEqual(stats.reconnects, 1)
+        
         
\ No newline at end of file
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.websocket.decoders` module."""
+
+import json
+import unittest
+import unittest.mock
+
+from copra.websocket import decoders
+from copra.websocket.decoders import (DECODERS, LazyMessage, get_decoder,
+                                      parse_routing)
+
+
+MESSAGE = {'type': 'open', 'sequence': 10, 'product_id': 'BTC-USD',
+           'price': '6500.01', 'remaining_size': '1.00000000', 'side': 'buy',
+           'order_id': 'd50ec984-77a8-460a-b958-66f114b0de9b'}
+
+
+class TestDecoders(unittest.TestCase):
+    """Tests for copra.websocket.decoders"""
+
+    def test_decoders(self):
+        payload = json.dumps(MESSAGE).encode('utf8')
+        self.assertIn('json', DECODERS)
+        for name, decode in DECODERS.items():
+            self.assertEqual(decode(payload), MESSAGE, name)
+
+    def test_get_decoder(self):
+        # fastest installed
+        if decoders.orjson is not None:
+            self.assertIs(get_decoder(), decoders.orjson.loads)
+        elif decoders.ujson is not None:
+            self.assertIs(get_decoder(), decoders.ujson.loads)
+        else:
+            self.assertIs(get_decoder(), DECODERS['json'])
+
+        # by name
+        self.assertIs(get_decoder('json'), DECODERS['json'])
+
+        # callable
+        decode = lambda payload: {}
+        self.assertIs(get_decoder(decode), decode)
+
+        with self.assertRaises(ValueError):
+            get_decoder('simplejson')
+
+    def test_parse_routing(self):
+        payload = json.dumps(MESSAGE).encode('utf8')
+        self.assertEqual(parse_routing(payload),
+                         {'type': 'open', 'sequence': 10,
+                          'product_id': 'BTC-USD'})
+
+        # compact, nested and missing fields
+        payload = (b'{"type":"subscriptions","channels":[{"name":"level2",'
+                   b'"product_ids":["BTC-USD"]}]}')
+        self.assertEqual(parse_routing(payload), {'type': 'subscriptions'})
+
+        # valid JSON the byte search doesn't recognize
+        payload = json.dumps(MESSAGE, separators=(' , ', ' : ')).encode()
+        self.assertEqual(parse_routing(payload),
+                         {'type': 'open', 'sequence': 10,
+                          'product_id': 'BTC-USD'})
+
+
+class TestLazyMessage(unittest.TestCase):
+    """Tests for copra.websocket.decoders.LazyMessage"""
+
+    def setUp(self):
+        self.payload = json.dumps(MESSAGE).encode('utf8')
+        self.decode = unittest.mock.Mock(side_effect=DECODERS['json'])
+        self.msg = LazyMessage(self.payload, self.decode)
+
+    def test_routing_fields(self):
+        msg = self.msg
+        self.assertEqual(msg['type'], 'open')
+        self.assertEqual(msg.get('product_id'), 'BTC-USD')
+        self.assertEqual(msg['sequence'], 10)
+        self.assertIn('type', msg)
+
+        # routing fields the message lacks
+        msg = LazyMessage(b'{"type":"heartbeat"}', self.decode)
+        self.assertIsNone(msg.get('product_id'))
+        self.assertNotIn('sequence', msg)
+        with self.assertRaises(KeyError):
+            msg['sequence']
+
+        self.decode.assert_not_called()
+        self.assertFalse(msg.decoded)
+
+    def test_non_compact(self):
+        payload = json.dumps(MESSAGE, separators=(' , ', ' : ')).encode()
+        msg = LazyMessage(payload, self.decode)
+        self.assertIn('type', msg)
+        self.assertEqual(msg.get('type'), 'open')
+        self.assertEqual(msg['product_id'], 'BTC-USD')
+        self.assertEqual(msg['sequence'], 10)
+        self.assertEqual(msg.copy(), MESSAGE)
+        self.decode.assert_called_once_with(payload)
+
+    def test_decode(self):
+        msg = self.msg
+        msg['received'] = 1.5
+        self.assertEqual(msg['price'], '6500.01')
+        self.assertTrue(msg.decoded)
+        self.assertEqual(msg['received'], 1.5)
+        self.assertEqual(msg.get('missing', 'default'), 'default')
+        self.assertEqual(len(msg), len(MESSAGE) + 1)
+        self.decode.assert_called_once_with(self.payload)
+
+        expected = dict(MESSAGE, received=1.5)
+        self.assertEqual(msg, expected)
+        self.assertEqual(msg.copy(), expected)
+        self.assertIsInstance(msg.copy(), dict)
+
+        del msg['received']
+        self.assertEqual(dict(msg), MESSAGE)
+        with self.assertRaises(KeyError):
+            msg['received']
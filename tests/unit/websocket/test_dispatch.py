@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.websocket.dispatch` module."""
+
+import unittest
+
+from copra.websocket.dispatch import HandlerTable
+
+
+class TestHandlerTable(unittest.TestCase):
+    """Tests for copra.websocket.dispatch.HandlerTable"""
+
+    def test_lookup(self):
+        table = HandlerTable()
+        for name, msg_type, product_id in (('all', None, None),
+                                           ('product', None, 'BTC-USD'),
+                                           ('type', 'match', None),
+                                           ('both', 'match', 'BTC-USD'),
+                                           ('other', 'match', 'ETH-USD')):
+            table.add(msg_type, name, product_id)
+        self.assertEqual(table.lookup(('match', 'BTC-USD')),
+                         ('both', 'type', 'product', 'all'))
+        self.assertEqual(table.lookup(('match', None)), ('type', 'all'))
+        self.assertEqual(table.lookup(('open', 'LTC-USD')), ('all',))
+        self.assertEqual(table.cache[('match', 'BTC-USD')],
+                         ('both', 'type', 'product', 'all'))
+
+    def test_remove(self):
+        table = HandlerTable()
+        table.add('match', 'handler', 'BTC-USD')
+        table.lookup(('match', 'BTC-USD'))
+        table.remove('match', 'handler', 'BTC-USD')
+        self.assertEqual(table.handlers, {})
+        self.assertEqual(table.cache, {})
+        self.assertEqual(table.lookup(('match', 'BTC-USD')), ())
+
+        with self.assertRaises(ValueError):
+            table.remove('match', 'handler', 'BTC-USD')
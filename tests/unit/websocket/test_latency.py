@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.websocket.latency` module."""
+
+import calendar
+import json
+import random
+import time
+
+from asynctest import TestCase, MagicMock
+
+from copra.websocket import Channel, Client, LatencyMonitor
+from copra.websocket.client import ClientProtocol
+from copra.websocket.latency import (Histogram, RollingHistogram, _MINUTES,
+                                     parse_time)
+
+
+class TestHistogram(TestCase):
+    """Tests for copra.websocket.latency.Histogram"""
+
+    def test_buckets(self):
+        histogram = Histogram(significant_bits=6)
+        previous = 0
+        for micros in range(1, 1 << 16):
+            index = histogram._index(micros)
+            self.assertIn(index - previous, (0, 1))
+            self.assertLessEqual(histogram._lowest(index), micros)
+            self.assertGreater(histogram._lowest(index + 1), micros)
+            previous = index
+
+    def test_quantile(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.quantile(0.5), 0.0)
+        self.assertEqual(histogram.mean, 0.0)
+
+        rnd = random.Random(0)
+        values = sorted(rnd.expovariate(1000) for _ in range(10000))
+        for value in values:
+            histogram.record(value)
+        self.assertEqual(histogram.count, 10000)
+        self.assertEqual(histogram.max, values[-1])
+        self.assertAlmostEqual(histogram.mean, sum(values) / 10000)
+        for q in (0.1, 0.5, 0.9, 0.99, 0.999):
+            exact = values[int(q * 10000) - 1]
+            self.assertGreaterEqual(histogram.quantile(q), exact - 1e-6)
+            self.assertLessEqual(histogram.quantile(q), exact * 1.04 + 1e-6)
+        self.assertEqual(histogram.quantile(1.0), values[-1])
+
+    def test_record_limits(self):
+        histogram = Histogram(max_seconds=1.0)
+        histogram.record(-0.5)
+        histogram.record(10.0)
+        self.assertEqual(histogram.counts[0], 1)
+        self.assertEqual(histogram.counts[-1], 1)
+        self.assertEqual(histogram.quantile(0.5), 0.0)
+        self.assertEqual(histogram.max, 10.0)
+
+    def test_merge_clear(self):
+        first, second = Histogram(), Histogram()
+        first.record(0.001)
+        second.record(0.002)
+        second.record(0.003)
+        first.merge(second)
+        self.assertEqual(first.count, 3)
+        self.assertEqual(first.max, 0.003)
+        self.assertAlmostEqual(first.total, 0.006)
+        first.clear()
+        self.assertEqual(first.count, 0)
+        self.assertEqual(sum(first.counts), 0)
+
+
+class TestRollingHistogram(TestCase):
+    """Tests for copra.websocket.latency.RollingHistogram"""
+
+    def test_window(self):
+        rolling = RollingHistogram(window=60.0, slices=6)
+        rolling.record(0.001, now=100.0)
+        rolling.record(0.002, now=125.0)
+        rolling.record(0.003, now=155.0)
+        self.assertEqual(rolling.snapshot(now=155.0).count, 3)
+        self.assertEqual(rolling.snapshot(now=165.0).count, 2)
+        self.assertEqual(rolling.snapshot(now=205.0).count, 1)
+        self.assertEqual(rolling.snapshot(now=300.0).count, 0)
+
+        # reusing a slice clears it
+        rolling.record(0.004, now=160.0)
+        snapshot = rolling.snapshot(now=160.0)
+        self.assertEqual(snapshot.count, 3)
+        self.assertEqual(snapshot.max, 0.004)
+
+
+class TestParseTime(TestCase):
+    """Tests for copra.websocket.latency.parse_time"""
+
+    def test_parse_time(self):
+        expected = calendar.timegm((2019, 1, 7, 23, 41, 39)) + 0.123456
+        self.assertAlmostEqual(parse_time('2019-01-07T23:41:39.123456Z'),
+                               expected)
+        self.assertIn('2019-01-07T23:41', _MINUTES)
+        self.assertAlmostEqual(parse_time('2019-01-07T23:42:00Z'),
+                               expected + 20.876544)
+
+    def test_cache_size(self):
+        _MINUTES.clear()
+        for minute in range(1002):
+            hour, minute = divmod(minute, 60)
+            parse_time('2019-01-07T{:02}:{:02}:00Z'.format(hour, minute))
+        self.assertLessEqual(len(_MINUTES), 1001)
+
+
+class TestLatencyMonitor(TestCase):
+    """Tests for copra.websocket.LatencyMonitor"""
+
+    def test_parse_time(self):
+        monitor = LatencyMonitor()
+        expected = calendar.timegm((2019, 1, 7, 23, 41, 39)) + 0.123456
+        self.assertAlmostEqual(
+            monitor.parse_time('2019-01-07T23:41:39.123456Z'), expected)
+        self.assertAlmostEqual(monitor.parse_time('2019-01-07T23:41:39Z'),
+                               expected - 0.123456)
+        with self.assertRaises(ValueError):
+            monitor.parse_time('yesterday')
+
+    def test_observe(self):
+        monitor = LatencyMonitor()
+        now = time.monotonic()
+        sent = calendar.timegm((2019, 1, 7, 23, 41, 39))
+        message = {'type': 'l2update', 'product_id': 'BTC-USD',
+                   'time': '2019-01-07T23:41:39.000000Z'}
+        monitor.observe(message, sent + 0.050, now, now + 0.002)
+        monitor.observe({'type': 'snapshot', 'product_id': 'BTC-USD'},
+                        sent, now, now + 0.010)
+        monitor.observe({'type': 'ticker', 'product_id': 'ETH-USD',
+                         'time': 'garbage'}, sent, now, now + 0.001)
+
+        summary = monitor.summary(quantiles=(0.5, 0.999))
+        level2 = summary[('level2', 'BTC-USD')]
+        self.assertEqual(level2['network']['count'], 1)
+        self.assertAlmostEqual(level2['network']['p50'], 0.050, places=3)
+        self.assertEqual(level2['handler']['count'], 2)
+        self.assertAlmostEqual(level2['handler']['max'], 0.010)
+        self.assertIn('p99.9', level2['handler'])
+        self.assertEqual(list(summary[('ticker', 'ETH-USD')]), ['handler'])
+
+    def test_client(self):
+        monitor = LatencyMonitor()
+        client = Client(self.loop, Channel('ticker', 'BTC-USD'),
+                        auto_connect=False, latency=monitor, timestamps=True)
+        client.on_message = MagicMock()
+        protocol = ClientProtocol()
+        protocol.factory = client
+
+        before = time.time()
+        payload = json.dumps({'type': 'ticker', 'product_id': 'BTC-USD',
+                              'time': '2019-01-07T23:41:39.000000Z'})
+        protocol.onMessage(payload.encode('utf8'), False)
+        message = client.on_message.call_args[0][0]
+        self.assertGreaterEqual(message['received'], before)
+        self.assertLessEqual(message['received'], time.time())
+
+        summary = monitor.summary()[('ticker', 'BTC-USD')]
+        self.assertEqual(summary['network']['count'], 1)
+        self.assertEqual(summary['handler']['count'], 1)
+
+        client.timestamps = False
+        protocol.onMessage(payload.encode('utf8'), False)
+        self.assertNotIn('received', client.on_message.call_args[0][0])
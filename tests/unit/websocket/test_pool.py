@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.websocket.pool` module."""
+
+import asyncio
+import json
+import os
+import time
+
+from asynctest import TestCase, CoroutineMock, MagicMock
+
+from copra.websocket import Channel, Client, ProcessPool
+from copra.websocket.client import ClientProtocol
+
+
+def processor(message):
+    if message['type'] == 'skip':
+        return None
+    if message['type'] == 'fail':
+        raise ValueError('processor failure')
+    if message['type'] == 'sleep':
+        time.sleep(30)
+    return (message['product_id'], message['sequence'], os.getpid())
+
+
+def payload(product_id, sequence, msg_type='match'):
+    return json.dumps({'type': msg_type, 'product_id': product_id,
+                       'sequence': sequence}).encode('utf8')
+
+
+class TestProcessPool(TestCase):
+    """Tests for copra.websocket.ProcessPool"""
+
+    def test__init__(self):
+        pool = ProcessPool(processor, workers=3, decoder='json')
+        self.assertIs(pool.processor, processor)
+        self.assertEqual(pool.workers, 3)
+        self.assertEqual(pool.decoder, 'json')
+        self.assertFalse(pool.started)
+        self.assertGreater(ProcessPool(processor).workers, 0)
+
+    def test_worker_for(self):
+        pool = ProcessPool(processor, workers=4)
+        index = pool.worker_for('BTC-USD')
+        self.assertIn(index, range(4))
+        self.assertEqual(pool.worker_for('BTC-USD'), index)
+
+    def test_submit_not_started(self):
+        pool = ProcessPool(processor, workers=2)
+        self.assertFalse(pool.submit(payload('BTC-USD', 1)))
+
+    async def test_pool(self):
+        records = []
+        pool = ProcessPool(processor, workers=2)
+        pool.start(self.loop, records.append)
+        self.assertTrue(pool.started)
+        try:
+            products = ['BTC-USD', 'ETH-USD', 'LTC-USD', 'BCH-USD']
+            for sequence in range(50):
+                for product_id in products:
+                    self.assertTrue(pool.submit(payload(product_id, sequence)))
+            self.assertTrue(pool.submit(payload('BTC-USD', 50, 'skip')))
+            self.assertTrue(pool.submit(payload('BTC-USD', 51, 'fail')))
+            self.assertFalse(pool.submit(b'{"type": "subscriptions"}'))
+            self.assertEqual(pool.submitted, 202)
+
+            for _ in range(500):
+                if len(records) == 200:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await pool.close()
+        self.assertFalse(pool.started)
+
+        self.assertEqual(len(records), 200)
+        self.assertEqual(pool.records, 200)
+        for product_id in products:
+            product_records = [r for r in records if r[0] == product_id]
+            # in order and all in the same worker
+            self.assertEqual([r[1] for r in product_records], list(range(50)))
+            self.assertEqual(len(set(r[2] for r in product_records)), 1)
+            self.assertNotEqual(product_records[0][2], os.getpid())
+
+    async def test_slow_worker(self):
+        pool = ProcessPool(processor, workers=1)
+        pool.start(self.loop, lambda record: None)
+        pool.submit(payload('BTC-USD', 1, 'sleep'))
+        await asyncio.sleep(0.1)
+
+        # more than the pipe holds, without blocking the loop
+        filler = payload('BTC-USD', 2).rstrip(b'}') + b', "x": "' + \
+            b'x' * 100000 + b'"}'
+        started = time.monotonic()
+        for _ in range(20):
+            pool.submit(filler)
+            pool._flush()
+        self.assertLess(time.monotonic() - started, 1.0)
+
+        # the worker is terminated after the timeout, and the loop runs
+        # meanwhile
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0.01)
+
+        ticker = self.loop.create_task(tick())
+        with self.assertLogs('copra.websocket.pool'):
+            await pool.close(timeout=0.3)
+        ticker.cancel()
+        self.assertGreater(len(ticks), 5)
+        self.assertFalse(pool.started)
+
+
+class TestClientPool(TestCase):
+    """Tests for the pool option of copra.websocket.Client"""
+
+    async def test_client_pool(self):
+        pool = MagicMock()
+        pool.close = CoroutineMock()
+        pool.submit = MagicMock(side_effect=lambda payload: b'product_id' in payload)
+        client = Client(self.loop, Channel('matches', 'BTC-USD'),
+                        auto_connect=False, pool=pool)
+        pool.start.assert_called_with(self.loop, client.on_record)
+        client.on_message = MagicMock()
+
+        protocol = ClientProtocol()
+        protocol.factory = client
+        protocol.onMessage(payload('BTC-USD', 1), False)
+        pool.submit.assert_called_with(payload('BTC-USD', 1))
+        client.on_message.assert_not_called()
+        protocol.onMessage(b'{"type": "subscriptions"}', False)
+        client.on_message.assert_called_with({'type': 'subscriptions'})
+
+        client.protocol.sendClose = MagicMock(side_effect=lambda: client.disconnected.set())
+        await client.close()
+        pool.close.assert_called_with()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.websocket.queue` module."""
+
+import asyncio
+
+from asynctest import TestCase, MagicMock
+
+from copra.websocket import Channel, Client, MessageQueue
+
+
+def msg(n, msg_type='ticker', product_id='BTC-USD'):
+    return {'type': msg_type, 'product_id': product_id, 'n': n}
+
+
+class TestMessageQueue(TestCase):
+    """Tests for copra.websocket.MessageQueue"""
+
+    def setUp(self):
+        self.client = MagicMock()
+
+    def test__init__(self):
+        queue = MessageQueue(self.client)
+        self.assertEqual(queue.maxsize, 1000)
+        self.assertEqual(queue.policy, 'block')
+        self.assertEqual(len(queue), 0)
+        self.assertFalse(queue.closed)
+
+        with self.assertRaises(ValueError):
+            MessageQueue(self.client, maxsize=0)
+
+        with self.assertRaises(ValueError):
+            MessageQueue(self.client, policy='drop-everything')
+
+    async def test_get(self):
+        queue = MessageQueue(self.client, maxsize=10)
+        queue.put(msg(1))
+        queue.put(msg(2))
+        self.assertEqual(len(queue), 2)
+        self.assertEqual((await queue.get())['n'], 1)
+        self.assertEqual((await queue.get())['n'], 2)
+
+        task = self.loop.create_task(queue.get())
+        await asyncio.sleep(0)
+        self.assertFalse(task.done())
+        queue.put(msg(3))
+        self.assertEqual((await task)['n'], 3)
+        self.assertEqual(queue.received, 3)
+        self.assertEqual(queue.high_water, 2)
+
+    async def test_async_for(self):
+        queue = MessageQueue(self.client, maxsize=10)
+        for n in range(3):
+            queue.put(msg(n))
+        queue.close()
+        self.client._remove_queue.assert_called_with(queue)
+        # ignored once closed
+        queue.put(msg(4))
+        received = []
+        async for message in queue:
+            received.append(message['n'])
+        self.assertEqual(received, [0, 1, 2])
+
+        with self.assertRaises(EOFError):
+            await queue.get()
+
+    async def test_drop_oldest(self):
+        queue = MessageQueue(self.client, maxsize=2, policy='drop-oldest')
+        for n in range(5):
+            queue.put(msg(n))
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.dropped, 3)
+        self.assertEqual((await queue.get())['n'], 3)
+        self.assertEqual((await queue.get())['n'], 4)
+
+    async def test_drop_newest(self):
+        queue = MessageQueue(self.client, maxsize=2, policy='drop-newest')
+        for n in range(5):
+            queue.put(msg(n))
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.dropped, 3)
+        self.assertEqual((await queue.get())['n'], 0)
+        self.assertEqual((await queue.get())['n'], 1)
+
+    async def test_conflate(self):
+        queue = MessageQueue(self.client, maxsize=2, policy='conflate')
+        queue.put(msg(0))
+        queue.put(msg(1, product_id='ETH-USD'))
+        queue.put(msg(2))
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.conflated, 1)
+        self.assertEqual(queue.dropped, 0)
+        # full of other keys, drop the oldest
+        queue.put(msg(3, product_id='LTC-USD'))
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual((await queue.get())['n'], 1)
+        self.assertEqual((await queue.get())['n'], 3)
+        # same product, different type
+        queue.put(msg(4))
+        queue.put(msg(5, msg_type='heartbeat'))
+        self.assertEqual(len(queue), 2)
+
+    async def test_block(self):
+        queue = MessageQueue(self.client, maxsize=4, policy='block')
+        for n in range(3):
+            queue.put(msg(n))
+        self.client._pause_reading.assert_not_called()
+        queue.put(msg(3))
+        self.client._pause_reading.assert_called_once_with(queue)
+        # messages already read are never dropped
+        queue.put(msg(4))
+        self.assertEqual(len(queue), 5)
+        self.assertEqual(queue.dropped, 0)
+        self.assertEqual(queue.blocked, 1)
+
+        for n in range(2):
+            await queue.get()
+        self.client._resume_reading.assert_not_called()
+        await queue.get()
+        self.client._resume_reading.assert_called_once_with(queue)
+
+
+class TestClientMessages(TestCase):
+    """Tests for copra.websocket.Client.messages"""
+
+    async def test_messages(self):
+        client = Client(self.loop, Channel('ticker', 'BTC-USD'), auto_connect=False)
+        client.on_message = MagicMock()
+        queue = client.messages(maxsize=10, msg_type='ticker')
+        self.assertIsInstance(queue, MessageQueue)
+        client._process_message(msg(1))
+        client._process_message(msg(2, msg_type='heartbeat'))
+        self.assertEqual(len(queue), 1)
+        queue.close()
+        self.assertEqual(client._queues, {})
+        self.assertEqual(client._dispatch.handlers, {})
+
+    def test_pause_reading(self):
+        client = Client(self.loop, Channel('ticker', 'BTC-USD'), auto_connect=False)
+        transport = client.protocol.transport = MagicMock()
+        client._pause_reading('a')
+        client._pause_reading('b')
+        transport.pause_reading.assert_called_once_with()
+        client._resume_reading('a')
+        transport.resume_reading.assert_not_called()
+        client._resume_reading('b')
+        transport.resume_reading.assert_called_once_with()
+
+    async def test_close(self):
+        client = Client(self.loop, Channel('ticker', 'BTC-USD'), auto_connect=False)
+        client.protocol.sendClose = MagicMock(side_effect=lambda: client.disconnected.set())
+        queue = client.messages()
+        await client.close()
+        self.assertTrue(queue.closed)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.websocket.recorder` module."""
+
+import json
+import os
+import shutil
+import tempfile
+
+from asynctest import ANY, TestCase, MagicMock
+
+from copra.websocket import Channel, Client, Recorder
+from copra.websocket.client import ClientProtocol
+from copra.websocket.recorder import read, read_index, segments
+
+
+def payload(n):
+    return json.dumps({'type': 'match', 'product_id': 'BTC-USD',
+                       'sequence': n, 'price': '6500.00'}).encode('utf8')
+
+
+class TestRecorder(TestCase):
+    """Tests for copra.websocket.Recorder"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_record(self):
+        path = os.path.join(self.directory, 'new')
+        with Recorder(path, block_size=10) as recorder:
+            for n in range(95):
+                recorder.record(payload(n), connection_id=n % 2,
+                                wall_time=1000.0 + n, monotonic_time=5.0 + n)
+        self.assertTrue(recorder.closed)
+        self.assertEqual(recorder.recorded, 95)
+        self.assertEqual(recorder.written, 95)
+        # ignored once closed
+        recorder.record(payload(95))
+        self.assertEqual(recorder.recorded, 95)
+
+        entries = list(read(path))
+        self.assertEqual(len(entries), 95)
+        self.assertEqual(entries[3].payload, payload(3))
+        self.assertEqual(entries[3].wall_time, 1003.0)
+        self.assertEqual(entries[3].monotonic_time, 8.0)
+        self.assertEqual(entries[3].connection_id, 1)
+
+        # sparse index: one record per block
+        index = read_index(segments(path)[0])
+        self.assertEqual(len(index), 10)
+        self.assertEqual(index[0][:2], (1000.0, 1009.0))
+        self.assertEqual(index[-1][3], 5)
+
+        # compressed
+        size = sum(os.path.getsize(p + '.seg') for p in segments(path))
+        self.assertEqual(size, recorder.bytes_written)
+        self.assertLess(size, sum(len(payload(n)) for n in range(95)))
+
+    def test_read_range(self):
+        with Recorder(self.directory, block_size=10) as recorder:
+            for n in range(100):
+                recorder.record(payload(n), wall_time=1000.0 + n)
+        entries = list(read(self.directory, start=1025.0, end=1034.0))
+        self.assertEqual([e.wall_time for e in entries],
+                         [1000.0 + n for n in range(25, 35)])
+        self.assertEqual(list(read(self.directory, start=2000)), [])
+
+    def test_segments(self):
+        with Recorder(self.directory, block_size=10, segment_size=1) as recorder:
+            for n in range(30):
+                recorder.record(payload(n), wall_time=1000.0)
+        self.assertEqual(len(segments(self.directory)), 3)
+        self.assertEqual([json.loads(e.payload.decode('utf8'))['sequence']
+                          for e in read(self.directory)], list(range(30)))
+
+    def test_flush_interval(self):
+        recorder = Recorder(self.directory, flush_interval=0.01)
+        recorder.record(payload(1))
+        for _ in range(200):
+            if recorder.written:
+                break
+            recorder._thread.join(0.01)
+        self.assertEqual(recorder.written, 1)
+        self.assertEqual(len(list(read(self.directory))), 1)
+        recorder.close()
+
+    def test_client(self):
+        recorder = MagicMock()
+        client = Client(self.loop, Channel('matches', 'BTC-USD'),
+                        auto_connect=False, recorder=recorder)
+        client.on_message = MagicMock()
+        client.protocol.sendMessage = MagicMock()
+        self.assertEqual(client.connection_id, 0)
+        client.on_open()
+        self.assertGreater(client.connection_id, 0)
+        protocol = ClientProtocol()
+        protocol.factory = client
+        protocol.onMessage(payload(1), False)
+        recorder.record.assert_called_with(payload(1), client.connection_id,
+                                           ANY, ANY)
+        client.on_message.assert_called_with(json.loads(payload(1).decode('utf8')))
+
+        connection_id = client.connection_id
+        client.on_open()
+        self.assertNotEqual(client.connection_id, connection_id)
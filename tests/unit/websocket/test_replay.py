@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.websocket.replay` module."""
+
+import json
+import shutil
+import tempfile
+
+from asynctest import TestCase, CoroutineMock, MagicMock, patch
+
+from copra.websocket import Channel, Client, Recorder, Replayer
+from copra.websocket.recorder import Entry
+
+
+def payload(n, msg_type='match'):
+    return json.dumps({'type': msg_type, 'product_id': 'BTC-USD',
+                       'sequence': n}).encode('utf8')
+
+
+def entries(count, interval=1.0):
+    return [Entry(1000.0 + n * interval, 10.0 + n * interval, 1, payload(n))
+            for n in range(count)]
+
+
+class TestReplayer(TestCase):
+    """Tests for copra.websocket.Replayer"""
+
+    def setUp(self):
+        self.client = Client(self.loop, Channel('matches', 'BTC-USD'),
+                             auto_connect=False)
+        self.received = []
+        self.client.on_message = self.received.append
+
+    def test__init__(self):
+        replayer = Replayer(self.client, [])
+        self.assertIs(replayer.client, self.client)
+        self.assertIsNone(replayer.speed)
+        self.assertEqual(replayer.rate, 0.0)
+
+        with self.assertRaises(ValueError):
+            Replayer(self.client, [], speed=0)
+
+    async def test_run(self):
+        self.client.on_error = MagicMock()
+        source = entries(5)
+        source.append(Entry(1005.0, 15.0, 1, json.dumps(
+            {'type': 'error', 'message': 'oops'}).encode('utf8')))
+        replayer = Replayer(self.client, source, yield_every=2)
+        self.assertEqual(await replayer.run(), 6)
+        self.assertEqual([m['sequence'] for m in self.received], list(range(5)))
+        self.client.on_error.assert_called_with('oops', '')
+        self.assertEqual(replayer.messages, 6)
+        self.assertGreater(replayer.elapsed, 0)
+        self.assertGreater(replayer.rate, 0)
+
+    async def test_run_range(self):
+        replayer = Replayer(self.client, entries(10), start=1002.0, end=1004.0)
+        await replayer.run()
+        self.assertEqual([m['sequence'] for m in self.received], [2, 3, 4])
+
+    async def test_run_speed(self):
+        source = entries(4, interval=2.0)
+        # a second session with an unrelated monotonic clock
+        source.append(Entry(2000.0, 1.0, 2, payload(4)))
+        source.append(Entry(2001.0, 2.0, 2, payload(5)))
+        replayer = Replayer(self.client, source, speed=4)
+        with patch('asyncio.sleep', new=CoroutineMock()) as mock_sleep:
+            self.loop.time = MagicMock(return_value=100.0)
+            await replayer.run()
+        delays = [round(c[0][0], 6) for c in mock_sleep.call_args_list]
+        self.assertEqual(delays, [0.5, 1.0, 1.5, 0.25])
+        self.assertEqual(len(self.received), 6)
+
+    async def test_run_recording(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with Recorder(directory) as recorder:
+            for entry in entries(20):
+                recorder.record(entry.payload, entry.connection_id,
+                                entry.wall_time, entry.monotonic_time)
+        replayer = Replayer(self.client, directory, end=1009.0)
+        self.assertEqual(await replayer.run(), 10)
+        self.assertEqual([m['sequence'] for m in self.received], list(range(10)))
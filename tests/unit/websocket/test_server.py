@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.websocket.server` module."""
+
+import asyncio
+import json
+
+from asynctest import TestCase, MagicMock
+
+from copra.websocket import Channel, Client
+from copra.websocket.recorder import Entry
+from copra.websocket.server import FeedServer, frame
+
+
+class Collector(Client):
+
+    def __init__(self, *args, **kwargs):
+        self.received = []
+        self.errors = []
+        super().__init__(*args, **kwargs)
+
+    def on_message(self, message):
+        self.received.append(message)
+
+    def on_error(self, message, reason=''):
+        self.errors.append((message, reason))
+
+
+class TestFeedServer(TestCase):
+    """Tests for copra.websocket.server.FeedServer"""
+
+    async def serve(self, **kwargs):
+        server = FeedServer(self.loop, seed=0, **kwargs)
+        await server.start()
+        self.addCleanup(server.close)
+        return server
+
+    async def connect(self, server, channels, **kwargs):
+        client = Collector(self.loop, channels, feed_url=server.url, **kwargs)
+        self.addCleanup(self.close_client, client)
+        await client.connected.wait()
+        return client
+
+    async def close_client(self, client):
+        if client.connected.is_set():
+            await client.close()
+        client.closing = True
+
+    async def wait_for(self, client, count, timeout=5.0):
+        for _ in range(int(timeout / 0.01)):
+            if len(client.received) >= count:
+                return
+            await asyncio.sleep(0.01)
+        self.fail('received {} of {} messages'.format(len(client.received),
+                                                      count))
+
+    def test_frame(self):
+        self.assertEqual(frame(b'abc'), b'\x81\x03abc')
+        self.assertEqual(frame(b'a' * 200)[:4], b'\x81\x7e\x00\xc8')
+        self.assertEqual(frame(b'a' * 70000)[:10],
+                         b'\x81\x7f\x00\x00\x00\x00\x00\x01\x11\x70')
+
+    def test_synthetic(self):
+        server = FeedServer(self.loop, gap_every=3, seed=0)
+        pairs = [('full', 'BTC-USD'), ('ticker', 'BTC-USD'),
+                 ('full', 'ETH-USD')] * 2
+        messages = [json.loads(p.decode()) for p in server.synthetic(pairs)]
+        self.assertEqual([(m['type'], m['product_id'], m['sequence'])
+                          for m in messages],
+                         [('open', 'BTC-USD', 1), ('ticker', 'BTC-USD', 1),
+                          ('open', 'ETH-USD', 1), ('done', 'BTC-USD', 2),
+                          ('ticker', 'BTC-USD', 2), ('done', 'ETH-USD', 2)])
+
+        messages = server.synthetic([('full', 'BTC-USD')])
+        self.assertEqual(json.loads(messages[0].decode())['sequence'], 4)
+
+        server.gap('ETH-USD', 5)
+        message = json.loads(server.synthetic([('matches', 'ETH-USD')])[0])
+        self.assertEqual(message['sequence'], 7)
+        snapshot = json.loads(server.snapshot('ETH-USD').decode())
+        self.assertEqual(snapshot['type'], 'snapshot')
+        self.assertEqual(len(snapshot['bids']), 50)
+        self.assertLess(float(snapshot['bids'][0][0]),
+                        float(snapshot['asks'][0][0]))
+
+    def test_synthetic_mixed_channels(self):
+        server = FeedServer(self.loop, gap_every=4, seed=0)
+        pairs = [('full', 'BTC-USD'), ('heartbeat', 'BTC-USD')] * 20
+        sequences = [json.loads(p.decode())['sequence']
+                     for p in server.synthetic(pairs)[::2]]
+        self.assertEqual(sequences, [n + n // 4 for n in range(1, 21)])
+
+    async def test_start(self):
+        server = await self.serve()
+        self.assertNotEqual(server.port, 0)
+        self.assertEqual(server.url, 'ws://127.0.0.1:{}'.format(server.port))
+
+    async def test_subscribe(self):
+        server = await self.serve(batch_size=10)
+        client = await self.connect(
+            server, [Channel('full', ['BTC-USD', 'ETH-USD']),
+                     Channel('level2', 'BTC-USD')])
+        await self.wait_for(client, 200)
+
+        subscriptions = client.received[0]
+        self.assertEqual(subscriptions['type'], 'subscriptions')
+        self.assertEqual(subscriptions['channels'],
+                         [{'name': 'full', 'product_ids': ['BTC-USD', 'ETH-USD']},
+                          {'name': 'level2', 'product_ids': ['BTC-USD']}])
+        types = [msg['type'] for msg in client.received]
+        self.assertLess(types.index('snapshot'), types.index('l2update'))
+        self.assertIn('open', types)
+        self.assertIn('done', types)
+
+        for product_id in ('BTC-USD', 'ETH-USD'):
+            sequences = [msg['sequence'] for msg in client.received
+                         if msg.get('product_id') == product_id and
+                         msg['type'] in ('open', 'done')]
+            self.assertEqual(sequences,
+                             list(range(1, len(sequences) + 1)))
+        self.assertEqual(len(server.connections), 1)
+        self.assertGreaterEqual(server.sent, 200)
+
+        client.unsubscribe(Channel('level2', 'BTC-USD'))
+        await asyncio.sleep(0.1)
+        self.assertIn({'type': 'subscriptions', 'channels': [
+            {'name': 'full', 'product_ids': ['BTC-USD', 'ETH-USD']}]},
+            client.received)
+
+    async def test_subscribe_error(self):
+        server = await self.serve()
+        client = await self.connect(server, [])
+        client.protocol.sendMessage(json.dumps(
+            {'type': 'subscribe', 'product_ids': ['BTC-USD'],
+             'channels': ['bogus']}).encode())
+        for _ in range(100):
+            if client.errors:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(client.errors,
+                         [('Failed to subscribe', 'bogus is not a valid channel')])
+
+        client.protocol.sendMessage(json.dumps({'type': 'wrong'}).encode())
+        client.protocol.sendMessage(b'not json')
+        await asyncio.sleep(0.1)
+        self.assertEqual(client.errors[1:], [
+            ('Failed to subscribe',
+             'Type has to be either subscribe or unsubscribe'),
+            ('Failed to subscribe', 'Malformed JSON')])
+        self.assertEqual(server.sent, 0)
+
+    async def test_source(self):
+        payloads = [json.dumps({'type': 'match', 'product_id': 'BTC-USD',
+                                'sequence': n}).encode() for n in range(50)]
+        source = [Entry(0.0, 0.0, 1, p) for p in payloads[:25]] + payloads[25:]
+        server = await self.serve(source=source, batch_size=7)
+        client = await self.connect(server, Channel('matches', 'BTC-USD'))
+        await self.wait_for(client, 51)
+        await asyncio.sleep(0.05)
+        self.assertEqual([msg['sequence'] for msg in client.received[1:]],
+                         list(range(50)))
+        self.assertEqual(server.sent, 50)
+
+    async def test_rate(self):
+        server = await self.serve(rate=1000)
+        client = await self.connect(server, Channel('ticker', 'BTC-USD'))
+        await asyncio.sleep(0.3)
+        self.assertGreater(server.sent, 100)
+        self.assertLess(server.sent, 600)
+        self.assertEqual(client.received[-1]['type'], 'ticker')
+
+    async def test_faults(self):
+        server = await self.serve(gap_every=10, error_every=30,
+                                  disconnect_every=100, batch_size=4)
+        client = await self.connect(server, Channel('full', 'BTC-USD'),
+                                    reconnect_jitter=0)
+        client._check_sequence = MagicMock(wraps=client._check_sequence)
+        await self.wait_for(client, 250)
+
+        sequences = [msg['sequence'] for msg in client.received
+                     if msg['type'] in ('open', 'done')]
+        self.assertIn(11, sequences)
+        self.assertNotIn(10, sequences)
+        self.assertIn(('Injected error', 'error_every'), client.errors)
+        self.assertGreaterEqual(client.reconnect_stats.reconnects, 1)
+
+        server.disconnect_every = None
+        server.drop_connections()
+        await asyncio.sleep(0.1)
+        await client.connected.wait()
+        reconnects = client.reconnect_stats.reconnects
+
+        server.send_error('Oops', 'manual')
+        await asyncio.sleep(0.1)
+        self.assertIn(('Oops', 'manual'), client.errors)
+
+        server.drop_connections()
+        await asyncio.sleep(0.1)
+        self.assertEqual(client.reconnect_stats.reconnects, reconnects + 1)
+
+    async def test_compression(self):
+        server = await self.serve(compression=True, batch_size=10)
+        plain = await self.connect(server, Channel('full', 'BTC-USD'))
+        client = await self.connect(server, Channel('full', 'BTC-USD'),
+                                    compression=True,
+                                    compression_window_bits=10)
+        await self.wait_for(plain, 100)
+        await self.wait_for(client, 100)
+
+        self.assertIsNone(plain.compression_stats.negotiated)
+        self.assertEqual(plain.compression_stats.messages, 0)
+        self.assertEqual(plain.compression_stats.ratio(), 1.0)
+
+        stats = client.compression_stats
+        self.assertEqual(stats.negotiated['server_max_window_bits'], 10)
+        self.assertEqual(client.received[1]['type'], 'open')
+        self.assertGreaterEqual(stats.messages, 100)
+        self.assertLess(stats.ratio(), 0.8)
+        self.assertGreaterEqual(stats.cpu_time, 0.0)
+        self.assertIsNotNone(stats.cpu_per_message())
+
+        # the totals survive reconnects
+        received = stats.uncompressed_bytes
+        server.drop_connections()
+        await asyncio.sleep(0.1)
+        await client.connected.wait()
+        self.assertGreaterEqual(stats.uncompressed_bytes, received)
+        self.assertIsNotNone(stats.negotiated)
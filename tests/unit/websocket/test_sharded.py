@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.websocket.sharded` module."""
+
+from asynctest import TestCase, CoroutineMock, MagicMock, patch
+
+from copra.websocket import Channel, Client, ShardedClient
+
+
+class TestShardedClient(TestCase):
+    """Tests for copra.websocket.ShardedClient"""
+
+    def setUp(self):
+        self.channels = [Channel('level2', ['BTC-USD', 'ETH-USD', 'LTC-USD', 'BCH-USD']),
+                         Channel('heartbeat', ['BTC-USD', 'ETH-USD'])]
+
+    def test__init__(self):
+        client = ShardedClient(self.loop, self.channels, shards=3,
+                               auto_connect=False, name='Test')
+        self.assertEqual(len(client.shards), 3)
+        for i, shard in enumerate(client.shards):
+            self.assertIsInstance(shard, Client)
+            self.assertEqual(shard.name, 'Test shard {}'.format(i))
+            self.assertFalse(shard.auto_connect)
+
+        # each product is on exactly one shard
+        for product_id in ('BTC-USD', 'ETH-USD', 'LTC-USD', 'BCH-USD'):
+            shards = [shard for shard in client.shards
+                      if 'level2' in shard.channels and
+                      product_id in shard.channels['level2'].product_ids]
+            self.assertEqual(shards, [client.shard_for(product_id)])
+
+        self.assertEqual(client.channels['level2'], self.channels[0])
+        self.assertEqual(client.channels['heartbeat'], self.channels[1])
+
+        # stable assignment
+        other = ShardedClient(self.loop, self.channels, shards=3, auto_connect=False)
+        for product_id in ('BTC-USD', 'ETH-USD', 'LTC-USD', 'BCH-USD'):
+            self.assertEqual(client._shard_of[product_id], other._shard_of[product_id])
+
+        with self.assertRaises(ValueError):
+            ShardedClient(self.loop, self.channels, shards=0, auto_connect=False)
+
+    def test_weights(self):
+        weights = {'BTC-USD': 10, 'ETH-USD': 6, 'LTC-USD': 3}
+        client = ShardedClient(self.loop, self.channels, shards=2,
+                               weights=weights, auto_connect=False)
+        self.assertEqual(client._shard_of['ETH-USD'], client._shard_of['LTC-USD'])
+        self.assertEqual(client._shard_of['ETH-USD'], client._shard_of['BCH-USD'])
+        self.assertNotEqual(client._shard_of['BTC-USD'], client._shard_of['ETH-USD'])
+        self.assertEqual(sorted(client._loads), [10, 10])
+
+        # new products go to the lightest shard
+        client.subscribe(Channel('ticker', 'ETH-EUR'))
+        self.assertEqual(sorted(client._loads), [10, 11])
+
+    def test_subscribe(self):
+        client = ShardedClient(self.loop, self.channels, shards=2, auto_connect=False)
+        client.subscribe(Channel('ticker', ['BTC-USD', 'LTC-USD']))
+        self.assertIn('BTC-USD', client.shard_for('BTC-USD').channels['ticker'].product_ids)
+        self.assertIn('LTC-USD', client.shard_for('LTC-USD').channels['ticker'].product_ids)
+        self.assertEqual(client.channels['ticker'], Channel('ticker', ['BTC-USD', 'LTC-USD']))
+
+        client.unsubscribe([Channel('ticker', ['BTC-USD', 'LTC-USD']),
+                            Channel('heartbeat', 'BTC-USD')])
+        self.assertNotIn('ticker', client.channels)
+        self.assertEqual(client.channels['heartbeat'], Channel('heartbeat', 'ETH-USD'))
+
+    def test_on(self):
+        client = ShardedClient(self.loop, self.channels, shards=2, auto_connect=False)
+        client.on_message = MagicMock()
+        handler = MagicMock()
+        client.on('l2update', handler, product_id='BTC-USD')
+        client.on(None, handler)
+        shard = client.shard_for('BTC-USD')
+        self.assertEqual(shard._dispatch.handlers, {('l2update', 'BTC-USD'): [handler],
+                                           (None, None): [handler]})
+        for other in client.shards:
+            if other is not shard:
+                self.assertEqual(other._dispatch.handlers, {(None, None): [handler]})
+
+        # messages are passed on to the sharded client's on_message
+        msg = {'type': 'l2update', 'product_id': 'BTC-USD'}
+        shard._process_message(msg)
+        self.assertEqual(handler.call_count, 2)
+        client.on_message.assert_called_with(msg)
+
+        client.off('l2update', handler, product_id='BTC-USD')
+        client.off(None, handler)
+        for other in client.shards:
+            self.assertEqual(other._dispatch.handlers, {})
+
+    def test_on_error(self):
+        client = ShardedClient(self.loop, self.channels, shards=2, auto_connect=False)
+        client.on_error = MagicMock()
+        client.shards[1].on_error('oops', 'because')
+        client.on_error.assert_called_with('oops', 'because')
+
+    def test_add_as_task_to_loop(self):
+        with patch('copra.websocket.client.Client.add_as_task_to_loop') as mock_attl:
+            client = ShardedClient(self.loop, self.channels, shards=3)
+            used = len([shard for shard in client.shards if shard.channels])
+            self.assertEqual(mock_attl.call_count, used)
+            client.add_as_task_to_loop()
+            self.assertEqual(mock_attl.call_count, 2 * used)
+
+    def test_empty_shard(self):
+        channel = Channel('ticker', ['BTC-USD', 'ETH-USD', 'LTC-USD'])
+        client = ShardedClient(self.loop, channel, shards=3,
+                               auto_connect=False)
+        empty = [shard for shard in client.shards if not shard.channels]
+        self.assertTrue(empty)
+        for shard in client.shards:
+            shard.add_as_task_to_loop = MagicMock()
+
+        # empty shards aren't connected
+        client.add_as_task_to_loop()
+        for shard in client.shards:
+            self.assertEqual(shard.add_as_task_to_loop.call_count,
+                             1 if shard.channels else 0)
+
+        # until they are subscribed to something
+        product_id = next(product_id for product_id in
+                          ('BCH-USD', 'ETH-EUR', 'LTC-EUR', 'BTC-EUR', 'ETC-USD')
+                          if client.shard_for(product_id) is empty[0])
+        client.subscribe(Channel('ticker', product_id))
+        empty[0].add_as_task_to_loop.assert_called_once_with()
+        client.subscribe(Channel('heartbeat', product_id))
+        empty[0].add_as_task_to_loop.assert_called_once_with()
+
+    async def test_pool(self):
+        pool = MagicMock()
+        pool.close = CoroutineMock()
+        client = ShardedClient(self.loop, self.channels, shards=2,
+                               auto_connect=False, pool=pool)
+        pool.start.assert_called_once_with(self.loop, client.on_record)
+        for shard in client.shards:
+            self.assertIs(shard.pool, pool)
+
+        # records go to the sharded client
+        client.on_record = MagicMock()
+        client.shards[1].on_record('record')
+        client.on_record.assert_called_once_with('record')
+
+        # closing the shards doesn't close the shared pool
+        await client.shards[0].close()
+        pool.close.assert_not_called()
+        await client.close()
+        pool.close.assert_called_once_with()
+
+    async def test_close(self):
+        client = ShardedClient(self.loop, self.channels, shards=2, auto_connect=False)
+        for shard in client.shards:
+            shard.close = CoroutineMock()
+        await client.close()
+        for shard in client.shards:
+            shard.close.assert_called_with()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.websocket.watchdog` module."""
+
+import asyncio
+import json
+
+from asynctest import TestCase, MagicMock, patch
+
+from copra.websocket import Channel, Client, FeedServer, Watchdog
+
+
+class TestWatchdog(TestCase):
+    """Tests for copra.websocket.Watchdog"""
+
+    def setUp(self):
+        self.client = Client(self.loop, [Channel('full', ['BTC-USD', 'ETH-USD']),
+                                         Channel('ticker', 'BTC-USD')],
+                             auto_connect=False)
+        self.client.on_message = MagicMock()
+        self.client.protocol = MagicMock()
+        self.client.connected.set()
+        self.client.connection_id = 1
+        self.watchdog = Watchdog(timeout=5.0)
+        self.watchdog.attach(self.client)
+        self.addCleanup(self.watchdog.detach, self.client)
+
+    def message(self, product_id, msg_type='heartbeat', now=0.0):
+        with patch('time.monotonic', return_value=now):
+            self.client._process_message({'type': msg_type,
+                                          'product_id': product_id})
+
+    def test__init__(self):
+        self.assertEqual(Watchdog().interval, 1.25)
+        self.assertEqual(Watchdog(interval=0.5).interval, 0.5)
+
+    def test_attach(self):
+        self.assertEqual(self.client.channels['heartbeat'],
+                         Channel('heartbeat', ['BTC-USD', 'ETH-USD']))
+        self.assertIsNotNone(self.watchdog._handle)
+
+        watchdog = Watchdog(heartbeat=False)
+        client = Client(self.loop, Channel('ticker', 'LTC-USD'),
+                        auto_connect=False)
+        watchdog.attach(client)
+        self.assertNotIn('heartbeat', client.channels)
+        watchdog.detach(client)
+        self.assertIsNone(watchdog._handle)
+        self.assertEqual(client._dispatch.handlers, {})
+
+    def test_process(self):
+        self.message('BTC-USD', 'heartbeat', now=3.0)
+        self.message('BTC-USD', 'ticker', now=4.0)
+        self.message(None, 'subscriptions', now=5.0)
+        self.assertEqual(self.watchdog.last_message, {'BTC-USD': 4.0})
+        self.assertEqual(self.watchdog.last_heartbeat, {'BTC-USD': 3.0})
+
+    def test_check_resubscribe(self):
+        self.watchdog.on_stale = MagicMock()
+        self.assertEqual(self.watchdog.check(now=100.0), [])
+        self.message('BTC-USD', now=104.0)
+        self.client._sequences['ETH-USD'] = 42
+        self.client.protocol.sendMessage.reset_mock()
+
+        self.assertEqual(self.watchdog.check(now=105.5), ['ETH-USD'])
+        self.assertTrue(self.watchdog.is_stale('ETH-USD'))
+        self.assertFalse(self.watchdog.is_stale('BTC-USD'))
+        self.watchdog.on_stale.assert_called_once_with('ETH-USD')
+        self.assertEqual(self.watchdog.resubscribes, 1)
+        self.assertEqual(self.client._sequences['ETH-USD'], 42)
+        sent = [json.loads(c[0][0].decode('utf8'))
+                for c in self.client.protocol.sendMessage.call_args_list]
+        self.assertEqual([msg['type'] for msg in sent],
+                         ['unsubscribe', 'subscribe'])
+        for msg in sent:
+            self.assertEqual(msg['channels'], [
+                {'name': 'full', 'product_ids': ['ETH-USD']},
+                {'name': 'heartbeat', 'product_ids': ['ETH-USD']}])
+        self.assertEqual(self.client.channels['full'],
+                         Channel('full', ['BTC-USD', 'ETH-USD']))
+
+        # another timeout before it is stale again
+        self.message('BTC-USD', now=108.0)
+        self.assertEqual(self.watchdog.check(now=109.0), [])
+        self.message('ETH-USD', now=109.5)
+        self.assertFalse(self.watchdog.is_stale('ETH-USD'))
+        self.client.protocol.dropConnection.assert_not_called()
+
+    async def test_resubscribe_window(self):
+        self.client.subscription_window = 0
+        self.client.protocol.sendMessage.reset_mock()
+        self.watchdog.resubscribe('ETH-USD')
+        await asyncio.sleep(0)
+        sent = [json.loads(c[0][0].decode('utf8'))['type']
+                for c in self.client.protocol.sendMessage.call_args_list]
+        self.assertEqual(sent, ['unsubscribe', 'subscribe'])
+
+    def test_check_reconnect(self):
+        self.watchdog.check(now=100.0)
+        self.assertEqual(self.watchdog.check(now=106.0),
+                         ['BTC-USD', 'ETH-USD'])
+        self.client.protocol.dropConnection.assert_called_once_with(abort=True)
+        self.assertEqual(self.watchdog.reconnects, 1)
+        self.assertEqual(self.watchdog.resubscribes, 0)
+
+        # a new connection gets a fresh timeout
+        self.client.connection_id = 2
+        self.assertEqual(self.watchdog.check(now=107.0), [])
+        self.assertEqual(self.watchdog.stale, set())
+        self.assertEqual(self.watchdog.check(now=111.0), [])
+
+        self.client.connected.clear()
+        self.assertEqual(self.watchdog.check(now=200.0), [])
+
+    async def test_half_open(self):
+        # The server sends a handful of messages and then goes quiet without
+        # closing the connection.
+        payloads = [json.dumps({'type': 'heartbeat', 'product_id': 'BTC-USD',
+                                'sequence': n}).encode() for n in range(3)]
+        server = FeedServer(self.loop, source=payloads)
+        await server.start()
+        self.addCleanup(server.close)
+
+        client = Client(self.loop, Channel('ticker', 'BTC-USD'),
+                        feed_url=server.url, reconnect_jitter=0)
+        client.on_message = MagicMock()
+        watchdog = Watchdog(timeout=0.1, interval=0.02)
+        watchdog.attach(client)
+        self.addCleanup(watchdog.detach, client)
+        self.addCleanup(client.close)
+
+        for _ in range(100):
+            if client.reconnect_stats.reconnects:
+                break
+            await asyncio.sleep(0.02)
+        self.assertGreaterEqual(watchdog.reconnects, 1)
+        self.assertGreaterEqual(client.reconnect_stats.reconnects, 1)
+        await client.connected.wait()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `copra.websocket.workers` module."""
+
+import asyncio
+
+from asynctest import TestCase, MagicMock
+
+from copra.websocket import Channel, Client, ProductWorkers
+
+
+def msg(n, msg_type='ticker', product_id='BTC-USD'):
+    return {'type': msg_type, 'product_id': product_id, 'n': n}
+
+
+class TestProductWorkers(TestCase):
+    """Tests for copra.websocket.ProductWorkers"""
+
+    def setUp(self):
+        self.client = Client(self.loop, Channel('ticker', 'BTC-USD'),
+                             auto_connect=False)
+        self.client.on_message = MagicMock()
+        self.workers = ProductWorkers(groups={'alts': ['LTC-USD', 'ETH-BTC']},
+                                      maxsize=10)
+        self.workers.attach(self.client)
+
+    async def tearDown(self):
+        if self.workers.client is not None:
+            self.workers.detach(self.client)
+        await self.workers.join()
+
+    def test_worker(self):
+        workers = self.workers
+        btc = workers.worker('BTC-USD')
+        self.assertEqual(btc.name, 'BTC-USD')
+        self.assertIs(workers.worker('BTC-USD'), btc)
+        self.assertIs(workers.worker('LTC-USD'), workers.worker('ETH-BTC'))
+        self.assertEqual(workers.worker('ETH-BTC').name, 'alts')
+        self.assertIsNone(workers.worker(None).name)
+        self.assertEqual(set(workers.workers), {'BTC-USD', 'alts', None})
+
+    async def test_order(self):
+        handled = []
+
+        async def handler(message):
+            await asyncio.sleep(0.001 * (3 - message['n']))
+            handled.append((message['product_id'], message['n']))
+
+        self.workers.on('ticker', handler)
+        for n in range(3):
+            self.client._process_message(msg(n))
+            self.client._process_message(msg(n, product_id='ETH-USD'))
+        self.workers.detach(self.client)
+        await self.workers.join()
+
+        # in order per product
+        self.assertEqual([n for product_id, n in handled
+                          if product_id == 'BTC-USD'], [0, 1, 2])
+        self.assertEqual([n for product_id, n in handled
+                          if product_id == 'ETH-USD'], [0, 1, 2])
+        # the products' handlers ran concurrently
+        self.assertEqual(handled[:2], [('BTC-USD', 0), ('ETH-USD', 0)])
+
+    async def test_slow_product(self):
+        release = asyncio.Event()
+        fast = []
+
+        async def slow(message):
+            await release.wait()
+
+        self.workers.on('ticker', slow, product_id='BTC-USD')
+        self.workers.on('ticker', fast.append, product_id='ETH-USD')
+        for n in range(3):
+            self.client._process_message(msg(n))
+            self.client._process_message(msg(n, product_id='ETH-USD'))
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(fast), 3)
+
+        stats = self.workers.stats()
+        self.assertEqual(stats['BTC-USD']['depth'], 2)
+        self.assertEqual(stats['BTC-USD']['handled'], 0)
+        self.assertEqual(stats['ETH-USD']['depth'], 0)
+        self.assertEqual(stats['ETH-USD']['handled'], 3)
+        self.assertEqual(stats['ETH-USD']['received'], 3)
+
+        release.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.workers.worker('BTC-USD').handled, 3)
+
+    async def test_errors(self):
+        def fail(message):
+            raise ValueError(message['n'])
+        handled = []
+        self.workers.on(None, fail)
+        self.workers.on('ticker', handled.append, product_id='BTC-USD')
+        with self.assertLogs('copra.websocket.workers'):
+            self.client._process_message(msg(1))
+            await asyncio.sleep(0.01)
+        self.assertEqual(handled, [msg(1)])
+        self.assertEqual(self.workers.worker('BTC-USD').errors, 1)
+
+        self.workers.off(None, fail)
+        with self.assertRaises(ValueError):
+            self.workers.off(None, fail)
+
+    async def test_detach(self):
+        handled = []
+        self.workers.on(None, handled.append)
+        self.client._process_message(msg(1))
+        self.workers.detach(self.client)
+        self.client._process_message(msg(2))
+        await self.workers.join()
+        self.assertEqual(handled, [msg(1)])
+        self.assertTrue(self.workers.worker('BTC-USD').task.done())
+
+    async def test_reattach(self):
+        handled = []
+        self.workers.on(None, handled.append)
+        self.client._process_message(msg(1))
+        self.workers.detach(self.client)
+        await self.workers.join()
+
+        self.workers.attach(self.client)
+        self.client._process_message(msg(2))
+        await asyncio.sleep(0.01)
+        self.assertEqual(handled, [msg(1), msg(2)])
+        self.assertEqual(self.workers.stats()['BTC-USD']['received'], 1)
+        self.assertFalse(self.workers.worker('BTC-USD').task.done())
+
+    async def test_policy(self):
+        release = asyncio.Event()
+
+        async def slow(message):
+            await release.wait()
+
+        self.workers.on('ticker', slow, product_id='BTC-USD')
+        self.client._pause_reading = MagicMock()
+        for n in range(15):
+            self.client._process_message(msg(n))
+        await asyncio.sleep(0.01)
+        stats = self.workers.stats()['BTC-USD']
+        release.set()
+        self.client._pause_reading.assert_not_called()
+        self.assertEqual(stats['depth'], 9)
+        self.assertEqual(stats['dropped'], 5)